@@ -0,0 +1,232 @@
+"""Offline batch analysis of the images_data capture archive.
+
+Walks a directory tree, runs the same detection, food filtering and
+nutrition logic as the capture page (`food_analysis`) and appends one JSON
+line per image to an index file. Images are grouped into batches for a single
+`predict` call each, and batches are spread over a process pool; every worker
+process loads the model once.
+
+The run is resumable: images already in the index with the same size and
+modification time are skipped, so an interrupted run can simply be started
+again. Images that failed are retried on the next run; images deleted while
+the run is in progress are skipped.
+
+Usage::
+
+    python batch_analyze.py                       # images_data -> images_data/analysis_index.jsonl
+    python batch_analyze.py images_data/ash_user3 --workers 4 --batch-size 16
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROOT = os.path.join(PROJECT_ROOT, 'images_data')
+DEFAULT_INDEX = os.path.join(DEFAULT_ROOT, 'analysis_index.jsonl')
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.webp')
+# the catalog of favourite options is not meal photos, and `blob_store` keeps a
+# second name for every capture (and linked catalog image) under blobs/
+SKIP_DIRS = {'favourites_option', 'favourites', 'blobs'}
+
+
+def iter_images(root: str) -> Iterator[str]:
+    """Yield meal images under `root`, skipping derived `*_annotated` files."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.startswith('.'))
+        for fname in sorted(filenames):
+            stem, ext = os.path.splitext(fname)
+            if ext.lower() in IMAGE_EXTS and not stem.endswith('_annotated'):
+                yield os.path.join(dirpath, fname)
+
+
+def _rel(path: str, root: str) -> str:
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def _user_for(rel_path: str) -> Optional[str]:
+    # images_data/<user>/food_to_analyse/...
+    parts = rel_path.split('/')
+    if len(parts) >= 3 and parts[1] == 'food_to_analyse':
+        return parts[0]
+    return None
+
+
+def load_done(index_path: str) -> Dict[str, Tuple[int, int]]:
+    """Map of relative path -> (size, mtime_ns) for successfully indexed images."""
+    done: Dict[str, Tuple[int, int]] = {}
+    if not os.path.exists(index_path):
+        return done
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # a line cut short by an interrupted run
+                continue
+            if rec.get('error'):
+                done.pop(rec.get('path'), None)
+            else:
+                done[rec['path']] = (rec.get('size'), rec.get('mtime_ns'))
+    return done
+
+
+def restat(paths: List[str], root: str = DEFAULT_ROOT, index_path: str = DEFAULT_INDEX) -> int:
+    """Carry the indexed results of `paths` over to their current size and mtime.
+
+    For images whose bytes were replaced by an equivalent encoding (see
+    `storage_maintenance`), so the next run does not analyse them again.
+    Returns the number of records appended.
+    """
+    if not os.path.exists(index_path):
+        return 0
+    root = os.path.abspath(root)
+    wanted = {_rel(os.path.abspath(p), root): p for p in paths}
+    latest: Dict[str, Dict[str, Any]] = {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get('path') in wanted:
+                latest[rec['path']] = rec
+    out = []
+    for rel, rec in latest.items():
+        if rec.get('error'):
+            continue
+        try:
+            st = os.stat(wanted[rel])
+        except OSError:
+            continue
+        if (rec.get('size'), rec.get('mtime_ns')) != (st.st_size, st.st_mtime_ns):
+            out.append(dict(rec, size=st.st_size, mtime_ns=st.st_mtime_ns))
+    if out:
+        with open(index_path, 'a', encoding='utf-8') as f:
+            for rec in out:
+                f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+    return len(out)
+
+
+def _init_worker() -> None:
+    # each process runs its own model; stop torch from oversubscribing the CPU
+    try:
+        import torch
+
+        torch.set_num_threads(1)
+    except Exception:
+        pass
+
+
+def analyze_chunk(paths: List[str], root: str) -> List[Dict[str, Any]]:
+    """Analyse one batch of images in a worker process and build index records."""
+    import food_analysis
+    import nutrition
+
+    records = []
+    try:
+        results: List[Any] = food_analysis.analyze_batch(paths)
+    except Exception:
+        # one unreadable image fails the whole batch; retry one by one to isolate it
+        results = []
+        for path in paths:
+            try:
+                results.append(food_analysis.analyze_image(path))
+            except Exception as e:
+                results.append(e)
+    # nutrition totals for the whole chunk in one matrix product
+    ok = [r for r in results if not isinstance(r, Exception)]
+    chunk_totals = iter(nutrition.batch_totals({k: v['count'] for k, v in r['summary'].items()} for r in ok).tolist())
+    for path, result in zip(paths, results):
+        rel = _rel(path, root)
+        try:
+            st = os.stat(path)
+        except OSError:
+            # removed while the batch ran (e.g. by storage retention); nothing to index
+            if not isinstance(result, Exception):
+                next(chunk_totals)
+            records.append({'path': rel, 'skipped': 'missing'})
+            continue
+        rec: Dict[str, Any] = {
+            'path': rel,
+            'user': _user_for(rel),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+        }
+        if isinstance(result, Exception):
+            rec['error'] = str(result) or type(result).__name__
+        else:
+            totals = dict(zip(nutrition.NUTRIENTS, next(chunk_totals)))
+            rec.update({
+                'has_food': result['has_food'],
+                'detections': [[lab, round(conf, 4)] for lab, conf in result['detections'].pairs()],
+                'summary': {k: v['count'] for k, v in result['summary'].items()},
+                'totals': {k: round(v, 1) for k, v in totals.items()},
+            })
+        records.append(rec)
+    return records
+
+
+def run(root: str, index_path: str, workers: int, batch_size: int, limit: Optional[int] = None) -> Dict[str, int]:
+    root = os.path.abspath(root)
+    done = load_done(index_path)
+    todo = []
+    skipped = 0
+    for path in iter_images(root):
+        try:
+            st = os.stat(path)
+        except OSError:
+            # gone since the directory was listed
+            continue
+        if done.get(_rel(path, root)) == (st.st_size, st.st_mtime_ns):
+            skipped += 1
+            continue
+        todo.append(path)
+        if limit is not None and len(todo) >= limit:
+            break
+
+    chunks = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    counts = {'skipped': skipped, 'analysed': 0, 'failed': 0, 'missing': 0}
+    if not chunks:
+        return counts
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    start = time.perf_counter()
+    with open(index_path, 'a', encoding='utf-8') as out, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(analyze_chunk, chunk, root) for chunk in chunks]
+        for fut in as_completed(futures):
+            for rec in fut.result():
+                if rec.get('skipped'):
+                    counts['missing'] += 1
+                    continue
+                out.write(json.dumps(rec, separators=(',', ':')) + '\n')
+                counts['failed' if rec.get('error') else 'analysed'] += 1
+            # flush per batch so an interrupted run keeps what it finished
+            out.flush()
+            n = counts['analysed'] + counts['failed'] + counts['missing']
+            print(f"{n}/{len(todo)} images ({n / (time.perf_counter() - start):.1f}/s)", file=sys.stderr)
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Analyse archived food images into a JSONL index.')
+    parser.add_argument('root', nargs='?', default=DEFAULT_ROOT, help='directory tree to scan (default: images_data)')
+    parser.add_argument('--index', default=DEFAULT_INDEX, help='JSONL index to write/resume (default: images_data/analysis_index.jsonl)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='worker processes')
+    parser.add_argument('--batch-size', type=int, default=8, help='images per predict call')
+    parser.add_argument('--limit', type=int, default=None, help='analyse at most this many new images')
+    args = parser.parse_args(argv)
+
+    counts = run(args.root, args.index, args.workers, max(1, args.batch_size), args.limit)
+    print(f"analysed {counts['analysed']}, failed {counts['failed']}, skipped {counts['skipped']} already indexed"
+          + (f", {counts['missing']} removed during the run" if counts.get('missing') else ''))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""Content-addressed blob store for images under images_data.
+
+Every image is stored once, under `images_data/blobs/<aa>/<sha256><ext>`.
+The places the app shows images from (`captures/`, `<user>/food_to_analyse/`,
+`<user>/favourites/`) hold references to blobs instead of their own copies:
+hard links where the filesystem supports them (no extra bytes on disk), else
+plain copies. A reference is always a regular file, so it stays readable
+whatever happens to the blob.
+
+A small SQLite database next to the blobs records which reference paths
+point at which blob. A blob with no references left is garbage and is
+removed by `collect_garbage()` once it is older than a grace period. Storing
+a blob again restarts its grace period, and `link()` checks the blob file
+under the same write lock as the collector, so a blob written by a request
+that has not linked it yet is never collected.
+
+Command line::
+
+    python blob_store.py migrate     # fold existing duplicate files into blobs
+    python blob_store.py gc          # delete unreferenced blobs
+    python blob_store.py stats
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_ROOT = os.environ.get('FOODLENS_DATA_ROOT', os.path.join(PROJECT_ROOT, 'images_data'))
+BLOB_DIR = os.path.join(DATA_ROOT, 'blobs')
+DB_PATH = os.path.join(BLOB_DIR, 'refs.sqlite3')
+# unreferenced blobs younger than this are left alone by gc
+GC_GRACE_SECONDS = 3600
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(
+                '''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS refs (
+                    path TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL REFERENCES blobs(digest)
+                );
+                CREATE INDEX IF NOT EXISTS refs_digest ON refs(digest);
+                '''
+            )
+            _schema_ready = True
+    _local.conn = conn
+    return conn
+
+
+def _rel(path: str) -> str:
+    return os.path.relpath(os.path.abspath(path), DATA_ROOT).replace(os.sep, '/')
+
+
+def _abs(rel: str) -> str:
+    return os.path.join(DATA_ROOT, *rel.split('/'))
+
+
+def _norm_ext(ext: str) -> str:
+    ext = (ext or '').lower()
+    if ext and not ext.startswith('.'):
+        ext = '.' + ext
+    return '.jpg' if ext == '.jpeg' else ext
+
+
+def blob_path(digest: str, ext: str) -> str:
+    return os.path.join(BLOB_DIR, digest[:2], digest + _norm_ext(ext))
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _record_blob(digest: str, ext: str, size: int) -> None:
+    # storing a blob again restarts its gc grace period
+    _connect().execute(
+        'INSERT INTO blobs (digest, ext, size, created) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(digest) DO UPDATE SET created = excluded.created',
+        (digest, _norm_ext(ext), size, time.time()),
+    )
+
+
+def put_bytes(data: bytes, ext: str) -> str:
+    """Store `data` (if not already stored) and return its digest."""
+    digest = hashlib.sha256(data).hexdigest()
+    target = blob_path(digest, ext)
+    # recorded first: from here on gc leaves the blob alone, and if it removed the
+    # file just before, the file is written again below
+    _record_blob(digest, ext, len(data))
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)
+    return digest
+
+
+def put_file(path: str) -> str:
+    """Store the file at `path` and return its digest.
+
+    The file is hard-linked into the store when possible, so adopting an
+    existing image costs no extra disk space.
+    """
+    digest = _hash_file(path)
+    ext = os.path.splitext(path)[1]
+    target = blob_path(digest, ext)
+    _record_blob(digest, ext, os.path.getsize(path))
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+    return digest
+
+
+def _place(src: str, dest: str) -> None:
+    # hard link, else copy; always via a temp name so dest is never half-written
+    tmp = dest + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def link(digest: str, dest: str) -> str:
+    """Make `dest` a reference to blob `digest` and record it. Returns `dest`.
+
+    Raises KeyError if the blob is unknown or its file has been collected.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    conn = _connect()
+    # the write lock keeps gc from removing the blob between the check and the refs row
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT ext FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown blob {digest}")
+        src = blob_path(digest, row[0])
+        if not os.path.exists(src):
+            raise KeyError(f"Blob {digest} is missing from the store")
+        try:
+            same = os.path.samefile(src, dest)
+        except OSError:
+            same = False
+        if not same:
+            _place(src, dest)
+        conn.execute('INSERT OR REPLACE INTO refs (path, digest) VALUES (?, ?)', (_rel(dest), digest))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return dest
+
+
+def store_bytes(data: bytes, dest: str) -> str:
+    """Store `data` once and make `dest` a reference to it. Returns the digest."""
+    digest = put_bytes(data, os.path.splitext(dest)[1])
+    link(digest, dest)
+    return digest
+
+
+def store_file(src: str, dest: str) -> str:
+    """Reference-copy `src` to `dest` through the store. Returns the digest."""
+    digest = put_file(src)
+    link(digest, dest)
+    return digest
+
+
+def unlink(dest: str) -> None:
+    """Remove the reference at `dest` (file and record). The blob stays until gc."""
+    try:
+        os.remove(dest)
+    except FileNotFoundError:
+        pass
+    _connect().execute('DELETE FROM refs WHERE path = ?', (_rel(dest),))
+
+
+def refcount(digest: str) -> int:
+    return _connect().execute('SELECT COUNT(*) FROM refs WHERE digest = ?', (digest,)).fetchone()[0]
+
+
+def digest_of(dest: str) -> Optional[str]:
+    row = _connect().execute('SELECT digest FROM refs WHERE path = ?', (_rel(dest),)).fetchone()
+    return row[0] if row else None
+
+
+def collect_garbage(grace_seconds: float = GC_GRACE_SECONDS, dry_run: bool = False) -> Tuple[int, int]:
+    """Delete blobs with no references. Returns `(blobs_removed, bytes_freed)`.
+
+    References whose files were deleted outside the store are dropped first.
+    """
+    conn = _connect()
+    for (rel,) in conn.execute('SELECT path FROM refs').fetchall():
+        if not os.path.lexists(_abs(rel)):
+            conn.execute('DELETE FROM refs WHERE path = ?', (rel,))
+    cutoff = time.time() - grace_seconds
+    rows = conn.execute(
+        'SELECT digest, ext, size FROM blobs WHERE created < ? AND digest NOT IN (SELECT digest FROM refs)',
+        (cutoff,),
+    ).fetchall()
+    removed = freed = 0
+    for digest, ext, size in rows:
+        if dry_run:
+            removed += 1
+            freed += size
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # re-check inside the write lock: a reference may have been added, or the
+            # blob stored again (restarting its grace period), meanwhile
+            if (conn.execute('SELECT 1 FROM refs WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+                    or not conn.execute('SELECT 1 FROM blobs WHERE digest = ? AND created < ?', (digest, cutoff)).fetchone()):
+                conn.execute('ROLLBACK')
+                continue
+            conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            try:
+                os.remove(blob_path(digest, ext))
+            except FileNotFoundError:
+                pass
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+def _iter_images(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != BLOB_DIR and not d.startswith('.')]
+        for fname in filenames:
+            if os.path.splitext(fname)[1].lower() in ('.png', '.jpg', '.jpeg', '.webp', '.avif', '.gif', '.bmp'):
+                yield os.path.join(dirpath, fname)
+
+
+def migrate(root: str = DATA_ROOT) -> Dict[str, int]:
+    """Turn every image under `root` into a reference to a blob.
+
+    Duplicate files collapse onto one blob; returns counts and bytes saved
+    (only when hard links are available does this actually free space).
+    """
+    seen: Dict[str, int] = {}
+    counts = {'files': 0, 'blobs': 0, 'duplicate_bytes': 0}
+    for path in _iter_images(root):
+        digest = store_file(path, path)
+        counts['files'] += 1
+        if digest in seen:
+            counts['duplicate_bytes'] += seen[digest]
+        else:
+            seen[digest] = os.path.getsize(path)
+    counts['blobs'] = len(seen)
+    return counts
+
+
+def stats() -> Dict[str, int]:
+    conn = _connect()
+    blobs, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+    refs = conn.execute('SELECT COUNT(*) FROM refs').fetchone()[0]
+    orphans, orphan_size = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs WHERE digest NOT IN (SELECT digest FROM refs)'
+    ).fetchone()
+    return {'blobs': blobs, 'blob_bytes': size, 'refs': refs, 'unreferenced': orphans, 'unreferenced_bytes': orphan_size}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Manage the images_data blob store.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('migrate', help='fold existing images into the store')
+    gc = sub.add_parser('gc', help='delete unreferenced blobs')
+    gc.add_argument('--grace', type=float, default=GC_GRACE_SECONDS, help='minimum blob age in seconds')
+    gc.add_argument('--dry-run', action='store_true')
+    sub.add_parser('stats')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'migrate':
+        c = migrate()
+        print(f"{c['files']} files -> {c['blobs']} blobs ({c['duplicate_bytes'] / 1e6:.1f} MB duplicated)")
+    elif args.cmd == 'gc':
+        removed, freed = collect_garbage(args.grace, args.dry_run)
+        print(f"{'would remove' if args.dry_run else 'removed'} {removed} blobs, {freed / 1e6:.1f} MB")
+    else:
+        for k, v in stats().items():
+            print(f"{k}: {v}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""Process-wide index of the recommendation catalog (`favourites_option`).
+
+The catalog directory is scanned once into an immutable snapshot of items
+(ID, path, format, size, mtime, tags) with lookups by ID, path and file name,
+together with the optional per-item metadata in `catalog.json` next to the
+images (see `catalog_search`).
+All sessions share the snapshot. A daemon thread re-lists the directory
+every `WATCH_SECONDS` (one `scandir`, with the size and mtime of every
+entry, plus a stat of `catalog.json`) and swaps in a fresh snapshot when
+files were added, removed, renamed or rewritten in place, or the metadata
+changed. Rendering a page reads the index without touching the filesystem.
+
+With object storage (`object_store`, FOODLENS_STORAGE=s3) the catalog is the
+`favourites_option/` prefix of the bucket instead and item paths are object
+locations (`s3://...`, see `object_store`). The watcher then lists the prefix every `REMOTE_WATCH_SECONDS`, which
+costs one LIST request per 1000 objects per check; raise
+FOODLENS_CATALOG_REMOTE_WATCH for large catalogs.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import object_store
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+# first directory that exists and has images is the catalog
+CATALOG_DIRS = [
+    os.path.join(PROJECT_ROOT, 'images_data', 'favourites_option'),
+    os.path.join(PROJECT_ROOT, 'image_data', 'favourites_option'),
+    os.path.join(PROJECT_ROOT, 'images', 'favourites_option'),
+    os.path.join(PROJECT_ROOT, 'favourites_option'),
+]
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.avif')
+# files in the catalog directory that should not be recommended
+SKIP = {'bunch-bananas-6175887.webp'}
+# optional {item id: {name, tags, groups, vegetarian, cuisine}} in the catalog directory
+META_FILE = 'catalog.json'
+WATCH_SECONDS = float(os.environ.get('FOODLENS_CATALOG_WATCH', '2'))
+# catalog prefix in object storage, listed at most this often
+CATALOG_PREFIX = 'favourites_option'
+REMOTE_WATCH_SECONDS = float(os.environ.get('FOODLENS_CATALOG_REMOTE_WATCH', '30'))
+
+
+class Item(NamedTuple):
+    id: str          # file name, unique within the catalog directory
+    path: str        # file path, or object location with remote storage
+    format: str      # lowercase extension without the dot
+    size: int
+    mtime_ns: int
+    tags: Tuple[str, ...]  # lowercase words from the file name
+
+    @property
+    def stat(self) -> Tuple[str, int, int]:
+        """(path, mtime_ns, size), the key the thumbnail and embedding caches use."""
+        return (self.path, self.mtime_ns, self.size)
+
+
+def tags_for(name: str) -> Tuple[str, ...]:
+    """Lowercase words of a file name without its extension ("tofu-bowl_2.jpg" -> ("tofu", "bowl", "2"))."""
+    base = os.path.splitext(os.path.basename(name))[0].lower()
+    return tuple(t for t in re.split(r'[^a-z0-9]+', base) if t)
+
+
+class Catalog:
+    """Immutable snapshot of the catalog directory."""
+
+    def __init__(self, directory: Optional[str], items: Sequence[Item], signature: Tuple[Any, ...], version: int,
+                 meta: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        self.directory = directory
+        self.meta: Dict[str, Dict[str, Any]] = meta or {}
+        self.items: Tuple[Item, ...] = tuple(items)
+        # what the watcher compares to notice changes (see `_signature`)
+        self.signature = signature
+        self.version = version
+        self.paths: List[str] = [it.path for it in self.items]
+        self.by_id: Dict[str, Item] = {it.id: it for it in self.items}
+        self.by_path: Dict[str, Item] = {it.path: it for it in self.items}
+        # path -> (path, mtime_ns, size), for `thumbnails.data_uris(stats=...)`
+        self.stats: Dict[str, Tuple[str, int, int]] = {it.path: it.stat for it in self.items}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def resolve(self, path_or_id: str) -> Optional[Item]:
+        """The item for a catalog path, a copy of it elsewhere (same file name) or an ID."""
+        item = self.by_path.get(path_or_id)
+        if item is None:
+            item = self.by_id.get(os.path.basename(path_or_id))
+        return item
+
+
+def _dir_mtimes() -> Tuple[Optional[int], ...]:
+    out = []
+    for d in CATALOG_DIRS:
+        try:
+            out.append(os.stat(d).st_mtime_ns)
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+def _parse_meta(data: Any) -> Dict[str, Dict[str, Any]]:
+    return {str(k): v for k, v in data.items() if isinstance(v, dict)} if isinstance(data, dict) else {}
+
+
+def _load_meta(directory: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, META_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return _parse_meta(data)
+
+
+def _local_listing() -> Tuple[Optional[str], List[Item], Tuple[Any, ...]]:
+    """(directory, items, signature) of the first catalog directory that has images."""
+    mtimes = _dir_mtimes()
+    for d, mtime in zip(CATALOG_DIRS, mtimes):
+        if mtime is None:
+            continue
+        items = []
+        meta_stat = None
+        with os.scandir(d) as it:
+            for entry in it:
+                name = entry.name
+                if name == META_FILE:
+                    st = entry.stat()
+                    meta_stat = (st.st_size, st.st_mtime_ns)
+                    continue
+                ext = os.path.splitext(name)[1].lower()
+                if ext not in IMAGE_EXTS or name.lower() in SKIP or not entry.is_file():
+                    continue
+                st = entry.stat()
+                items.append(Item(name, os.path.join(d, name), ext[1:], st.st_size, st.st_mtime_ns, tags_for(name)))
+        if items:
+            items.sort(key=lambda i: i.id)
+            # sizes and mtimes are in the items, so an image rewritten in place changes the signature too
+            return d, items, mtimes + (meta_stat, hash(tuple(items)))
+    return None, [], mtimes
+
+
+def _remote_listing(storage: object_store.Storage) -> Tuple[List[Item], Tuple[Any, ...]]:
+    items = []
+    meta_stat = None
+    for obj in storage.list(CATALOG_PREFIX):
+        name = obj.key.rsplit('/', 1)[-1]
+        if name == META_FILE:
+            meta_stat = (obj.size, obj.mtime_ns)
+            continue
+        ext = os.path.splitext(name)[1].lower()
+        if ext not in IMAGE_EXTS or name.lower() in SKIP:
+            continue
+        items.append(Item(name, storage.location(obj.key), ext[1:], obj.size, obj.mtime_ns, tags_for(name)))
+    items.sort(key=lambda i: i.id)
+    return items, (meta_stat, hash(tuple(items)))
+
+
+def _scan_remote(storage: object_store.Storage, version: int) -> Catalog:
+    items, signature = _remote_listing(storage)
+    meta: Dict[str, Dict[str, Any]] = {}
+    if signature[0] is not None:
+        try:
+            meta = _parse_meta(json.loads(storage.get_bytes(f'{CATALOG_PREFIX}/{META_FILE}')))
+        except Exception:
+            # unreadable metadata: items are still listed
+            pass
+    return Catalog(CATALOG_PREFIX, items, signature, version, meta)
+
+
+def _signature() -> Tuple[Any, ...]:
+    storage = object_store.get_storage()
+    if storage.is_local:
+        return _local_listing()[2]
+    return _remote_listing(storage)[1]
+
+
+def scan(version: int = 0) -> Catalog:
+    """Build a snapshot from the first catalog directory that has images (or from object storage)."""
+    storage = object_store.get_storage()
+    if not storage.is_local:
+        return _scan_remote(storage, version)
+    d, items, signature = _local_listing()
+    if d is None:
+        return Catalog(None, [], signature, version)
+    return Catalog(d, items, signature, version, _load_meta(d))
+
+
+_current: Optional[Catalog] = None
+_lock = threading.Lock()
+_watcher: Optional[threading.Thread] = None
+
+
+def _watch() -> None:
+    interval = WATCH_SECONDS if object_store.get_storage().is_local else max(WATCH_SECONDS, REMOTE_WATCH_SECONDS)
+    while True:
+        time.sleep(interval)
+        try:
+            if _current is None or _signature() != _current.signature:
+                refresh()
+        except Exception:
+            # keep serving the last good snapshot
+            pass
+
+
+def refresh() -> Catalog:
+    """Rescan now and swap in the new snapshot."""
+    global _current
+    with _lock:
+        _current = scan((_current.version + 1) if _current is not None else 1)
+        return _current
+
+
+def get() -> Catalog:
+    """The current snapshot; scans on first use and starts the directory watcher."""
+    global _watcher
+    if _current is None:
+        refresh()
+    if _watcher is None:
+        with _lock:
+            if _watcher is None:
+                _watcher = threading.Thread(target=_watch, name='catalog-watch', daemon=True)
+                _watcher.start()
+    return _current
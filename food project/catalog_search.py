@@ -0,0 +1,215 @@
+"""Catalog metadata and ranked search over it.
+
+Every catalog item gets a description: display name, tags, macro groups
+(protein / carbs / fat, via `meal_balance`), whether it is vegetarian and
+its cuisine. Entries in the catalog's `catalog.json` take precedence; any
+field left out is derived from the file name.
+
+`SearchIndex` is an inverted index from terms (tags, name words, groups,
+cuisine, "vegetarian") to items, stored as NumPy arrays of rows and
+TF-IDF weights already divided by the item norms. A query only touches the
+postings of its own terms (a single `bincount`), filters are precomputed
+boolean masks and the top k are picked with `argpartition`, so a search or a
+"similar to my favourites" ranking stays well under a millisecond even for
+tens of thousands of items. Unknown query words fall back to prefix matches
+and then to typo-tolerant matches over the term vocabulary (`fuzzy`).
+
+Indexes are built once per catalog snapshot and shared across sessions.
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+import catalog
+import meal_balance
+from fuzzy import FuzzyIndex
+
+# words that make an item non-vegetarian
+NON_VEG_WORDS = {
+    'chicken', 'beef', 'pork', 'lamb', 'mutton', 'turkey', 'duck', 'ham', 'bacon', 'sausage',
+    'salami', 'meat', 'fish', 'salmon', 'tuna', 'cod', 'shrimp', 'prawn', 'crab', 'lobster', 'anchovy',
+}
+# word -> cuisine, for items without one in catalog.json
+CUISINE_WORDS = {
+    'dal': 'indian', 'paneer': 'indian', 'curry': 'indian', 'naan': 'indian', 'biryani': 'indian',
+    'pasta': 'italian', 'pizza': 'italian', 'risotto': 'italian', 'lasagna': 'italian',
+    'tahini': 'middle eastern', 'hummus': 'middle eastern', 'falafel': 'middle eastern', 'pita': 'middle eastern',
+    'tofu': 'east asian', 'sushi': 'japanese', 'ramen': 'japanese', 'noodles': 'east asian',
+    'taco': 'mexican', 'burrito': 'mexican', 'tortilla': 'mexican', 'greek': 'greek',
+}
+PREFIX_EXPANSIONS = 8
+COMMON_FRACTION = 0.5
+
+
+class ItemMeta(NamedTuple):
+    id: str
+    name: str
+    tags: Tuple[str, ...]
+    groups: Tuple[str, ...]   # subset of `meal_balance.GROUPS`
+    vegetarian: bool
+    cuisine: Optional[str]
+
+
+def _words(text: str) -> List[str]:
+    return [t for t in re.split(r'[^a-z0-9]+', text.lower()) if t]
+
+
+def describe(item: catalog.Item, meta: Optional[Mapping[str, Any]] = None) -> ItemMeta:
+    """Metadata for a catalog item; fields missing from `meta` are derived from its file name."""
+    meta = meta or {}
+    name = str(meta.get('name') or ' '.join(item.tags))
+    tags = tuple(dict.fromkeys([*(str(t).lower() for t in meta.get('tags', ())), *item.tags]))
+    groups = meta.get('groups')
+    if groups is None:
+        groups = meal_balance.rules_for().groups(name)
+    vegetarian = meta.get('vegetarian')
+    if vegetarian is None:
+        vegetarian = not any(w in NON_VEG_WORDS for w in tags)
+    cuisine = meta.get('cuisine')
+    if cuisine is None:
+        cuisine = next((CUISINE_WORDS[w] for w in tags if w in CUISINE_WORDS), None)
+    return ItemMeta(item.id, name, tags, tuple(g for g in meal_balance.GROUPS if g in groups), bool(vegetarian), cuisine)
+
+
+def _terms(meta: ItemMeta) -> List[str]:
+    terms = list(meta.tags) + _words(meta.name) + list(meta.groups)
+    if meta.cuisine:
+        terms += _words(meta.cuisine)
+    if meta.vegetarian:
+        terms.append('vegetarian')
+    return terms
+
+
+class SearchIndex:
+    """TF-IDF inverted index over a list of item descriptions."""
+
+    def __init__(self, metas: Iterable[ItemMeta]) -> None:
+        self.items: List[ItemMeta] = list(metas)
+        self.row: Dict[str, int] = {m.id: i for i, m in enumerate(self.items)}
+        counts: List[Dict[str, int]] = []
+        df: Dict[str, int] = defaultdict(int)
+        for meta in self.items:
+            tf: Dict[str, int] = defaultdict(int)
+            for t in _terms(meta):
+                tf[t] += 1
+            counts.append(tf)
+            for t in tf:
+                df[t] += 1
+        n = len(self.items)
+        self.idf: Dict[str, float] = {t: math.log((n + 1) / (d + 1)) + 1.0 for t, d in df.items()}
+        rows: Dict[str, List[int]] = defaultdict(list)
+        weights: Dict[str, List[float]] = defaultdict(list)
+        # per-item normalized vectors, the query for `similar()`
+        self._vectors: List[Dict[str, float]] = []
+        for i, tf in enumerate(counts):
+            vec = {t: (1.0 + math.log(c)) * self.idf[t] for t, c in tf.items()}
+            norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+            vec = {t: w / norm for t, w in vec.items()}
+            self._vectors.append(vec)
+            for t, w in vec.items():
+                rows[t].append(i)
+                weights[t].append(w)
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            t: (np.array(rows[t], dtype=np.int32), np.array(weights[t], dtype=np.float64)) for t in rows
+        }
+        self._vocab = sorted(self._postings)
+        self._fuzzy = FuzzyIndex(self._vocab)
+        # filter columns
+        self._vegetarian = np.array([m.vegetarian for m in self.items], dtype=bool)
+        self._groups = {g: np.array([g in m.groups for m in self.items], dtype=bool) for g in meal_balance.GROUPS}
+        self._cuisine = np.array([m.cuisine or '' for m in self.items], dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _expand(self, word: str) -> List[str]:
+        """Index terms a query word stands for: itself, else terms it prefixes, else close spellings."""
+        if word in self._postings:
+            return [word]
+        lo = bisect.bisect_left(self._vocab, word)
+        hits = []
+        for t in self._vocab[lo:lo + PREFIX_EXPANSIONS]:
+            if not t.startswith(word):
+                break
+            hits.append(t)
+        if hits:
+            return hits
+        return [t for t, _ in self._fuzzy.search(word, limit=2)] if len(word) > 3 else []
+
+    def _top(self, query: Mapping[str, float], k: int, exclude: Iterable[int] = (),
+             vegetarian: Optional[bool] = None, group: Optional[str] = None, cuisine: Optional[str] = None) -> List[Tuple[ItemMeta, float]]:
+        n = len(self.items)
+        postings = [(self._postings[t], qw) for t, qw in query.items() if t in self._postings]
+        if not postings:
+            return []
+        # terms on more than half the items barely change the ranking but cost the most to add up;
+        # leave them out unless nothing else matches
+        rare = [(p, qw) for p, qw in postings if len(p[0]) <= n * COMMON_FRACTION]
+        postings = rare or postings
+        # one pass over all matching postings
+        scores = np.bincount(
+            np.concatenate([p[0] for p, _ in postings]),
+            weights=np.concatenate([p[1] * qw for p, qw in postings]),
+            minlength=n,
+        )
+        keep = scores > 0
+        if vegetarian is not None:
+            keep &= self._vegetarian == bool(vegetarian)
+        if group is not None:
+            keep &= self._groups.get(group, np.zeros(n, dtype=bool))
+        if cuisine is not None:
+            keep &= self._cuisine == cuisine
+        keep[list(exclude)] = False
+        hits = np.flatnonzero(keep)
+        if k < len(hits):
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        # best first; ties keep catalog order
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(self.items[i], float(scores[i])) for i in hits]
+
+    def search(self, text: str, k: int = 10, **filters: Any) -> List[Tuple[ItemMeta, float]]:
+        """Top-k items for a free-text query as `(meta, score)`, best first.
+
+        Keyword filters: `vegetarian`, `group` (one of `meal_balance.GROUPS`), `cuisine`.
+        """
+        query: Dict[str, float] = defaultdict(float)
+        for word in _words(text):
+            terms = self._expand(word)
+            for t in terms:
+                query[t] += self.idf[t] / len(terms)
+        return self._top(query, k, **filters) if query else []
+
+    def similar(self, ids: Sequence[str], k: int = 3, exclude: Sequence[str] = (), **filters: Any) -> List[Tuple[ItemMeta, float]]:
+        """Top-k items closest to the items `ids` (summed TF-IDF vectors), excluding them."""
+        rows = [self.row[i] for i in ids if i in self.row]
+        query: Dict[str, float] = defaultdict(float)
+        for row in rows:
+            for t, w in self._vectors[row].items():
+                query[t] += w
+        banned = set(rows) | {self.row[i] for i in exclude if i in self.row}
+        return self._top(query, k, exclude=banned, **filters) if query else []
+
+
+_indexes: Dict[int, SearchIndex] = {}
+_lock = threading.Lock()
+
+
+def index_for(cat: catalog.Catalog) -> SearchIndex:
+    """The shared index for a catalog snapshot (built once per snapshot version)."""
+    index = _indexes.get(cat.version)
+    if index is None:
+        with _lock:
+            index = _indexes.get(cat.version)
+            if index is None:
+                index = SearchIndex(describe(it, cat.meta.get(it.id)) for it in cat.items)
+                # older snapshots are not needed once a newer one is indexed
+                _indexes.clear()
+                _indexes[cat.version] = index
+    return index
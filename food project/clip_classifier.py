@@ -0,0 +1,89 @@
+"""Batched CLIP zero-shot classification of detection crops.
+
+The label vocabulary is tokenized and encoded once per process; the
+normalized text embeddings are cached and reused. All crops from one image
+are stacked into a single batch, encoded in one forward pass and scored
+against the cached text embeddings with one matrix multiply, so a plate with
+ten detected items costs about the same as a plate with one.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import model_registry
+
+# candidate labels to check (lowercase)
+CANDIDATES = ('avocado', 'apple', 'banana', 'orange', 'rice', 'bread', 'pasta', 'egg', 'tofu', 'cheese')
+CROP_SIZE = (224, 224)
+
+_text_cache: Dict[Tuple[Any, ...], Any] = {}
+_text_lock = threading.Lock()
+
+
+def text_embeddings(labels: Sequence[str] = CANDIDATES) -> Any:
+    """Normalized CLIP text embeddings for `labels`, computed once and cached."""
+    handle = model_registry.get_model('clip')
+    key = (id(handle.model.model), tuple(labels))
+    feats = _text_cache.get(key)
+    if feats is not None:
+        return feats
+    import torch
+
+    with _text_lock:
+        feats = _text_cache.get(key)
+        if feats is None:
+            with handle as bundle, torch.no_grad():
+                tokens = bundle.clip.tokenize(list(labels)).to(bundle.device)
+                feats = bundle.model.encode_text(tokens)
+                feats = feats / feats.norm(dim=-1, keepdim=True)
+            _text_cache[key] = feats
+    return feats
+
+
+def classify_crops(image: Any, boxes: Sequence[Optional[Sequence[float]]], labels: Sequence[str] = CANDIDATES) -> List[Optional[Tuple[str, float]]]:
+    """Classify each box crop of `image` against `labels`.
+
+    `image` is a PIL image or an `image_ingest.IngestedImage`; both provide
+    `crop((left, top, right, bottom))`.
+
+    Returns one entry per box, in order: `(top_label, top_prob)` or None when
+    the box is missing or cannot be cropped.
+    """
+    import torch
+
+    handle = model_registry.get_model('clip')
+    bundle = handle.model
+    text_feats = text_embeddings(labels)
+
+    results: List[Optional[Tuple[str, float]]] = [None] * len(boxes)
+    tensors = []
+    index = []
+    for i, coords in enumerate(boxes):
+        if not coords or len(coords) < 4:
+            continue
+        left, top, right, bottom = (int(c) for c in coords[:4])
+        if right <= left or bottom <= top:
+            continue
+        try:
+            crop = image.crop((left, top, right, bottom)).resize(CROP_SIZE)
+        except Exception:
+            continue
+        tensors.append(bundle.preprocess(crop))
+        index.append(i)
+    if not tensors:
+        return results
+
+    batch = torch.stack(tensors).to(bundle.device)
+    with handle, torch.no_grad():
+        img_feats = bundle.model.encode_image(batch)
+        img_feats = img_feats / img_feats.norm(dim=-1, keepdim=True)
+        # same scaling as CLIP's own forward(): logit_scale * cosine similarity
+        logits = bundle.model.logit_scale.exp() * img_feats @ text_feats.t().to(img_feats.dtype)
+        probs = logits.float().softmax(dim=-1).cpu().numpy()
+
+    top = probs.argmax(axis=1)
+    for row, i in enumerate(index):
+        k = int(top[row])
+        results[i] = (labels[k], float(probs[row, k]))
+    return results
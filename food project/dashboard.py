@@ -2,6 +2,13 @@ import streamlit as st
 import importlib.util
 import os
 from st_compat import rerun
+import model_registry
+import storage_maintenance
+
+# Load and warm the detection models once per server process (no-op on reruns)
+model_registry.warm_up()
+# Periodic compaction/retention of images_data when FOODLENS_MAINTENANCE_HOURS is set (once per process)
+storage_maintenance.start_background()
 
 # Hide Streamlit's default pages navigation so we can show a custom, minimal sidebar
 st.markdown(
@@ -77,7 +84,7 @@ else:
 	st.sidebar.divider()
 	if st.sidebar.button("Log off", key="dashboard_logoff"):
 		# Clear authentication and related session state so sidebar shows only Login/Enroll
-		for k in ['authenticated', 'user', 'page', 'credentials', 'credentials_file', 'enrollment', 'enrolled', 'favorited']:
+		for k in ['authenticated', 'user', 'page', 'credentials', 'credentials_file', 'enrollment', 'enrolled', 'favorited', 'favorites']:
 			if k in st.session_state:
 				del st.session_state[k]
 		st.success("Logged out")
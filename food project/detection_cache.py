@@ -0,0 +1,138 @@
+"""Content-addressed cache of detection results.
+
+Entries are keyed by the SHA-256 of the image bytes plus the detector
+settings (weights, confidence threshold, inference size), so re-analysing the
+same capture, rerunning the page or re-uploading the same photo under a new
+name is answered without touching the model. Changing any setting changes
+the key, so stale results are never served.
+
+Two tiers: an in-memory LRU shared by all sessions of the server process, and
+a JSON file per entry on disk that survives restarts. Disk writes go through
+a temporary file and `os.replace` so a crash never leaves a half-written
+entry behind. The disk tier is kept within an age and size budget by
+`storage_maintenance`.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get('FOODLENS_CACHE_DIR', os.path.join(PROJECT_ROOT, 'cache', 'detections'))
+MEMORY_ENTRIES = 256
+
+_lru: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_lock = threading.Lock()
+# (path, mtime_ns, size) -> sha256, so unchanged files are not re-read and re-hashed
+_file_digests: Dict[Tuple[str, int, int], str] = {}
+_counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'write_errors': 0}
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _file_digests.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        if len(_file_digests) > 4 * MEMORY_ENTRIES:
+            _file_digests.clear()
+        _file_digests[memo_key] = digest
+    return digest
+
+
+def make_key(image_digest: str, settings: Dict[str, Any]) -> str:
+    """Combine an image digest and detector settings into one cache key."""
+    parts = [image_digest] + [f"{k}={settings[k]}" for k in sorted(settings)]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], key + '.json')
+
+
+def _remember(key: str, value: Dict[str, Any]) -> None:
+    with _lock:
+        _lru[key] = value
+        _lru.move_to_end(key)
+        while len(_lru) > MEMORY_ENTRIES:
+            _lru.popitem(last=False)
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached entry for `key`, or None."""
+    with _lock:
+        value = _lru.get(key)
+        if value is not None:
+            _lru.move_to_end(key)
+            _counters['memory_hits'] += 1
+            return value
+    try:
+        with open(_disk_path(key), 'r', encoding='utf-8') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        with _lock:
+            _counters['misses'] += 1
+        return None
+    _remember(key, value)
+    with _lock:
+        _counters['disk_hits'] += 1
+    return value
+
+
+def put(key: str, value: Dict[str, Any]) -> bool:
+    """Store a JSON-serialisable entry in both tiers.
+
+    A value that cannot be serialised is not cached at all (the next lookup
+    is a miss). Returns True only if the entry was written to disk; if the
+    disk write fails it is still kept in memory for this process.
+    """
+    try:
+        text = json.dumps(value, separators=(',', ':'))
+    except (TypeError, ValueError):
+        with _lock:
+            _counters['write_errors'] += 1
+        return False
+    _remember(key, value)
+    path = _disk_path(key)
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError:
+        # the memory tier still works if the disk is read-only or full
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        with _lock:
+            _counters['write_errors'] += 1
+        return False
+    return True
+
+
+def clear_memory() -> None:
+    with _lock:
+        _lru.clear()
+        _file_digests.clear()
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return dict(_counters, memory_entries=len(_lru), cache_dir=CACHE_DIR)
@@ -0,0 +1,134 @@
+"""Compact, array-backed detection results.
+
+`Detections` keeps one image's boxes, class IDs and confidences as NumPy
+arrays next to the model's label vocabulary, instead of a Python list of
+`(label, confidence)` tuples plus a parallel list of coordinate lists. It is
+built straight from ultralytics' tensors without per-element conversion and
+is what session state and the detection cache hold.
+
+`FoodLookup` maps every class ID of a vocabulary to a food ID (or -1 for
+non-food) once; filtering, de-duplication and counting of detections are
+then a handful of vectorized operations.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class Detections:
+    __slots__ = ('boxes', 'class_ids', 'conf', 'names')
+
+    def __init__(self, boxes: Any, class_ids: Any, conf: Any, names: Sequence[str]) -> None:
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.class_ids = np.asarray(class_ids, dtype=np.int32).reshape(-1)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        # the vocabulary is shared by every result from a model, so keep it as one tuple
+        self.names = tuple(names)
+
+    @classmethod
+    def empty(cls, names: Sequence[str] = ()) -> 'Detections':
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0), names)
+
+    @classmethod
+    def from_ultralytics(cls, r: Any, names: Sequence[str]) -> 'Detections':
+        """Build from an ultralytics `Results` object (one tensor transfer per field)."""
+        b = getattr(r, 'boxes', None)
+        if b is None or len(b) == 0:
+            return cls.empty(names)
+
+        def _np(t: Any) -> Any:
+            return t.cpu().numpy() if hasattr(t, 'cpu') else np.asarray(t)
+
+        return cls(_np(b.xyxy), _np(b.cls), _np(b.conf), names)
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, float]], boxes: Optional[Sequence[Sequence[float]]] = None) -> 'Detections':
+        """Build from `(label, confidence)` pairs (e.g. older cached results)."""
+        pairs = list(pairs)
+        vocab: Dict[str, int] = {}
+        ids = [vocab.setdefault(label, len(vocab)) for label, _ in pairs]
+        if boxes is None or any(not b or len(b) < 4 for b in boxes):
+            boxes = [[0, 0, 0, 0]] * len(pairs)
+        return cls(boxes, ids, [c for _, c in pairs], list(vocab))
+
+    def __len__(self) -> int:
+        return int(self.class_ids.shape[0])
+
+    @property
+    def labels(self) -> List[str]:
+        return [self.names[i] for i in self.class_ids]
+
+    def pairs(self) -> List[Tuple[str, float]]:
+        """`(label, confidence)` tuples, for display and JSON output."""
+        return [(self.names[i], float(c)) for i, c in zip(self.class_ids, self.conf)]
+
+    def relabel(self, index: Any, label: str) -> None:
+        """Change the label of the detections at `index` (int, slice or mask)."""
+        if label in self.names:
+            cid = self.names.index(label)
+        else:
+            cid = len(self.names)
+            self.names = self.names + (label,)
+        self.class_ids[index] = cid
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'boxes': self.boxes.tolist(),
+            'class_ids': self.class_ids.tolist(),
+            'conf': [round(float(c), 4) for c in self.conf],
+            'names': list(self.names),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> 'Detections':
+        return cls(d['boxes'], d['class_ids'], d['conf'], d['names'])
+
+
+class FoodLookup:
+    """Class-ID -> food-ID table for one label vocabulary.
+
+    `food_id[c]` is the index into `food_names` for class `c`, or -1 if the
+    class is not a food; `candidate[c]` says whether class `c` counts as
+    "looks like food" for the re-capture check.
+    """
+
+    def __init__(self, names: Sequence[str], food_map: Mapping[str, str], allowed: Iterable[str], non_food: Iterable[str], candidates: Iterable[str]) -> None:
+        allowed = set(allowed) - set(non_food)
+        candidates = set(candidates)
+        self.names = tuple(names)
+        self.food_names: List[str] = []
+        index: Dict[str, int] = {}
+        food_id = np.full(len(self.names), -1, dtype=np.int32)
+        candidate = np.zeros(len(self.names), dtype=bool)
+        for cid, label in enumerate(self.names):
+            raw = str(label).lower()
+            candidate[cid] = raw in candidates
+            if raw not in allowed:
+                continue
+            name = food_map.get(raw, raw.replace('_', ' ').title())
+            food_id[cid] = index.setdefault(name, len(self.food_names))
+            if food_id[cid] == len(self.food_names):
+                self.food_names.append(name)
+        self.food_id = food_id
+        self.candidate = candidate
+
+    def has_food(self, det: Detections) -> bool:
+        return bool(len(det)) and bool(self.candidate[det.class_ids].any())
+
+    def summarize(self, det: Detections) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """Per-food `{'count', 'top_conf'}` in order of first detection, plus sorted names."""
+        fid = self.food_id[det.class_ids]
+        mask = fid >= 0
+        fid, conf = fid[mask], det.conf[mask]
+        if fid.size == 0:
+            return {}, []
+        n = len(self.food_names)
+        counts = np.bincount(fid, minlength=n)
+        top = np.zeros(n, dtype=np.float32)
+        np.maximum.at(top, fid, conf)
+        present, first = np.unique(fid, return_index=True)
+        order = present[np.argsort(first)]
+        summary = {self.food_names[i]: {'count': int(counts[i]), 'top_conf': float(top[i])} for i in order}
+        return summary, sorted(summary, key=lambda x: x.lower())
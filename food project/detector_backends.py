@@ -0,0 +1,191 @@
+"""Selectable inference backends for the YOLOv8 food detector.
+
+* ``torch``     - the PyTorch `yolov8n.pt` weights (default)
+* ``onnx``      - the same network exported to ONNX, run by ONNX Runtime
+* ``onnx-int8`` - the ONNX export with weights dynamically quantized to INT8
+
+The ONNX variants are loaded through ultralytics' own `YOLO('*.onnx')`
+wrapper, which runs them with ONNX Runtime but returns the same `Results`
+objects as the PyTorch model, so `food_analysis` parses them unchanged.
+Exports are created on first use and kept under `models/`.
+
+Pick the backend per deployment with ``FOODLENS_DETECTOR_BACKEND``; use the
+built-in comparison to decide::
+
+    python detector_backends.py export            # write both ONNX variants
+    python detector_backends.py bench images_data/captures --runs 3
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.environ.get('FOODLENS_MODEL_DIR', os.path.join(PROJECT_ROOT, 'models'))
+PT_WEIGHTS = 'yolov8n.pt'
+IMGSZ = 640
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+BACKEND = os.environ.get('FOODLENS_DETECTOR_BACKEND', 'torch')
+
+_export_lock = threading.Lock()
+
+
+def _stem() -> str:
+    return os.path.splitext(os.path.basename(PT_WEIGHTS))[0]
+
+
+def onnx_path(int8: bool = False) -> str:
+    return os.path.join(MODEL_DIR, _stem() + ('.int8.onnx' if int8 else '.onnx'))
+
+
+def export_onnx(int8: bool = False, force: bool = False) -> str:
+    """Export the detector to ONNX (optionally INT8) and return the file path."""
+    target = onnx_path(int8)
+    with _export_lock:
+        if os.path.exists(target) and not force:
+            return target
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            fp32 = export_onnx(int8=False)
+            tmp = target + '.tmp'
+            quantize_dynamic(fp32, tmp, weight_type=QuantType.QUInt8)
+            os.replace(tmp, target)
+        else:
+            from ultralytics import YOLO
+
+            # static 640x640 input matches how the app always calls predict()
+            exported = YOLO(PT_WEIGHTS).export(format='onnx', imgsz=IMGSZ, dynamic=False, simplify=False)
+            shutil.move(str(exported), target)
+    return target
+
+
+def weights_for(backend: str = BACKEND) -> str:
+    """Weights file for `backend`, exporting it first if needed."""
+    if backend == 'torch':
+        return PT_WEIGHTS
+    if backend == 'onnx':
+        return export_onnx(int8=False)
+    if backend == 'onnx-int8':
+        return export_onnx(int8=True)
+    raise ValueError(f"Unknown detector backend '{backend}'; choose one of {', '.join(BACKENDS)}")
+
+
+def load_detector(backend: str = BACKEND) -> Any:
+    """A ready ultralytics `YOLO` object for `backend`."""
+    from ultralytics import YOLO
+
+    if backend == 'torch':
+        try:
+            return YOLO(PT_WEIGHTS)
+        except Exception:
+            # Model file will be downloaded automatically in many setups
+            return YOLO(_stem())
+    return YOLO(weights_for(backend), task='detect')
+
+
+def _labels(result: Any, names: Any) -> List[str]:
+    try:
+        return sorted(names[int(c)] for c in result.boxes.cls)
+    except Exception:
+        return []
+
+
+def benchmark(images: Sequence[str], backends: Sequence[str] = BACKENDS, runs: int = 3, conf: float = 0.25) -> Dict[str, Dict[str, Any]]:
+    """Time each backend on `images` and compare its labels with PyTorch.
+
+    Every backend is warmed up on the first image before timing. Returns per
+    backend: mean/p50/p95 latency in ms per image, weights file size and the
+    fraction of images whose detected label multiset matches the torch
+    backend (when torch is among `backends`).
+    """
+    report: Dict[str, Dict[str, Any]] = {}
+    reference: Dict[str, List[str]] = {}
+    for backend in backends:
+        try:
+            model = load_detector(backend)
+        except Exception as e:
+            report[backend] = {'error': f"{type(e).__name__}: {e}"}
+            continue
+        model.predict(source=images[0], conf=conf, imgsz=IMGSZ, verbose=False)
+        times = []
+        labels: Dict[str, List[str]] = {}
+        for _ in range(max(1, runs)):
+            for img in images:
+                start = time.perf_counter()
+                results = model.predict(source=img, conf=conf, imgsz=IMGSZ, verbose=False)
+                times.append((time.perf_counter() - start) * 1000)
+                labels[img] = _labels(results[0], model.names)
+        times.sort()
+        weights = PT_WEIGHTS if backend == 'torch' else weights_for(backend)
+        entry: Dict[str, Any] = {
+            'mean_ms': statistics.fmean(times),
+            'p50_ms': times[len(times) // 2],
+            'p95_ms': times[round(0.95 * (len(times) - 1))],
+            'weights_mb': os.path.getsize(weights) / 1e6 if os.path.exists(weights) else None,
+        }
+        if backend == 'torch':
+            reference = labels
+        elif reference:
+            same = sum(1 for img in images if labels.get(img) == reference.get(img))
+            entry['agreement'] = same / len(images)
+        report[backend] = entry
+    return report
+
+
+def _sample_images(paths: Sequence[str], limit: int) -> List[str]:
+    out: List[str] = []
+    for p in paths:
+        if os.path.isdir(p):
+            for fname in sorted(os.listdir(p)):
+                stem, ext = os.path.splitext(fname)
+                if ext.lower() in ('.jpg', '.jpeg', '.png', '.webp') and not stem.endswith('_annotated'):
+                    out.append(os.path.join(p, fname))
+        elif os.path.isfile(p):
+            out.append(p)
+    return out[:limit]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Export and compare YOLOv8 detector backends.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    exp = sub.add_parser('export', help='export ONNX and INT8 ONNX weights')
+    exp.add_argument('--force', action='store_true', help='re-export even if files exist')
+    bench = sub.add_parser('bench', help='compare backend latency on sample images')
+    bench.add_argument('images', nargs='*', default=[os.path.join(PROJECT_ROOT, 'images_data', 'captures')])
+    bench.add_argument('--limit', type=int, default=20, help='number of images to time')
+    bench.add_argument('--runs', type=int, default=3, help='passes over the images')
+    bench.add_argument('--backends', default=','.join(BACKENDS))
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'export':
+        for int8 in (False, True):
+            print(export_onnx(int8=int8, force=args.force))
+        return 0
+
+    images = _sample_images(args.images, args.limit)
+    if not images:
+        print('no images found', file=sys.stderr)
+        return 1
+    report = benchmark(images, [b.strip() for b in args.backends.split(',') if b.strip()], runs=args.runs)
+    print(f"{'backend':<10} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'MB':>6} {'agree':>6}")
+    for backend, r in report.items():
+        if 'error' in r:
+            print(f"{backend:<10} {r['error']}")
+            continue
+        agree = f"{r['agreement']:.0%}" if 'agreement' in r else '-'
+        mb = f"{r['weights_mb']:.1f}" if r['weights_mb'] else '-'
+        print(f"{backend:<10} {r['mean_ms']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {mb:>6} {agree:>6}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
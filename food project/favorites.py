@@ -0,0 +1,111 @@
+"""Per-user favourites manifest.
+
+A user's favourites are catalog item IDs (see `catalog.Item.id`) in one
+SQLite table keyed by (user, item), stored without rowids so a user's rows
+sit together in primary-key order. Loading them at login is one indexed
+range read whatever the number of users. Toggling a favourite inserts or
+deletes a single row; no image bytes are copied.
+
+Older versions kept favourites only as image copies under
+`images_data/<user>/favourites/`. `load()` adopts those once for a user
+who has no manifest rows yet. The manifest lives under data/ with the other
+SQLite stores; one left at its earlier place, images_data/favorites.sqlite3,
+is moved there the first time the store is opened.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import List
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_ROOT = os.environ.get('FOODLENS_DATA_ROOT', os.path.join(PROJECT_ROOT, 'images_data'))
+DB_PATH = os.environ.get('FOODLENS_FAVORITES_DB', os.path.join(PROJECT_ROOT, 'data', 'favorites.sqlite3'))
+LEGACY_DB_PATH = os.path.join(DATA_ROOT, 'favorites.sqlite3')
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    with _schema_lock:
+        if not _schema_ready:
+            _adopt_legacy_db()
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(
+                '''
+                CREATE TABLE IF NOT EXISTS favorites (
+                    user TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    added REAL NOT NULL,
+                    PRIMARY KEY (user, item_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS adopted (
+                    user TEXT PRIMARY KEY
+                );
+                '''
+            )
+            _schema_ready = True
+    _local.conn = conn
+    return conn
+
+
+def _adopt_legacy_db() -> None:
+    if os.path.exists(DB_PATH) or not os.path.exists(LEGACY_DB_PATH):
+        return
+    # WAL and shared-memory files go with the database so no committed row is lost
+    for suffix in ('-wal', '-shm', ''):
+        if os.path.exists(LEGACY_DB_PATH + suffix):
+            os.replace(LEGACY_DB_PATH + suffix, DB_PATH + suffix)
+
+
+def _legacy_ids(user: str) -> List[str]:
+    folder = os.path.join(DATA_ROOT, user, 'favourites')
+    try:
+        with os.scandir(folder) as it:
+            return sorted(e.name for e in it if e.is_file() and not e.name.startswith('.'))
+    except OSError:
+        return []
+
+
+def load(user: str) -> List[str]:
+    """The user's favourite item IDs, oldest first."""
+    conn = _connect()
+    rows = conn.execute('SELECT item_id FROM favorites WHERE user = ? ORDER BY added, item_id', (user,)).fetchall()
+    if rows or conn.execute('SELECT 1 FROM adopted WHERE user = ?', (user,)).fetchone():
+        return [r[0] for r in rows]
+    # first login since manifests were introduced: adopt the old favourites folder once
+    ids = _legacy_ids(user)
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(
+            'INSERT OR IGNORE INTO favorites (user, item_id, added) VALUES (?, ?, ?)',
+            [(user, item_id, now) for item_id in ids],
+        )
+        conn.execute('INSERT OR IGNORE INTO adopted (user) VALUES (?)', (user,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return ids
+
+
+def add(user: str, item_id: str) -> None:
+    _connect().execute('INSERT OR IGNORE INTO favorites (user, item_id, added) VALUES (?, ?, ?)', (user, item_id, time.time()))
+
+
+def remove(user: str, item_id: str) -> None:
+    _connect().execute('DELETE FROM favorites WHERE user = ? AND item_id = ?', (user, item_id))
@@ -0,0 +1,366 @@
+"""Food detection and summarising, independent of the Streamlit UI.
+
+`detect_foods()` runs YOLOv8 on an image and applies the CLIP avocado
+fallback; the result holds a compact `detections.Detections` and `overlays`
+draws its boxes on demand. `summarize_detections()` turns the class IDs into
+the per-food counts shown on the capture page and `meal_totals()` estimates
+their nutrition. Nothing here touches `st.*`, so it can run on a worker
+thread or from a command-line tool such as `batch_analyze.py`.
+Failures are raised as `AnalysisError` with a message fit to show the user.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import clip_classifier
+import detection_cache
+import detector_backends
+from detections import Detections, FoodLookup
+import image_ingest
+import model_registry
+import nutrition
+
+CONF_THRESHOLD = 0.25
+IMGSZ = 640
+# bump when the detection/summary logic changes so cached results are recomputed
+RESULT_VERSION = 4
+
+FRUIT_LABELS = {'apple', 'banana', 'orange', 'grape', 'strawberry', 'lemon', 'lime', 'pineapple', 'mango', 'pear', 'peach', 'watermelon', 'kiwi', 'blueberry'}
+
+# Quick check: if none of the detected labels look like food, ask user to re-capture
+FOOD_CANDIDATES = {'apple', 'banana', 'orange', 'sandwich', 'pizza', 'rice', 'bread', 'pasta', 'avocado', 'egg', 'tofu', 'cheese'} | FRUIT_LABELS
+
+# Map raw model labels to friendly food names (extend as needed)
+FOOD_MAP = {
+    'apple': 'Apple',
+    'banana': 'Banana',
+    'orange': 'Orange',
+    'sandwich': 'Sandwich',
+    'pizza': 'Pizza',
+    'cup': 'Cup',
+    'bottle': 'Bottle',
+    'avocado': 'Avocado',
+    'rice': 'Rice',
+    'bread': 'Bread',
+    'pasta': 'Pasta',
+    'egg': 'Egg',
+    'tofu': 'Tofu',
+    'cheese': 'Cheese',
+    # add more mappings you care about
+}
+
+# Labels to ignore (non-food objects detected by model)
+NON_FOOD = {'person', 'car', 'truck', 'dog', 'cat'}
+
+# Define allowed food labels (only include these in summary)
+FOOD_ALLOWED = set(k.lower() for k in FOOD_MAP.keys()) | FRUIT_LABELS | {'rice', 'bread', 'pasta', 'sandwich', 'pizza', 'avocado', 'egg', 'tofu', 'cheese'}
+
+ProgressFn = Callable[[float, str], None]
+
+# one class-ID -> food-ID table per label vocabulary, built on first use
+_lookups: Dict[Tuple[str, ...], FoodLookup] = {}
+_lookup_lock = threading.Lock()
+
+
+class AnalysisError(Exception):
+    """Raised when an image cannot be analysed; the message is user-facing."""
+
+
+def _noop_progress(fraction: float, message: str) -> None:
+    pass
+
+
+def _model_names(model: Any) -> Tuple[str, ...]:
+    """The model's class names indexed by class ID."""
+    try:
+        names = getattr(model, 'names', None)
+        if names is None:
+            return ()
+        if isinstance(names, dict):
+            return tuple(str(names[k]) for k in sorted(names))
+        return tuple(str(x) for x in names)
+    except Exception:
+        return ()
+
+
+def food_lookup(names: Iterable[str]) -> FoodLookup:
+    """The shared `FoodLookup` for a label vocabulary."""
+    names = tuple(names)
+    lookup = _lookups.get(names)
+    if lookup is None:
+        with _lookup_lock:
+            lookup = _lookups.get(names)
+            if lookup is None:
+                lookup = FoodLookup(names, FOOD_MAP, FOOD_ALLOWED, NON_FOOD, FOOD_CANDIDATES)
+                _lookups[names] = lookup
+    return lookup
+
+
+def _yolo_handle() -> model_registry.ModelHandle:
+    # The model is loaded once per server process and shared by all sessions
+    try:
+        return model_registry.get_model('yolo')
+    except ImportError:
+        raise AnalysisError("Package 'ultralytics' not found. Install with: pip install ultralytics")
+    except Exception as ex:
+        raise AnalysisError(f"Could not load YOLO model: {ex}")
+
+
+def _parse_result(r: Any, model: Any) -> Detections:
+    """Turn one ultralytics result into a `Detections`."""
+    try:
+        return Detections.from_ultralytics(r, _model_names(model))
+    except Exception:
+        # result fields differ from what we expect; treat as no detections
+        return Detections.empty(_model_names(model))
+
+
+def _clip_fallback(model: Any, image: image_ingest.IngestedImage, det: Detections) -> None:
+    """Relabel crops CLIP is confident are avocados (updates `det` in place).
+
+    Only used when the YOLO model has no 'avocado' class; optional, requires
+    the 'clip' package.
+    """
+    if not len(det) or any(n.lower() == 'avocado' for n in _model_names(model)):
+        return
+    try:
+        # all crops are cut from the shared array and scored in one batch
+        predictions = clip_classifier.classify_crops(image, det.boxes.tolist())
+        # if CLIP strongly believes it's an avocado, replace the detection label
+        hits = [i for i, pred in enumerate(predictions) if pred is not None and pred[0] == 'avocado' and pred[1] > 0.35]
+        if hits:
+            det.relabel(hits, 'avocado')
+    except Exception:
+        # CLIP not available or failed; suppress UI hint
+        pass
+
+
+def _load(path: str) -> image_ingest.IngestedImage:
+    try:
+        return image_ingest.load_file(path)
+    except Exception as ex:
+        raise AnalysisError(f"Could not read image: {ex}")
+
+
+def _detection_dict(det: Detections, image: image_ingest.IngestedImage) -> Dict[str, Any]:
+    return {
+        'detections': det,
+        # boxes are in the coordinates of the ingested (downscaled) image
+        'image_size': list(image.size),
+        'original_size': list(image.original_size),
+    }
+
+
+def detect_foods(path: str, progress: Optional[ProgressFn] = None, image: Optional[image_ingest.IngestedImage] = None) -> Dict[str, Any]:
+    """Run detection on the image at `path`.
+
+    Returns a dict with `detections` (a `Detections`: boxes, class IDs and
+    confidences as arrays) and the ingested/original image sizes. Pass `image` when the bytes were already
+    decoded; otherwise the file is read and decoded once here.
+    `progress(fraction, message)` is called between stages.
+    """
+    progress = progress or _noop_progress
+
+    progress(0.05, 'Loading model')
+    if image is None:
+        image = _load(path)
+    yolo = _yolo_handle()
+    model = yolo.model
+
+    progress(0.2, 'Detecting food')
+    try:
+        with yolo as locked_model:
+            results = locked_model.predict(source=image.bgr, conf=CONF_THRESHOLD, imgsz=IMGSZ, verbose=False)
+    except Exception as ex:
+        raise AnalysisError(f"YOLO inference failed: {ex}")
+
+    if not results:
+        return _detection_dict(Detections.empty(_model_names(model)), image)
+
+    det = _parse_result(results[0], model)
+
+    progress(0.7, 'Checking crops with CLIP')
+    _clip_fallback(model, image, det)
+
+    progress(1.0, 'Done')
+    return _detection_dict(det, image)
+
+
+def detect_batch(paths: List[str], images: Optional[List[image_ingest.IngestedImage]] = None) -> List[Dict[str, Any]]:
+    """Run detection on several images with one batched `predict` call.
+
+    Returns one `detect_foods()`-style dict per path, in order.
+    """
+    if not paths:
+        return []
+    if images is None:
+        images = [_load(p) for p in paths]
+    yolo = _yolo_handle()
+    model = yolo.model
+    try:
+        with yolo as locked_model:
+            results = locked_model.predict(source=[img.bgr for img in images], conf=CONF_THRESHOLD, imgsz=IMGSZ, verbose=False)
+    except Exception as ex:
+        raise AnalysisError(f"YOLO inference failed: {ex}")
+
+    out = []
+    for path, image, r in zip(paths, images, results):
+        det = _parse_result(r, model)
+        _clip_fallback(model, image, det)
+        out.append(_detection_dict(det, image))
+    return out
+
+
+DetectionsLike = Union[Detections, List[Tuple[str, float]]]
+
+
+def _as_detections(detections: DetectionsLike) -> Detections:
+    return detections if isinstance(detections, Detections) else Detections.from_pairs(detections)
+
+
+def has_food(detections: DetectionsLike) -> bool:
+    det = _as_detections(detections)
+    return food_lookup(det.names).has_food(det)
+
+
+def summarize_detections(detections: DetectionsLike) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """Aggregate food detections into `{name: {'count', 'top_conf'}}`.
+
+    Also returns the sorted list of distinct detected food names. Accepts a
+    `Detections` or a list of `(label, confidence)` pairs.
+    """
+    det = _as_detections(detections)
+    return food_lookup(det.names).summarize(det)
+
+
+def detector_settings() -> Dict[str, Any]:
+    """Everything besides the image bytes that changes what detection returns."""
+    return {
+        'model': model_registry.YOLO_WEIGHTS,
+        'backend': detector_backends.BACKEND,
+        'conf': CONF_THRESHOLD,
+        'imgsz': IMGSZ,
+        'clip': model_registry.CLIP_ARCH,
+        'version': RESULT_VERSION,
+    }
+
+
+def cache_key(digest: str) -> str:
+    """Cache key for an image's SHA-256 digest under the current settings."""
+    return detection_cache.make_key(digest, detector_settings())
+
+
+def _to_cache(result: Dict[str, Any]) -> Dict[str, Any]:
+    entry = dict(result)
+    entry['detections'] = result['detections'].to_dict()
+    return entry
+
+
+def _from_cache(entry: Dict[str, Any]) -> Dict[str, Any]:
+    result = dict(entry)
+    result['detections'] = Detections.from_dict(entry['detections'])
+    result['cached'] = True
+    return result
+
+
+def cached_analysis(path: Optional[str] = None, digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The cached `analyze_image()` result for an image, or None.
+
+    Pass the `digest` of the bytes when it is already known; otherwise the
+    file at `path` is hashed.
+    """
+    try:
+        if digest is None:
+            digest = detection_cache.hash_file(path)
+        entry = detection_cache.get(cache_key(digest))
+    except OSError:
+        return None
+    return _from_cache(entry) if entry is not None else None
+
+
+def _summarize(result: Dict[str, Any]) -> Dict[str, Any]:
+    det = result['detections']
+    lookup = food_lookup(det.names)
+    result['has_food'] = lookup.has_food(det)
+    if result['has_food']:
+        result['summary'], result['detected_foods'] = lookup.summarize(det)
+    else:
+        result['summary'], result['detected_foods'] = {}, []
+    return result
+
+
+def analyze_image(path: str, progress: Optional[ProgressFn] = None, use_cache: bool = True, data: Optional[bytes] = None) -> Dict[str, Any]:
+    """Detect and summarise foods in one call.
+
+    Adds `summary`, `detected_foods` and `has_food` to the `detect_foods()`
+    result. The image bytes (`data`, or the file at `path`) are read, hashed
+    and decoded once. Results are cached by image content and detector
+    settings, so the same photo is only run through the model once.
+    """
+    if data is None:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as ex:
+            raise AnalysisError(f"Could not read image: {ex}")
+    digest = detection_cache.hash_bytes(data)
+    key = cache_key(digest) if use_cache else None
+    if key is not None:
+        entry = detection_cache.get(key)
+        if entry is not None:
+            return _from_cache(entry)
+
+    try:
+        image = image_ingest.ingest(data)
+    except Exception as ex:
+        raise AnalysisError(f"Could not decode image: {ex}")
+    result = _summarize(detect_foods(path, progress, image=image))
+    if key is not None:
+        detection_cache.put(key, _to_cache(result))
+    result['cached'] = False
+    return result
+
+
+def analyze_batch(paths: List[str], use_cache: bool = True) -> List[Dict[str, Any]]:
+    """`analyze_image()` for several images; cache misses share one `predict` call."""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+    keys: List[Optional[str]] = [None] * len(paths)
+    todo = []
+    images = []
+    for i, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as ex:
+            raise AnalysisError(f"Could not read image {path}: {ex}")
+        if use_cache:
+            keys[i] = cache_key(detection_cache.hash_bytes(data))
+            entry = detection_cache.get(keys[i])
+            if entry is not None:
+                results[i] = _from_cache(entry)
+                continue
+        try:
+            images.append(image_ingest.ingest(data))
+        except Exception as ex:
+            raise AnalysisError(f"Could not decode image {path}: {ex}")
+        todo.append(i)
+
+    detected = detect_batch([paths[i] for i in todo], images=images)
+    for i, result in zip(todo, detected):
+        result = _summarize(result)
+        if keys[i] is not None:
+            detection_cache.put(keys[i], _to_cache(result))
+        result['cached'] = False
+        results[i] = result
+    return results
+
+
+def nutrition_for(name: str) -> Optional[Dict[str, float]]:
+    """Per-item nutrition for a food name: exact match, then contained food name."""
+    return nutrition.lookup(name)
+
+
+def meal_totals(summary: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """Estimated calories/protein/carbs/fat for a detection summary."""
+    return nutrition.meal_totals({name: info.get('count', 1) for name, info in summary.items()})
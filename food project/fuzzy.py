@@ -0,0 +1,107 @@
+"""Typo-tolerant matching of food names.
+
+`FuzzyIndex` is built once over a list of names. A query is split into
+character trigrams; an inverted index from trigram to names yields the few
+names sharing enough trigrams to possibly be within the edit-distance bound,
+and only those are compared with a bounded Damerau-Levenshtein distance.
+Only the query's rarest trigrams are probed (any name within the bound must
+contain at least one of them), so common trigrams never get scanned.
+Cost depends on how many names share the query's trigrams, not on how many
+names there are.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+Q = 3
+
+
+def _grams(text: str) -> Set[str]:
+    padded = ' ' * (Q - 1) + text + ' ' * (Q - 1)
+    return {padded[i:i + Q] for i in range(len(padded) - Q + 1)}
+
+
+def max_distance(text: str) -> int:
+    """Default edit-distance bound for a query: 1 up to 7 characters, then 2, then 3."""
+    return 1 if len(text) < 8 else 2 if len(text) < 13 else 3
+
+
+def distance(a: str, b: str, limit: int) -> int:
+    """Optimal-string-alignment distance between `a` and `b`, or `limit + 1` if larger."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d = min(d, prev2[j - 2] + 1)
+            cur[j] = d
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return min(prev[-1], limit + 1)
+
+
+class FuzzyIndex:
+    """Trigram index over a fixed list of names."""
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self.names: List[str] = []
+        self._grams: List[FrozenSet[str]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        seen: Set[str] = set()
+        for name in names:
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            grams = frozenset(_grams(name))
+            for g in grams:
+                self._postings[g].append(len(self.names))
+            self.names.append(name)
+            self._grams.append(grams)
+        self._postings = dict(self._postings)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, query: str, limit: int = 5, max_dist: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Names within `max_dist` edits of `query` as `(name, distance)`, closest first.
+
+        Tries one edit first and widens the bound only while nothing is found,
+        so the common single-typo case stays on the cheapest filter.
+        """
+        if not query:
+            return []
+        grams = _grams(query)
+        by_rarity = sorted(grams, key=lambda g: len(self._postings.get(g, ())))
+        for k in range(1, (max_distance(query) if max_dist is None else max_dist) + 1):
+            hits = self._search(query, grams, by_rarity, k)
+            if hits:
+                return hits[:limit]
+        return []
+
+    def _search(self, query: str, grams: Set[str], by_rarity: List[str], k: int) -> List[Tuple[str, int]]:
+        # each edit (a transposition counts as one) removes at most Q + 1 of the query's
+        # trigrams, so a match shares at least `need` of them and therefore contains at
+        # least one of any `len(grams) - need + 1`: probe only the rarest ones
+        need = len(grams) - k * (Q + 1)
+        if need <= 0:
+            candidates: Iterable[int] = range(len(self.names))
+        else:
+            candidates = {i for g in by_rarity[:len(grams) - need + 1] for i in self._postings.get(g, ())}
+        lo, hi = len(query) - k, len(query) + k
+        hits = []
+        for i in candidates:
+            name = self.names[i]
+            if not lo <= len(name) <= hi or len(grams & self._grams[i]) < need:
+                continue
+            d = distance(query, name, k)
+            if d <= k:
+                hits.append((d, abs(len(name) - len(query)), name))
+        hits.sort()
+        return [(name, d) for d, _, name in hits]
@@ -0,0 +1,92 @@
+"""Decode-once image ingest shared by saving, YOLO, CLIP and annotation.
+
+An uploaded or captured photo arrives as encoded bytes. `ingest()` hashes
+those bytes and decodes them exactly once into an RGB NumPy array that is
+already oriented (EXIF) and no larger than the detector needs. For JPEGs the
+downscale happens inside the decoder (draft mode), so a 12-MP phone photo is
+decoded at 1/4 or 1/8 scale instead of being expanded to full size first.
+
+The resulting `IngestedImage` is handed to YOLO (as a BGR view, the
+convention ultralytics uses for arrays), to the CLIP crop classifier and to
+annotation, so no stage re-reads the file from disk. Box coordinates refer
+to the ingested array; `scale` maps them back to the original photo.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+from typing import Any, Optional, Tuple
+
+# long side of the decoded array; matches the detector's imgsz
+INGEST_SIZE = 640
+
+
+class IngestedImage:
+    def __init__(self, rgb: Any, original_size: Tuple[int, int], digest: str, data: Optional[bytes] = None) -> None:
+        self.rgb = rgb
+        self.original_size = original_size
+        self.digest = digest
+        self.data = data
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height) of the decoded array."""
+        return int(self.rgb.shape[1]), int(self.rgb.shape[0])
+
+    @property
+    def scale(self) -> float:
+        """Original width divided by decoded width."""
+        return self.original_size[0] / max(1, self.size[0])
+
+    @property
+    def bgr(self) -> Any:
+        # a view, not a copy
+        return self.rgb[..., ::-1]
+
+    def crop(self, box: Any) -> Any:
+        """PIL image of `[x1, y1, x2, y2]` in decoded coordinates."""
+        from PIL import Image
+
+        h, w = self.rgb.shape[:2]
+        left, top, right, bottom = (int(c) for c in box[:4])
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(w, right), min(h, bottom)
+        if right <= left or bottom <= top:
+            raise ValueError('empty crop')
+        return Image.fromarray(self.rgb[top:bottom, left:right])
+
+
+def _decode(data: bytes, max_side: int) -> Tuple[Any, Tuple[int, int]]:
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(data))
+    original = img.size
+    try:
+        orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        orientation = 1
+    if orientation in (5, 6, 7, 8):
+        # rotated by 90 degrees: report the original size in display orientation
+        original = (original[1], original[0])
+    if img.format == 'JPEG':
+        # let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= max_side
+        img.draft('RGB', (max_side, max_side))
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.BILINEAR)
+    return np.asarray(img), original
+
+
+def ingest(data: bytes, max_side: int = INGEST_SIZE, keep_bytes: bool = False) -> IngestedImage:
+    """Hash and decode encoded image bytes once."""
+    digest = hashlib.sha256(data).hexdigest()
+    rgb, original = _decode(data, max_side)
+    return IngestedImage(rgb, original, digest, data if keep_bytes else None)
+
+
+def load_file(path: str, max_side: int = INGEST_SIZE) -> IngestedImage:
+    """`ingest()` the bytes of a file on disk (read once)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return ingest(data, max_side)
@@ -0,0 +1,229 @@
+"""Background inference job queue shared by all Streamlit sessions.
+
+Pages submit work with `submit()` and get back a job ID to keep in session
+state. The job runs on a bounded worker pool; the page polls `get()` on later
+reruns to show progress and pick up the result, and can `cancel()` it. Jobs
+beyond `MAX_PENDING` are refused with `QueueFull` so a burst of users cannot
+queue unbounded work.
+
+A job function receives the `Job` as its first argument and may call
+`job.report(fraction, message)`; once the job has been cancelled, `report()`
+raises `JobCancelled` so long-running work stops at the next checkpoint.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+# Workers default to 2: detection is CPU-bound and torch already uses several threads per call
+MAX_WORKERS = int(os.environ.get('FOODLENS_INFER_WORKERS', '2'))
+MAX_PENDING = int(os.environ.get('FOODLENS_INFER_MAX_PENDING', '32'))
+# finished jobs are forgotten after this many seconds
+JOB_TTL = 600.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Raised by `submit()` when too many jobs are already waiting."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function when its job has been cancelled."""
+
+
+class Job:
+    def __init__(self, job_id: str, label: str = '') -> None:
+        self.id = job_id
+        self.label = label
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = 'Waiting for a free worker'
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def report(self, fraction: float, message: str = '') -> None:
+        """Update progress; raises JobCancelled if the job was cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.progress = max(0.0, min(1.0, float(fraction)))
+        if message:
+            self.message = message
+
+    def wait_seconds(self) -> float:
+        """Time spent queued before a worker picked the job up (so far)."""
+        end = self.started_at if self.started_at is not None else time.time()
+        return end - self.submitted_at
+
+
+class JobQueue:
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # recent queue waits and run times for sizing the pool
+        self._waits: Deque[float] = deque(maxlen=200)
+        self._runs: Deque[float] = deque(maxlen=200)
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+
+    def submit(self, fn: Callable[..., Any], *args: Any, label: str = '', **kwargs: Any) -> str:
+        """Queue `fn(job, *args, **kwargs)` and return the new job ID."""
+        with self._lock:
+            self._prune()
+            if self._count(QUEUED) >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} analyses are already waiting; please try again shortly")
+            job = Job(uuid.uuid4().hex, label)
+            self._jobs[job.id] = job
+            job._future = self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if not job_id:
+            return None
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job. Queued jobs never start; running jobs stop at their next `report()`."""
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            self._finish(job, CANCELLED, message='Cancelled')
+        return True
+
+    def _run(self, job: Job, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        if job.cancelled:
+            self._finish(job, CANCELLED, message='Cancelled')
+            return
+        job.started_at = time.time()
+        job.status = RUNNING
+        job.message = 'Starting'
+        with self._lock:
+            self._waits.append(job.wait_seconds())
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            self._finish(job, CANCELLED, message='Cancelled')
+        except Exception as e:
+            self._finish(job, FAILED, error=str(e) or type(e).__name__)
+        else:
+            if job.cancelled:
+                self._finish(job, CANCELLED, message='Cancelled')
+            else:
+                job.result = result
+                self._finish(job, DONE, message='Done')
+
+    def _finish(self, job: Job, status: str, message: str = '', error: Optional[str] = None) -> None:
+        with self._lock:
+            if job.done:
+                return
+            job.finished_at = time.time()
+            job.status = status
+            job.error = error
+            if message:
+                job.message = message
+            if status == DONE:
+                job.progress = 1.0
+                self._completed += 1
+            elif status == FAILED:
+                self._failed += 1
+            else:
+                self._cancelled += 1
+            if job.started_at is not None:
+                self._runs.append(job.finished_at - job.started_at)
+
+    def _count(self, status: str) -> int:
+        return sum(1 for j in self._jobs.values() if j.status == status)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_TTL
+        stale = [jid for jid, j in self._jobs.items() if j.done and (j.finished_at or 0) < cutoff]
+        for jid in stale:
+            del self._jobs[jid]
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based position among queued jobs, or None if not queued."""
+        job = self._jobs.get(job_id)
+        if job is None or job.status != QUEUED:
+            return None
+        with self._lock:
+            ahead = sum(1 for j in self._jobs.values() if j.status == QUEUED and j.submitted_at < job.submitted_at)
+        return ahead + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, worker usage and wait/run times for sizing the pool."""
+        with self._lock:
+            queued = [j for j in self._jobs.values() if j.status == QUEUED]
+            waits = sorted(self._waits)
+            runs = sorted(self._runs)
+            return {
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'queued': len(queued),
+                'running': self._count(RUNNING),
+                'oldest_wait_seconds': max((j.wait_seconds() for j in queued), default=0.0),
+                'avg_wait_seconds': sum(waits) / len(waits) if waits else 0.0,
+                'p95_wait_seconds': waits[round(0.95 * (len(waits) - 1))] if waits else 0.0,
+                'avg_run_seconds': sum(runs) / len(runs) if runs else 0.0,
+                'completed': self._completed,
+                'failed': self._failed,
+                'cancelled': self._cancelled,
+            }
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """The process-wide queue, created on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+
+def submit(fn: Callable[..., Any], *args: Any, label: str = '', **kwargs: Any) -> str:
+    return get_queue().submit(fn, *args, label=label, **kwargs)
+
+
+def get(job_id: Optional[str]) -> Optional[Job]:
+    return get_queue().get(job_id)
+
+
+def cancel(job_id: str) -> bool:
+    return get_queue().cancel(job_id)
+
+
+def stats() -> Dict[str, Any]:
+    return get_queue().stats()
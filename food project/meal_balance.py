@@ -0,0 +1,208 @@
+"""Meal balance rules: which macro groups a meal covers and whether it is balanced.
+
+Two things are compiled once and reused:
+
+* food -> macro-group classification. Known labels are a dict lookup to a
+  bitmask; any other name is matched once against one precompiled regex per
+  group (word fragments such as "lentil" or "nut") and the answer memoized.
+* balance thresholds for a user. The share of a meal's energy that should
+  come from protein, carbs and fat is derived from the enrollment profile
+  (age, weight, height, gender) and kept as NumPy arrays.
+
+`BalanceRules.evaluate()` takes any number of meals and checks them all in
+one vectorized pass over their nutrient totals (`nutrition.batch_totals`).
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+import nutrition
+
+GROUPS = ('protein', 'carbs', 'fat')
+GROUP_TITLES = {'protein': 'Protein', 'carbs': 'Carbohydrates', 'fat': 'Fats'}
+# energy per gram, in GROUPS order
+KCAL_PER_GRAM = np.array([4.0, 4.0, 9.0])
+
+# Vegetarian label sets (lowercase, underscores for spaces)
+PROTEIN_LABELS = {
+    'tofu', 'tempeh', 'lentil', 'lentils', 'bean', 'beans', 'chickpea', 'chickpeas',
+    'egg', 'eggs', 'yogurt', 'greek_yogurt', 'cheese', 'cottage_cheese', 'paneer',
+    'seitan', 'quinoa', 'edamame', 'soy', 'nuts', 'almond', 'walnut', 'peanut'
+}
+CARB_LABELS = {
+    'rice', 'brown_rice', 'bread', 'wholegrain_bread', 'pita', 'pasta', 'noodle', 'noodles',
+    'potato', 'potatoes', 'sweet_potato', 'tortilla', 'wrap', 'oat', 'oats', 'cereal', 'bagel'
+}
+FAT_LABELS = {
+    'avocado', 'butter', 'oil', 'olive_oil', 'margarine', 'cheese', 'peanut_butter',
+    'nuts', 'almond', 'walnut', 'peanut', 'seeds', 'chia', 'flax', 'tahini'
+}
+# fragments that mark a group anywhere in a name ("lentil soup", "peanut butter toast")
+GROUP_FRAGMENTS = {
+    'protein': ('tofu', 'tempeh', 'lentil', 'bean', 'chick', 'egg', 'yogurt', 'cheese', 'paneer', 'quinoa', 'edamame', 'soy', 'nut'),
+    'carbs': ('rice', 'bread', 'pasta', 'potato', 'oat', 'noodle', 'tortilla'),
+    'fat': ('avocado', 'butter', 'oil', 'nut', 'seed', 'peanut butter'),
+}
+
+# what to suggest when a group is missing or low
+SUGGESTIONS = {
+    'protein': ['tofu', 'tempeh', 'boiled egg', 'lentils', 'chickpeas', 'beans', 'Greek yogurt', 'cottage cheese', 'paneer', 'quinoa', 'nuts', 'seeds'],
+    'carbs': ['brown rice', 'quinoa', 'whole wheat bread', 'oats', 'pasta', 'potatoes', 'sweet potatoes'],
+    'fat': ['avocado', 'olive oil', 'nuts', 'seeds', 'peanut butter', 'tahini', 'butter'],
+}
+
+# share of meal energy per group (percent), in GROUPS order
+ADULT_RANGE = ((10.0, 35.0), (45.0, 65.0), (20.0, 35.0))
+CHILD_RANGE = ((10.0, 30.0), (45.0, 65.0), (25.0, 35.0))
+MEALS_PER_DAY = 3
+ACTIVITY_FACTOR = 1.4
+
+
+class Targets(NamedTuple):
+    """Per-meal targets for one user."""
+    min_pct: np.ndarray  # (3,) lowest share of energy per group
+    max_pct: np.ndarray  # (3,) highest share of energy per group
+    protein_g: float     # protein per meal
+    kcal: float          # energy per meal
+
+
+def _number(profile: Mapping[str, Any], key: str) -> Optional[float]:
+    try:
+        value = float(profile.get(key) or 0)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def targets_for(profile: Optional[Mapping[str, Any]] = None) -> Targets:
+    """Per-meal targets from an enrollment profile; missing fields fall back to adult defaults.
+
+    Energy is Mifflin-St Jeor BMR x a light activity factor, split over three
+    meals. Protein is 0.8 g/kg a day (1.0 g/kg from age 65), which sets the
+    lower bound of the protein share within the recommended range.
+    """
+    profile = profile or {}
+    age = _number(profile, 'age') or 30.0
+    weight = _number(profile, 'weight') or 70.0
+    height = _number(profile, 'height') or 170.0
+    gender = str(profile.get('gender') or '').lower()
+    offset = 5.0 if gender == 'male' else -161.0 if gender == 'female' else -78.0
+
+    ranges = np.array(CHILD_RANGE if age < 18 else ADULT_RANGE)
+    kcal = max(1.0, (10 * weight + 6.25 * height - 5 * age + offset) * ACTIVITY_FACTOR / MEALS_PER_DAY)
+    protein_g = weight * (1.0 if age >= 65 else 0.8) / MEALS_PER_DAY
+    min_pct = ranges[:, 0].copy()
+    min_pct[0] = np.clip(100.0 * protein_g * KCAL_PER_GRAM[0] / kcal, ranges[0, 0], ranges[0, 1])
+    return Targets(min_pct, ranges[:, 1].copy(), float(protein_g), float(kcal))
+
+
+class Balance(NamedTuple):
+    """Evaluation of a batch of meals; every array has one row per meal."""
+    present: np.ndarray  # (n, 3) bool: some item belongs to the group
+    pct: np.ndarray      # (n, 3) share of energy per group, percent
+    low: np.ndarray      # (n, 3) bool: present but below the user's minimum share
+    high: np.ndarray     # (n, 3) bool: above the maximum share
+    totals: np.ndarray   # (n, 4) nutrient totals, columns in `nutrition.NUTRIENTS` order
+
+    @property
+    def balanced(self) -> np.ndarray:
+        return self.present.all(axis=1) & ~self.low.any(axis=1) & ~self.high.any(axis=1)
+
+
+class BalanceRules:
+    """Compiled rules for one user profile; safe to share between threads."""
+
+    def __init__(self, profile: Optional[Mapping[str, Any]] = None) -> None:
+        self.targets = targets_for(profile)
+        self._patterns = [
+            re.compile('|'.join(sorted((re.escape(f) for f in GROUP_FRAGMENTS[g]), key=len, reverse=True)))
+            for g in GROUPS
+        ]
+        self._bits = np.array([1 << b for b in range(len(GROUPS))])
+        # known labels are resolved up front; anything else on first sight
+        self._masks: Dict[str, int] = {}
+        for bit, labels in enumerate((PROTEIN_LABELS, CARB_LABELS, FAT_LABELS)):
+            for label in labels:
+                key = nutrition.normalize(label)
+                self._masks[key] = self._masks.get(key, self._match(key)) | (1 << bit)
+
+    def classify(self, name: str) -> int:
+        """Bitmask of the groups `name` belongs to (bit i = `GROUPS[i]`)."""
+        key = nutrition.normalize(name)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._match(key)
+            if len(self._masks) < 65536:
+                self._masks[key] = mask
+        return mask
+
+    def _match(self, key: str) -> int:
+        mask = 0
+        for bit, pattern in enumerate(self._patterns):
+            if pattern.search(key):
+                mask |= 1 << bit
+        return mask
+
+    def groups(self, name: str) -> List[str]:
+        mask = self.classify(name)
+        return [g for b, g in enumerate(GROUPS) if mask & (1 << b)]
+
+    def evaluate(self, meals: Sequence[nutrition.Meal]) -> Balance:
+        """Check every meal in `meals` against this user's targets."""
+        meals = list(meals)
+        masks = np.array([self._meal_mask(m) for m in meals], dtype=np.int64).reshape(-1, 1)
+        present = (masks & self._bits) != 0
+        totals = nutrition.batch_totals(meals)
+        # protein, carbs, fat columns -> energy -> share of the meal's macro energy
+        energy = totals[:, 1:4] * KCAL_PER_GRAM
+        total = energy.sum(axis=1, keepdims=True)
+        pct = np.divide(100.0 * energy, total, out=np.zeros_like(energy), where=total > 0)
+        low = present & (pct < self.targets.min_pct)
+        high = pct > self.targets.max_pct
+        return Balance(present, pct, low, high, totals)
+
+    def _meal_mask(self, meal: nutrition.Meal) -> int:
+        mask = 0
+        names = meal.keys() if isinstance(meal, Mapping) else meal
+        for name in names:
+            mask |= self.classify(name)
+        return mask
+
+
+_rules: Dict[Tuple[Any, ...], BalanceRules] = {}
+_rules_lock = threading.Lock()
+
+
+def rules_for(profile: Optional[Mapping[str, Any]] = None) -> BalanceRules:
+    """The shared `BalanceRules` for a profile (compiled once per distinct profile)."""
+    profile = profile or {}
+    key = tuple(str(profile.get(k, '')) for k in ('age', 'weight', 'height', 'gender'))
+    rules = _rules.get(key)
+    if rules is None:
+        with _rules_lock:
+            rules = _rules.get(key)
+            if rules is None:
+                rules = _rules[key] = BalanceRules(profile)
+    return rules
+
+
+def favourite_tokens(paths: Iterable[str]) -> Set[str]:
+    """Lowercase words from favourite image file names ("tofu-bowl.jpg" -> {"tofu", "bowl"})."""
+    tokens: Set[str] = set()
+    for p in paths:
+        base = p.replace('\\', '/').rsplit('/', 1)[-1].rsplit('.', 1)[0].lower()
+        tokens.update(t for t in re.split(r'[^a-z0-9]+', base) if t)
+    return tokens
+
+
+def format_suggestions(items: Iterable[str], fav_tokens: Set[str]) -> str:
+    """Comma-separated suggestions, with the ones matching a favourite in bold."""
+    parts = []
+    for it in items:
+        bold = any(t in fav_tokens for t in re.sub(r'[^a-z0-9]+', ' ', it.lower()).split())
+        parts.append(f"<strong>{it}</strong>" if bold else it)
+    return ', '.join(parts)
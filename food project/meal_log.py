@@ -0,0 +1,170 @@
+"""Append-only log of analysed meals.
+
+Each meal is one row: user, timestamp, the detected items with their counts
+and the macro totals (`nutrition.NUTRIENTS`). Rows are only ever inserted.
+
+The table is a WITHOUT ROWID table clustered on (user, ts), so every user's
+meals are stored together in time order: a per-user window such as "last 30
+days" is a single contiguous range read, and `summary()`/`daily()` add up
+the totals inside SQLite over that range only. The cost depends on the
+user's meals in the window, not on how many rows the log holds.
+
+A meal may carry a `source` (the analysed image); a second append with the
+same user and source is ignored, so reruns of a page cannot log the same
+meal twice.
+
+Command line::
+
+    python meal_log.py summary <user> [days]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+import nutrition
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('FOODLENS_MEAL_LOG', os.path.join(PROJECT_ROOT, 'data', 'meal_log.sqlite3'))
+DAY_MS = 86_400_000
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(
+                '''
+                CREATE TABLE IF NOT EXISTS meals (
+                    user TEXT NOT NULL,
+                    ts INTEGER NOT NULL,          -- unix time, milliseconds
+                    items TEXT NOT NULL,          -- JSON {name: count}
+                    n_items INTEGER NOT NULL,
+                    calories REAL NOT NULL,
+                    protein REAL NOT NULL,
+                    carbs REAL NOT NULL,
+                    fat REAL NOT NULL,
+                    source TEXT,
+                    PRIMARY KEY (user, ts)
+                ) WITHOUT ROWID;
+                CREATE UNIQUE INDEX IF NOT EXISTS meals_source ON meals(user, source) WHERE source IS NOT NULL;
+                '''
+            )
+            _schema_ready = True
+    _local.conn = conn
+    return conn
+
+
+def append(user: str, counts: Mapping[str, int], totals: Optional[Mapping[str, float]] = None,
+           source: Optional[str] = None, ts: Optional[float] = None) -> bool:
+    """Log a meal; `totals` default to `nutrition.meal_totals(counts)`.
+
+    Returns False if a meal from the same `source` was already logged.
+    """
+    counts = {str(k): int(v) for k, v in counts.items()}
+    if totals is None:
+        totals = nutrition.meal_totals(counts)
+    ms = int((time.time() if ts is None else ts) * 1000)
+    conn = _connect()
+    while True:
+        cur = conn.execute(
+            'INSERT OR IGNORE INTO meals (user, ts, items, n_items, calories, protein, carbs, fat, source) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (user, ms, json.dumps(counts), sum(counts.values()),
+             float(totals['calories']), float(totals['protein']), float(totals['carbs']), float(totals['fat']), source),
+        )
+        if cur.rowcount:
+            return True
+        if source is not None and conn.execute('SELECT 1 FROM meals WHERE user = ? AND source = ?', (user, source)).fetchone():
+            return False
+        # the same user logged another meal in the same millisecond
+        ms += 1
+
+
+def _since(days: float, now: Optional[float] = None) -> int:
+    return int(((time.time() if now is None else now) - days * 86400) * 1000)
+
+
+def summary(user: str, days: float = 30, now: Optional[float] = None) -> Dict[str, Any]:
+    """Meal count, item count and macro totals/averages for `user` over the last `days`."""
+    row = _connect().execute(
+        'SELECT COUNT(*), COALESCE(SUM(n_items), 0), COALESCE(SUM(calories), 0), COALESCE(SUM(protein), 0), '
+        'COALESCE(SUM(carbs), 0), COALESCE(SUM(fat), 0), MIN(ts), MAX(ts) '
+        'FROM meals WHERE user = ? AND ts >= ?',
+        (user, _since(days, now)),
+    ).fetchone()
+    meals = row[0]
+    totals = dict(zip(nutrition.NUTRIENTS, row[2:6]))
+    return {
+        'meals': meals,
+        'items': row[1],
+        'totals': totals,
+        'per_meal': {k: (v / meals if meals else 0.0) for k, v in totals.items()},
+        'first': row[6] / 1000 if row[6] is not None else None,
+        'last': row[7] / 1000 if row[7] is not None else None,
+    }
+
+
+def daily(user: str, days: float = 30, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Per-day (UTC) meal count and macro totals for `user` over the last `days`, oldest first."""
+    rows = _connect().execute(
+        'SELECT ts / ? AS day, COUNT(*), SUM(calories), SUM(protein), SUM(carbs), SUM(fat) '
+        'FROM meals WHERE user = ? AND ts >= ? GROUP BY day ORDER BY day',
+        (DAY_MS, user, _since(days, now)),
+    ).fetchall()
+    return [
+        {'date': time.strftime('%Y-%m-%d', time.gmtime(r[0] * 86400)), 'meals': r[1], **dict(zip(nutrition.NUTRIENTS, r[2:6]))}
+        for r in rows
+    ]
+
+
+def top_items(user: str, days: float = 30, limit: int = 5, now: Optional[float] = None) -> List[tuple]:
+    """Most eaten items for `user` over the last `days` as `(name, count)`."""
+    rows = _connect().execute(
+        'SELECT j.key, SUM(j.value) AS n FROM meals, json_each(meals.items) AS j '
+        'WHERE user = ? AND ts >= ? GROUP BY j.key ORDER BY n DESC, j.key LIMIT ?',
+        (user, _since(days, now), limit),
+    ).fetchall()
+    return [(r[0], int(r[1])) for r in rows]
+
+
+def recent(user: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """The user's latest meals, newest first."""
+    rows = _connect().execute(
+        'SELECT ts, items, calories, protein, carbs, fat FROM meals WHERE user = ? ORDER BY ts DESC LIMIT ?',
+        (user, limit),
+    ).fetchall()
+    return [{'ts': r[0] / 1000, 'items': json.loads(r[1]), **dict(zip(nutrition.NUTRIENTS, r[2:6]))} for r in rows]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('summary', help='aggregates for one user')
+    p.add_argument('user')
+    p.add_argument('days', nargs='?', type=float, default=30)
+    args = parser.parse_args(argv)
+    if args.cmd == 'summary':
+        print(json.dumps({'summary': summary(args.user, args.days), 'top_items': top_items(args.user, args.days)}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Process-wide registry of warm inference models.
+
+Streamlit re-executes page scripts on every rerun and every browser session
+gets its own script thread, so building `YOLO('yolov8n.pt')` or calling
+`clip.load()` inside a page costs seconds per click and one copy of the
+weights per session. This module is imported once per server process, so the
+models it loads are shared by all sessions.
+
+Usage from a page::
+
+    import model_registry
+
+    handle = model_registry.get_model('yolo')
+    with handle as model:
+        results = model.predict(source=path, conf=0.25, imgsz=640, verbose=False)
+
+Entering the handle takes a per-model lock: ultralytics predictors and CLIP
+keep per-call state on the model object, so concurrent sessions take turns
+instead of corrupting each other's results.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import detector_backends
+
+YOLO_WEIGHTS = detector_backends.PT_WEIGHTS
+CLIP_ARCH = 'ViT-B/32'
+INFER_SIZE = 640
+
+# CLIP needs the preprocess transform and device alongside the network itself
+ClipBundle = namedtuple('ClipBundle', ['model', 'preprocess', 'device', 'clip'])
+
+
+class ModelHandle:
+    """Thread-safe handle around a loaded model.
+
+    Use it as a context manager to get exclusive access to the model for the
+    duration of one inference call. Load and usage statistics are recorded on
+    the handle and reported by `model_stats()`.
+    """
+
+    def __init__(self, name: str, model: Any, load_seconds: float, param_bytes: Optional[int], rss_delta_bytes: Optional[int]) -> None:
+        self.name = name
+        self.model = model
+        self.load_seconds = load_seconds
+        self.warmup_seconds: Optional[float] = None
+        self.param_bytes = param_bytes
+        self.rss_delta_bytes = rss_delta_bytes
+        self.loaded_at = time.time()
+        self.uses = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> Any:
+        self._lock.acquire()
+        self.uses += 1
+        return self.model
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'backend': detector_backends.BACKEND if self.name == 'yolo' else None,
+            'load_seconds': round(self.load_seconds, 3),
+            'warmup_seconds': None if self.warmup_seconds is None else round(self.warmup_seconds, 3),
+            'param_bytes': self.param_bytes,
+            'rss_delta_bytes': self.rss_delta_bytes,
+            'loaded_at': self.loaded_at,
+            'uses': self.uses,
+        }
+
+
+def _rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process so far, or None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    # bytes on macOS, KiB on Linux and the BSDs
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _param_bytes(module: Any) -> Optional[int]:
+    """Size of a torch module's parameters in bytes, if it has any."""
+    try:
+        return int(sum(p.numel() * p.element_size() for p in module.parameters()))
+    except Exception:
+        return None
+
+
+def _load_yolo() -> Any:
+    # torch, onnx or onnx-int8, chosen per deployment (see detector_backends)
+    return detector_backends.load_detector(detector_backends.BACKEND)
+
+
+def _warm_yolo(model: Any) -> None:
+    import numpy as np
+
+    blank = np.zeros((INFER_SIZE, INFER_SIZE, 3), dtype=np.uint8)
+    model.predict(source=blank, imgsz=INFER_SIZE, verbose=False)
+
+
+def _yolo_params(model: Any) -> Optional[int]:
+    inner = getattr(model, 'model', model)
+    if isinstance(inner, str) and os.path.exists(inner):
+        # ONNX backends keep the weights file path here rather than a torch module
+        return os.path.getsize(inner)
+    return _param_bytes(inner)
+
+
+def _load_clip() -> ClipBundle:
+    import importlib
+
+    clip = importlib.import_module('clip')
+    torch = importlib.import_module('torch')
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    clip_model, clip_preprocess = clip.load(CLIP_ARCH, device=device)
+    clip_model.eval()
+    return ClipBundle(clip_model, clip_preprocess, device, clip)
+
+
+def _warm_clip(bundle: ClipBundle) -> None:
+    import torch
+    from PIL import Image
+
+    img = bundle.preprocess(Image.new('RGB', (224, 224))).unsqueeze(0).to(bundle.device)
+    with torch.no_grad():
+        bundle.model.encode_image(img)
+        bundle.model.encode_text(bundle.clip.tokenize(['food']).to(bundle.device))
+
+
+def _clip_params(bundle: ClipBundle) -> Optional[int]:
+    return _param_bytes(bundle.model)
+
+
+# name -> (loader, warm-up, parameter size)
+_LOADERS: Dict[str, tuple] = {
+    'yolo': (_load_yolo, _warm_yolo, _yolo_params),
+    'clip': (_load_clip, _warm_clip, _clip_params),
+}
+
+_handles: Dict[str, ModelHandle] = {}
+_errors: Dict[str, str] = {}
+_registry_lock = threading.Lock()
+_load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in _LOADERS}
+_warmup_thread: Optional[threading.Thread] = None
+
+
+def register(name: str, loader: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None, params: Optional[Callable[[Any], Optional[int]]] = None) -> None:
+    """Register (or replace) a model loader under `name`."""
+    with _registry_lock:
+        _LOADERS[name] = (loader, warmup, params)
+        _load_locks.setdefault(name, threading.Lock())
+        _handles.pop(name, None)
+        _errors.pop(name, None)
+
+
+def get_model(name: str, warm: bool = False) -> ModelHandle:
+    """Return the shared handle for `name`, loading it on first use.
+
+    Only one thread loads a given model; others asking for it at the same time
+    wait for that load instead of starting their own. Import errors (missing
+    `ultralytics`, `clip` or `torch`) propagate as ImportError so callers can
+    show an install hint; other load failures propagate unchanged and the next
+    call retries.
+    """
+    handle = _handles.get(name)
+    if handle is not None:
+        return handle
+    if name not in _LOADERS:
+        raise KeyError(f"Unknown model '{name}'")
+    with _load_locks[name]:
+        handle = _handles.get(name)
+        if handle is not None:
+            return handle
+        loader, warmup, params = _LOADERS[name]
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        try:
+            model = loader()
+        except Exception as e:
+            _errors[name] = f"{type(e).__name__}: {e}"
+            raise
+        load_seconds = time.perf_counter() - start
+        rss_after = _rss_bytes()
+        rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        handle = ModelHandle(name, model, load_seconds, params(model) if params else None, rss_delta)
+        if warm and warmup is not None:
+            _run_warmup(handle, warmup)
+        _handles[name] = handle
+        _errors.pop(name, None)
+        return handle
+
+
+def _run_warmup(handle: ModelHandle, warmup: Callable[[Any], None]) -> None:
+    # The first inference allocates buffers and picks kernels; pay that cost here
+    start = time.perf_counter()
+    try:
+        with handle as model:
+            warmup(model)
+        handle.warmup_seconds = time.perf_counter() - start
+    except Exception as e:
+        _errors[handle.name] = f"warm-up failed: {type(e).__name__}: {e}"
+    finally:
+        handle.uses = 0
+
+
+def warm_up(names: Iterable[str] = ('yolo', 'clip'), background: bool = True) -> None:
+    """Load and warm the given models once per process.
+
+    Safe to call on every rerun: after the first call it does nothing. With
+    `background=True` loading happens on a daemon thread so the first page
+    render is not held up; sessions that need a model before it is ready
+    simply wait on the load lock in `get_model()`.
+    """
+    global _warmup_thread
+    with _registry_lock:
+        if _warmup_thread is not None:
+            return
+
+        def _work() -> None:
+            for name in names:
+                try:
+                    get_model(name, warm=True)
+                except Exception:
+                    # Missing optional packages are reported through model_stats()
+                    pass
+
+        _warmup_thread = threading.Thread(target=_work, name='model-warmup', daemon=True)
+        if background:
+            _warmup_thread.start()
+    if not background:
+        _work()
+
+
+def is_loaded(name: str) -> bool:
+    return name in _handles
+
+
+def model_stats() -> Dict[str, Any]:
+    """Load time, warm-up time, memory and usage figures for every model."""
+    out: Dict[str, Any] = {'process_rss_bytes': _rss_bytes(), 'process_peak_rss_bytes': _peak_rss_bytes(), 'models': {}}
+    for name in _LOADERS:
+        handle = _handles.get(name)
+        if handle is not None:
+            out['models'][name] = handle.stats()
+        else:
+            out['models'][name] = {'name': name, 'loaded': False, 'error': _errors.get(name)}
+    return out
@@ -0,0 +1,345 @@
+"""Per-item nutrition lookup.
+
+The food table is compiled once per process into an index: exact names are
+answered from a dict, and names that merely contain a known food ("brown
+rice bowl", "cheese_pizza") are matched by one Aho-Corasick pass over the
+name, so the cost of a lookup depends on the length of the name, not on the
+number of foods in the table. The capture page's YOLO path and manual path
+both go through `lookup()`; typed names go through `resolve()` first, which
+corrects typos ("avacado", "chick peas") against the known names and aliases.
+
+When a USDA FoodData Central store has been imported (`usda_store`), names
+the built-in table does not know are looked up there as well. A re-import
+is noticed within `STORE_CHECK_SECONDS` (or at once, through
+`NutritionIndex.refresh()`) rather than by a stat of the store per lookup.
+
+Totals come from a foods x nutrients matrix: a meal is a vector of counts per
+matrix row (row 0 counts unknown foods, priced at `DEFAULT_NUTRITION`),
+and `counts @ matrix` gives the totals of one meal or, with a count matrix,
+of any number of meals in one call.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+from fuzzy import FuzzyIndex
+
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fat')
+# how often `find` asks the USDA store whether it was re-imported
+STORE_CHECK_SECONDS = float(os.environ.get('FOODLENS_USDA_CHECK', '5'))
+
+# Nutrition per typical serving
+FOODS: Dict[str, Dict[str, float]] = {
+    'apple': {'calories':95, 'protein':0.5, 'carbs':25, 'fat':0.3},
+    'banana': {'calories':105, 'protein':1.3, 'carbs':27, 'fat':0.4},
+    'orange': {'calories':62, 'protein':1.2, 'carbs':15.4, 'fat':0.2},
+    'rice': {'calories':205, 'protein':4.3, 'carbs':45, 'fat':0.4},
+    'brown rice': {'calories':216, 'protein':5, 'carbs':45, 'fat':1.8},
+    'bread': {'calories':79, 'protein':4, 'carbs':14, 'fat':1},
+    'whole wheat bread': {'calories':70, 'protein':4, 'carbs':12, 'fat':1},
+    'pasta': {'calories':131, 'protein':5, 'carbs':25, 'fat':1.1},
+    'avocado': {'calories':250, 'protein':3, 'carbs':12, 'fat':23},
+    'egg': {'calories':78, 'protein':6, 'carbs':0.6, 'fat':5},
+    'tofu': {'calories':76, 'protein':8, 'carbs':1.9, 'fat':4.8},
+    'cheese': {'calories':113, 'protein':7, 'carbs':1, 'fat':9},
+    'pizza': {'calories':266, 'protein':11, 'carbs':33, 'fat':10},
+    'sandwich': {'calories':250, 'protein':12, 'carbs':30, 'fat':8},
+    'chickpeas': {'calories':269, 'protein':14.5, 'carbs':45, 'fat':4.2},
+    'lentils': {'calories':230, 'protein':18, 'carbs':40, 'fat':0.8},
+}
+
+# other names for foods in the table (alias -> table name)
+ALIASES: Dict[str, str] = {
+    'eggs': 'egg',
+    'boiled egg': 'egg',
+    'wholegrain bread': 'whole wheat bread',
+    'whole grain bread': 'whole wheat bread',
+    'spaghetti': 'pasta',
+    'noodles': 'pasta',
+    'chickpea': 'chickpeas',
+    'garbanzo beans': 'chickpeas',
+    'lentil': 'lentils',
+}
+
+# used for totals when a food is not in the table
+DEFAULT_NUTRITION = {'calories':150, 'protein':5, 'carbs':20, 'fat':7}
+
+
+def normalize(name: str) -> str:
+    return ' '.join(name.strip().lower().replace('_', ' ').split())
+
+
+class _Matcher:
+    """Aho-Corasick automaton over a fixed set of patterns.
+
+    `longest(text)` returns the value of the longest pattern occurring in
+    `text` (ties go to the pattern added first), in one pass over `text`.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, int]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # best (length, -order, value) ending at each state, including via fail links
+        self._out: List[Optional[Tuple[int, int, int]]] = [None]
+        for order, (pattern, value) in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                state = nxt
+            cand = (len(pattern), -order, value)
+            if self._out[state] is None or cand > self._out[state]:
+                self._out[state] = cand
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                inherited = self._out[self._fail[nxt]]
+                if inherited is not None and (self._out[nxt] is None or inherited > self._out[nxt]):
+                    self._out[nxt] = inherited
+
+    def longest(self, text: str) -> Optional[int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        best = None
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hit = out[state]
+            if hit is not None and (best is None or hit > best):
+                best = hit
+        return best[2] if best is not None else None
+
+
+# a meal: food name -> count, or an iterable of names (each counted once)
+Meal = Union[Mapping[str, float], Iterable[str]]
+
+
+def _meal_items(meal: Meal) -> Iterable[Tuple[str, float]]:
+    if isinstance(meal, Mapping):
+        return meal.items()
+    return ((name, 1.0) for name in meal if name and name.strip())
+
+
+class NutritionIndex:
+    """Compiled lookup over a food table; build once and share.
+
+    With a `store` (see `usda_store`), names the built-in table does not know
+    exactly are looked up there too, and foods found are added to the index
+    (and the matrix) the first time they are used.
+    """
+
+    def __init__(self, foods: Mapping[str, Mapping[str, float]], aliases: Optional[Mapping[str, str]] = None, store: Any = None) -> None:
+        self.names: List[str] = []
+        self.rows: List[Dict[str, float]] = []
+        self._exact: Dict[str, int] = {}
+        for name, row in foods.items():
+            key = normalize(name)
+            if key not in self._exact:
+                self._exact[key] = self._append(key, row)
+        for alias, target in (aliases or {}).items():
+            fid = self._exact.get(normalize(target))
+            if fid is not None:
+                self._exact.setdefault(normalize(alias), fid)
+        self._matcher = _Matcher(self._exact.items())
+        self._fuzzy = FuzzyIndex(self._exact)
+        # row 0 prices unknown foods; food `fid` is row `fid + 1`, so rows never move as foods are added
+        self.matrix = np.array(
+            [[float(DEFAULT_NUTRITION[k]) for k in NUTRIENTS]] + [[row[k] for k in NUTRIENTS] for row in self.rows],
+            dtype=np.float64,
+        )
+        self._store = store
+        self._store_version = store.version() if store is not None else None
+        self._store_checked = time.monotonic()
+        self._store_ids: Dict[Any, int] = {}
+        self._memo: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _append(self, name: str, row: Mapping[str, float]) -> int:
+        self.names.append(name)
+        self.rows.append({k: float(row.get(k, 0.0)) for k in NUTRIENTS})
+        return len(self.names) - 1
+
+    def _adopt(self, food: Optional[Mapping[str, Any]]) -> Optional[int]:
+        # add a food found in the store, once
+        if food is None:
+            return None
+        with self._lock:
+            fid = self._store_ids.get(food['fdc_id'])
+            if fid is None:
+                fid = self._append(normalize(food['name']), food)
+                self.matrix = np.vstack([self.matrix, [[self.rows[fid][k] for k in NUTRIENTS]]])
+                self._store_ids[food['fdc_id']] = fid
+        return fid
+
+    def _find(self, key: str) -> Optional[int]:
+        fid = self._exact.get(key)
+        if fid is None and self._store is not None:
+            fid = self._adopt(self._store.lookup(key))
+        if fid is None:
+            fid = self._matcher.longest(key)
+        if fid is None and self._store is not None:
+            found = self._store.search(key, limit=1)
+            fid = self._adopt(found[0] if found else None)
+        return fid
+
+    def find(self, name: str) -> int:
+        """Food ID for `name`, or -1.
+
+        Tries an exact name, then an exact store name, then the longest
+        built-in food name contained in `name`, then the store's best word
+        match. Results are memoized per name.
+        """
+        if self._store is not None and time.monotonic() - self._store_checked >= STORE_CHECK_SECONDS:
+            self.refresh()
+        fid = self._memo.get(name)
+        if fid is None:
+            key = normalize(name)
+            found = self._find(key) if key else None
+            fid = -1 if found is None else found
+            if len(self._memo) < 65536:
+                self._memo[name] = fid
+        return fid
+
+    def refresh(self) -> None:
+        """Forget memoized answers if the store was re-imported since the last check."""
+        if self._store is None:
+            return
+        self._store_checked = time.monotonic()
+        version = self._store.version()
+        if version != self._store_version:
+            self._memo = {}
+            self._store_version = version
+
+    def lookup(self, name: str) -> Optional[Dict[str, float]]:
+        fid = self.find(name)
+        return self.rows[fid] if fid >= 0 else None
+
+    def suggest(self, name: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """Known names within a small edit distance of `name`, as `(name, distance)`, closest first."""
+        return self._fuzzy.search(normalize(name), limit=limit)
+
+    def resolve(self, name: str) -> str:
+        """`name` normalized, with a typo corrected to the closest known name.
+
+        Known names are kept as they are. Otherwise the whole name is matched
+        fuzzily, and failing that each word is (so "avacado toast" becomes
+        "avocado toast"). Names nothing is close to are returned unchanged.
+        """
+        key = normalize(name)
+        if not key or key in self._exact:
+            return key
+        close = self._fuzzy.search(key, limit=1)
+        if close:
+            return close[0][0]
+        if self.find(key) >= 0:
+            return key
+        words = key.split(' ')
+        fixed = []
+        for w in words:
+            close = self._fuzzy.search(w, limit=1) if len(w) > 3 and w not in self._exact else []
+            fixed.append(close[0][0] if close else w)
+        return ' '.join(fixed)
+
+    def column(self, name: str) -> int:
+        """Row of `matrix` for `name`; row 0 for unknown foods."""
+        return self.find(name) + 1
+
+    def count_vector(self, meal: Meal) -> np.ndarray:
+        """Counts per matrix row for one meal."""
+        cols = [(self.column(name), count) for name, count in _meal_items(meal)]
+        vec = np.zeros(self.matrix.shape[0], dtype=np.float64)
+        for col, count in cols:
+            vec[col] += count
+        return vec
+
+    def count_matrix(self, meals: Iterable[Meal]) -> np.ndarray:
+        """`count_vector()` for many meals, stacked into one (meals x foods) array."""
+        rows: List[int] = []
+        cols: List[int] = []
+        vals: List[float] = []
+        n = 0
+        for n, meal in enumerate(meals, 1):
+            for name, count in _meal_items(meal):
+                rows.append(n - 1)
+                cols.append(self.column(name))
+                vals.append(count)
+        counts = np.zeros((n, self.matrix.shape[0]), dtype=np.float64)
+        np.add.at(counts, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), vals)
+        return counts
+
+    def totals(self, counts: np.ndarray) -> np.ndarray:
+        """Nutrient totals for a count vector (-> 4 values) or count matrix (-> meals x 4)."""
+        # foods adopted after `counts` was built only add rows past its width
+        return counts @ self.matrix[:counts.shape[-1]]
+
+
+_index: Optional[NutritionIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> NutritionIndex:
+    """The process-wide index over `FOODS` (plus the USDA store, if imported), compiled on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                import usda_store
+
+                _index = NutritionIndex(FOODS, ALIASES, store=usda_store)
+    return _index
+
+
+def refresh() -> None:
+    """Pick up a USDA store re-imported by this process without waiting for the next check."""
+    if _index is not None:
+        _index.refresh()
+
+
+def lookup(name: str) -> Optional[Dict[str, float]]:
+    """Per-item nutrition for a food name, or None if nothing matches."""
+    return get_index().lookup(name)
+
+
+def suggest(name: str, limit: int = 5) -> List[Tuple[str, int]]:
+    """Known food names close to `name`, closest first."""
+    return get_index().suggest(name, limit)
+
+
+def resolve(name: str) -> str:
+    """`name` with typos corrected against the known food names (see `NutritionIndex.resolve`)."""
+    return get_index().resolve(name)
+
+
+def meal_totals(meal: Meal) -> Dict[str, float]:
+    """Estimated calories/protein/carbs/fat for one meal."""
+    index = get_index()
+    return dict(zip(NUTRIENTS, index.totals(index.count_vector(meal)).tolist()))
+
+
+def batch_totals(meals: Iterable[Meal]) -> np.ndarray:
+    """Totals for many meals at once: a (meals x 4) array, columns in `NUTRIENTS` order."""
+    index = get_index()
+    return index.totals(index.count_matrix(meals))
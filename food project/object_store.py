@@ -0,0 +1,351 @@
+"""Pluggable storage for the images the app reads and writes.
+
+Pages and helpers address images by key (`captures/capture_x.jpg`,
+`<user>/food_to_analyse/x.jpg`, `favourites_option/tofu.jpg`) and go
+through `get_storage()`, so where the bytes live is configuration:
+
+* `LocalStorage` (default): keys are paths under images_data. Writes go
+  through `blob_store`, so identical images share one file on disk and a
+  copy is a new hard link, not new bytes.
+* `S3Storage`: any S3-compatible object store (AWS S3, MinIO, Ceph RGW...)
+  through boto3. One client per process with a bounded connection pool is
+  shared by all threads. Large uploads are sent as parallel multipart
+  uploads. Copies are done server-side. `open()` returns a seekable reader
+  backed by ranged GETs, so reading an image header does not download the
+  whole object; reading it all is a single GET.
+
+Only images go through here. The SQLite stores (favorites, users, meal_log,
+usda and the blob references) stay on local disk whichever driver is
+selected.
+
+Session state and catalog items keep a *location* for each image
+(`Storage.location`): a file path with local storage, an `s3://bucket/key`
+URI for objects. Open one with `open_location()`; anything that is not an
+object URI of the configured storage is treated as a local path.
+
+Selected with environment variables::
+
+    FOODLENS_STORAGE=local|s3
+    FOODLENS_S3_BUCKET, FOODLENS_S3_PREFIX, FOODLENS_S3_ENDPOINT (e.g. http://localhost:9000 for MinIO),
+    FOODLENS_S3_REGION, FOODLENS_S3_POOL (connections), FOODLENS_S3_MULTIPART_MB
+
+Credentials come from the usual AWS variables or config files. The S3
+driver is tested against moto's in-process S3 (and a real MinIO when
+FOODLENS_TEST_S3_ENDPOINT is set), see `tests/test_object_store.py`.
+"""
+from __future__ import annotations
+
+import abc
+import io
+import os
+import threading
+from typing import Any, BinaryIO, Iterator, NamedTuple, Optional
+
+import blob_store
+
+DEFAULT_POOL = 32
+DEFAULT_MULTIPART_MB = 8
+# bytes fetched per ranged GET when reading through `open()`
+READ_CHUNK = 256 * 1024
+
+
+class ObjectInfo(NamedTuple):
+    key: str
+    size: int
+    mtime_ns: int
+
+
+class Storage(abc.ABC):
+    """Interface of a storage driver; keys are '/'-separated and relative."""
+
+    is_local = False
+
+    @abc.abstractmethod
+    def put_bytes(self, key: str, data: bytes) -> str:
+        """Store `data` at `key`; returns the key."""
+
+    @abc.abstractmethod
+    def put_file(self, key: str, path: str) -> str:
+        """Store the file at `path` under `key`; returns the key."""
+
+    @abc.abstractmethod
+    def get_bytes(self, key: str) -> bytes:
+        """The whole object."""
+
+    @abc.abstractmethod
+    def get_range(self, key: str, start: int, length: int) -> bytes:
+        """`length` bytes from offset `start` (fewer at the end of the object)."""
+
+    @abc.abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Readable, seekable file object for `key`."""
+
+    @abc.abstractmethod
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        """Size and mtime of `key`, or None if it does not exist."""
+
+    @abc.abstractmethod
+    def copy(self, src_key: str, dest_key: str) -> str:
+        """Make `dest_key` hold the same bytes as `src_key` without passing them through the app."""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove `key`; a missing key is not an error."""
+
+    @abc.abstractmethod
+    def list(self, prefix: str) -> Iterator[ObjectInfo]:
+        """Objects directly under `prefix` (a 'directory' ending in '/')."""
+
+    @abc.abstractmethod
+    def location(self, key: str) -> str:
+        """What to keep in session state or a catalog item for `key` (see module docstring)."""
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of `key` for the local driver, else None."""
+        return None
+
+    def key_of(self, location: str) -> Optional[str]:
+        """The key if `location` is an object of this storage, None for a local file path."""
+        return None
+
+    def open_location(self, location: str) -> BinaryIO:
+        key = self.key_of(location)
+        return self.open(key) if key is not None else open(location, 'rb')
+
+    def read_location(self, location: str) -> bytes:
+        key = self.key_of(location)
+        if key is not None:
+            return self.get_bytes(key)
+        with open(location, 'rb') as f:
+            return f.read()
+
+
+class LocalStorage(Storage):
+    is_local = True
+
+    def __init__(self, root: str = blob_store.DATA_ROOT) -> None:
+        self.root = root
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def location(self, key: str) -> str:
+        return self.local_path(key)
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        blob_store.store_bytes(data, self.local_path(key))
+        return key
+
+    def put_file(self, key: str, path: str) -> str:
+        blob_store.store_file(path, self.local_path(key))
+        return key
+
+    def get_bytes(self, key: str) -> bytes:
+        with open(self.local_path(key), 'rb') as f:
+            return f.read()
+
+    def get_range(self, key: str, start: int, length: int) -> bytes:
+        with open(self.local_path(key), 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.local_path(key), 'rb')
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            st = os.stat(self.local_path(key))
+        except OSError:
+            return None
+        return ObjectInfo(key, st.st_size, st.st_mtime_ns)
+
+    def copy(self, src_key: str, dest_key: str) -> str:
+        src, dest = self.local_path(src_key), self.local_path(dest_key)
+        digest = blob_store.digest_of(src)
+        if digest is not None:
+            # another reference to the same blob
+            blob_store.link(digest, dest)
+        else:
+            blob_store.store_file(src, dest)
+        return dest_key
+
+    def delete(self, key: str) -> None:
+        blob_store.unlink(self.local_path(key))
+
+    def list(self, prefix: str) -> Iterator[ObjectInfo]:
+        base = prefix.rstrip('/')
+        try:
+            with os.scandir(self.local_path(base)) as it:
+                entries = [e for e in it if e.is_file()]
+        except OSError:
+            return
+        for e in sorted(entries, key=lambda e: e.name):
+            st = e.stat()
+            yield ObjectInfo(f'{base}/{e.name}' if base else e.name, st.st_size, st.st_mtime_ns)
+
+
+class _RangedReader(io.RawIOBase):
+    """Seekable raw reader over an object; each read is one ranged GET of the size asked for."""
+
+    def __init__(self, storage: 'S3Storage', key: str, size: int) -> None:
+        self._storage = storage
+        self._key = key
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+        data = self._storage.get_range(self._key, self._pos, min(size, self._size - self._pos))
+        self._pos += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        # the rest of the object in one GET (RawIOBase's default reads 8 KiB at a time)
+        return self.read(max(0, self._size - self._pos))
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 pool: int = DEFAULT_POOL, multipart_mb: float = DEFAULT_MULTIPART_MB) -> None:
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        # path-style addressing works with MinIO and other self-hosted endpoints
+        config = Config(
+            max_pool_connections=pool,
+            retries={'max_attempts': 5, 'mode': 'adaptive'},
+            s3={'addressing_style': 'path'} if endpoint_url else None,
+        )
+        # boto3 clients are thread-safe; this one (and its connection pool) is shared
+        self.client = boto3.session.Session().client('s3', endpoint_url=endpoint_url, region_name=region, config=config)
+        chunk = int(multipart_mb * 1024 * 1024)
+        self.transfer = TransferConfig(multipart_threshold=chunk, multipart_chunksize=chunk,
+                                       max_concurrency=max(1, min(10, pool // 2)), use_threads=True)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def location(self, key: str) -> str:
+        return f's3://{self.bucket}/{self._key(key)}'
+
+    def key_of(self, location: str) -> Optional[str]:
+        base = f's3://{self.bucket}/{self.prefix}'
+        return location[len(base):] if location.startswith(base) else None
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        if len(data) >= self.transfer.multipart_threshold:
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket, self._key(key), Config=self.transfer)
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+        return key
+
+    def put_file(self, key: str, path: str) -> str:
+        # multipart above the threshold, parts sent in parallel
+        self.client.upload_file(path, self.bucket, self._key(key), Config=self.transfer)
+        return key
+
+    def get_bytes(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+
+    def get_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b''
+        resp = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f'bytes={start}-{start + length - 1}')
+        return resp['Body'].read()
+
+    def open(self, key: str) -> BinaryIO:
+        info = self.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        return io.BufferedReader(_RangedReader(self, key, info.size), buffer_size=READ_CHUNK)
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as ex:
+            if ex.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return ObjectInfo(key, int(head['ContentLength']), int(head['LastModified'].timestamp() * 1e9))
+
+    def copy(self, src_key: str, dest_key: str) -> str:
+        # server-side; multipart copy for large objects
+        self.client.copy({'Bucket': self.bucket, 'Key': self._key(src_key)}, self.bucket, self._key(dest_key), Config=self.transfer)
+        return dest_key
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix: str) -> Iterator[ObjectInfo]:
+        base = self._key(prefix.rstrip('/') + '/' if prefix else '')
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=base, Delimiter='/'):
+            for obj in page.get('Contents', ()):
+                yield ObjectInfo(obj['Key'][len(self.prefix):], int(obj['Size']), int(obj['LastModified'].timestamp() * 1e9))
+
+
+_storage: Optional[Storage] = None
+_lock = threading.Lock()
+
+
+def from_env() -> Storage:
+    kind = os.environ.get('FOODLENS_STORAGE', 'local').lower()
+    if kind == 's3':
+        bucket = os.environ.get('FOODLENS_S3_BUCKET')
+        if not bucket:
+            raise RuntimeError('FOODLENS_STORAGE=s3 needs FOODLENS_S3_BUCKET')
+        return S3Storage(
+            bucket,
+            prefix=os.environ.get('FOODLENS_S3_PREFIX', ''),
+            endpoint_url=os.environ.get('FOODLENS_S3_ENDPOINT') or None,
+            region=os.environ.get('FOODLENS_S3_REGION') or None,
+            pool=int(os.environ.get('FOODLENS_S3_POOL', str(DEFAULT_POOL))),
+            multipart_mb=float(os.environ.get('FOODLENS_S3_MULTIPART_MB', str(DEFAULT_MULTIPART_MB))),
+        )
+    if kind != 'local':
+        raise RuntimeError(f"Unknown FOODLENS_STORAGE {kind!r} (expected 'local' or 's3')")
+    return LocalStorage()
+
+
+def get_storage() -> Storage:
+    """The process-wide storage driver (created on first use)."""
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                _storage = from_env()
+    return _storage
+
+
+def open_location(location: str) -> BinaryIO:
+    """Open what `Storage.location()` returned (or any local path) through the configured storage."""
+    return get_storage().open_location(location)
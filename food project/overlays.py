@@ -0,0 +1,92 @@
+"""On-demand detection overlays.
+
+Analysis no longer writes a full-resolution `*_annotated.jpg` next to every
+capture. The boxes and labels are kept in the detection result, and this
+module draws them only when someone asks to see them: onto the same
+640px ingest-size image the detector saw, cached under `cache/overlays` by
+image digest and the detections drawn, so a second look costs one file read
+and a result from other detector settings never shows stale boxes.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+import detection_cache
+import image_ingest
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+OVERLAY_DIR = os.environ.get('FOODLENS_OVERLAY_DIR', os.path.join(PROJECT_ROOT, 'cache', 'overlays'))
+JPEG_QUALITY = 85
+
+# fixed palette; a label always gets the same colour
+PALETTE = ['#e6194b', '#3cb44b', '#4363d8', '#f58231', '#911eb4', '#42d4f4', '#f032e6', '#bfef45', '#469990', '#9a6324']
+
+
+def _colour(label: str) -> str:
+    return PALETTE[int(hashlib.md5(label.encode('utf-8')).hexdigest(), 16) % len(PALETTE)]
+
+
+def overlay_key(digest: str, result: Dict[str, Any]) -> str:
+    """Cache key for drawing `result` over the image with SHA-256 `digest`."""
+    drawn = {'detections': result['detections'].to_dict(), 'image_size': list(result.get('image_size') or ())}
+    return hashlib.sha256((digest + '|' + json.dumps(drawn, sort_keys=True)).encode('utf-8')).hexdigest()
+
+
+def overlay_path(key: str) -> str:
+    return os.path.join(OVERLAY_DIR, key[:2], key + '.jpg')
+
+
+def draw(image: image_ingest.IngestedImage, result: Dict[str, Any]) -> Any:
+    """PIL image of `image` with the result's boxes and labels drawn on it."""
+    from PIL import Image, ImageDraw
+
+    canvas = Image.fromarray(image.rgb).convert('RGB')
+    pen = ImageDraw.Draw(canvas)
+    # boxes are in the coordinates of the image the detector saw
+    src_w, src_h = result.get('image_size') or image.size
+    sx = canvas.width / max(1, src_w)
+    sy = canvas.height / max(1, src_h)
+    width = max(2, canvas.width // 200)
+    det = result['detections']
+    for (label, conf), box in zip(det.pairs(), det.boxes.tolist()):
+        x1, y1, x2, y2 = box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy
+        if x2 <= x1 or y2 <= y1:
+            continue
+        colour = _colour(label)
+        pen.rectangle((x1, y1, x2, y2), outline=colour, width=width)
+        text = f"{label} {conf:.2f}"
+        tx1, ty1, tx2, ty2 = pen.textbbox((x1, y1), text)
+        top = max(0, y1 - (ty2 - ty1) - 4)
+        pen.rectangle((x1, top, x1 + (tx2 - tx1) + 6, top + (ty2 - ty1) + 4), fill=colour)
+        pen.text((x1 + 3, top + 2), text, fill='#ffffff')
+    return canvas
+
+
+def _load(path: str, data: Optional[bytes]) -> image_ingest.IngestedImage:
+    return image_ingest.ingest(data) if data is not None else image_ingest.load_file(path)
+
+
+def render(path: str, result: Dict[str, Any], digest: Optional[str] = None, data: Optional[bytes] = None) -> str:
+    """Path of a JPEG showing `result` over the image at `path`.
+
+    Rendered on the first request and cached by `overlay_key()`. Pass the
+    image `digest` when it is known and the image `data` when it is in
+    memory or not on local disk; the image is only decoded on a cache miss.
+    """
+    if digest is None:
+        digest = detection_cache.hash_bytes(data) if data is not None else detection_cache.hash_file(path)
+    target = overlay_path(overlay_key(digest, result))
+    if os.path.exists(target):
+        return target
+    image = _load(path, data)
+    canvas = draw(image, result)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        canvas.save(f, format='JPEG', quality=JPEG_QUALITY)
+    os.replace(tmp, target)
+    return target
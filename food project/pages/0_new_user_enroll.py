@@ -1,7 +1,5 @@
 import streamlit as st
-import os
-import json
-import hashlib
+import users
 
 
 def render():
@@ -51,9 +49,6 @@ def render():
     inputPassword = st.text_input("Choose a password:", type="password", key="enroll_password")
     remember = st.checkbox("Remember me on this device", value=True, key="enroll_remember")
     st.divider()
-    # Path to store credentials (hashed password)
-    ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    CRED_PATH = os.path.join(ROOT, 'credentials.json')
 
     inputName = st.text_input("Name: ", key="enroll_name")
     st.write("Hello ", inputName, "!")
@@ -79,7 +74,7 @@ def render():
     st.divider()
 
     if st.button("Submit", key="enroll_submit"):
-        st.session_state['enrollment'] = {
+        enrollment = {
             'name': inputName,
             'age': inputAge,
             'gender': inputGender,
@@ -88,25 +83,25 @@ def render():
             'diet': inputDiet,
             'username': inputUsername,
         }
-        # store credentials in session_state for simple session-based login
-        st.session_state['credentials'] = {
-            'username': inputUsername,
-            'password': inputPassword,
-        }
-        # Persist hashed credentials if user opted in
+        # Persist the account (hashed password) with its profile if user opted in
+        saved = True
         if remember:
-            to_save = {
-                'username': inputUsername,
-                'password_hash': hashlib.sha256(inputPassword.encode()).hexdigest(),
-                'enrollment': st.session_state.get('enrollment', {})
-            }
             try:
-                with open(CRED_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(to_save, f)
+                users.create(inputUsername, inputPassword, enrollment, remember=True)
+            except users.UsernameTaken:
+                st.error("That username is already taken. Please choose another one.")
+                saved = False
             except Exception as e:
                 st.warning(f"Could not save credentials: {e}")
-        st.session_state['enrolled'] = True
-        st.success("Thank you for submitting your information!")
+        if saved:
+            st.session_state['enrollment'] = enrollment
+            # store credentials in session_state for simple session-based login
+            st.session_state['credentials'] = {
+                'username': inputUsername,
+                'password': inputPassword,
+            }
+            st.session_state['enrolled'] = True
+            st.success("Thank you for submitting your information!")
     st.divider()
 
     st.write("Your data will be used to tailor diet recommendations specifically for you.")
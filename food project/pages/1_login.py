@@ -1,7 +1,7 @@
 import streamlit as st
-import os
-import json
-import hashlib
+import catalog
+import favorites
+import users
 from st_compat import rerun
 
 
@@ -40,25 +40,16 @@ def render():
         unsafe_allow_html=True,
     )
 
-    # Load persisted credentials if present
-    ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    CRED_PATH = os.path.join(ROOT, 'credentials.json')
-    file_creds = None
-    if os.path.exists(CRED_PATH):
-        try:
-            with open(CRED_PATH, 'r', encoding='utf-8') as f:
-                file_creds = json.load(f)
-                # expose to session for later use
-                st.session_state['credentials_file'] = file_creds
-        except Exception:
-            file_creds = None
-
     # Logoff handled by dashboard sidebar; do not create per-page logoff button
 
     st.title("Login")
     st.divider()
 
-    prefill_user = file_creds.get('username') if file_creds else ''
+    # prefill the account last remembered on this server (cached, no disk read per rerun)
+    try:
+        prefill_user = users.remembered() or ''
+    except Exception:
+        prefill_user = ''
     username = st.text_input("Username", value=prefill_user, key="login_username")
     password = st.text_input("Password", type="password", key="login_password")
     remember = st.checkbox("Remember me on this device", value=False, key="login_remember")
@@ -68,28 +59,40 @@ def render():
 
     if st.button("Login", key="login_submit"):
         creds = st.session_state.get('credentials')
-        # First check session credentials (freshly enrolled in this run)
-        valid = False
-        if creds and username == creds.get('username') and password == creds.get('password'):
-            valid = True
-        # Otherwise check persisted file credentials (compare hashed password)
-        if not valid and file_creds:
-            if username == file_creds.get('username') and hashlib.sha256(password.encode()).hexdigest() == file_creds.get('password_hash'):
-                valid = True
+        # Saved accounts are checked first (hashed password), so a session-only enrollment
+        # cannot log in under a name that belongs to someone else
+        account = None
+        try:
+            account = users.get(username)
+        except Exception as e:
+            st.warning(f"Could not read saved accounts: {e}")
+        if account is not None:
+            valid = users.check_password(password, account.password_hash)
+        else:
+            # otherwise session credentials (freshly enrolled in this run)
+            valid = bool(creds and username == creds.get('username') and password == creds.get('password'))
 
         if valid:
             st.session_state['authenticated'] = True
             st.session_state['user'] = username
+            if account is not None and account.profile:
+                st.session_state['enrollment'] = account.profile
+            # restore saved favourites (catalog IDs -> current catalog paths)
+            try:
+                cat = catalog.get()
+                st.session_state['favorites'] = [cat.by_id[i].path for i in favorites.load(username) if i in cat.by_id]
+            except Exception:
+                st.session_state['favorites'] = []
             # Persist if requested
             if remember:
                 try:
-                    to_save = {
-                        'username': username,
-                        'password_hash': hashlib.sha256(password.encode()).hexdigest(),
-                        'enrollment': st.session_state.get('enrollment', {})
-                    }
-                    with open(CRED_PATH, 'w', encoding='utf-8') as f:
-                        json.dump(to_save, f)
+                    if account is None:
+                        # enrolled this session without saving: store the account now
+                        users.create(username, password, st.session_state.get('enrollment', {}), remember=True)
+                    else:
+                        users.remember(username)
+                except users.UsernameTaken:
+                    pass
                 except Exception as e:
                     st.warning(f"Could not save credentials: {e}")
 
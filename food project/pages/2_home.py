@@ -1,4 +1,5 @@
 import streamlit as st
+import meal_log
 
 
 def render():
@@ -32,6 +33,24 @@ def render():
     st.divider()
     st.write("You're now logged in. Use the sidebar to navigate.")
 
+    # Meals logged from the Image Capture page over the last 30 days
+    if user:
+        try:
+            last30 = meal_log.summary(str(user), days=30)
+        except Exception:
+            last30 = None
+        if last30 and last30['meals']:
+            st.divider()
+            st.subheader('Your last 30 days')
+            cols = st.columns(4)
+            cols[0].metric('Meals logged', last30['meals'])
+            cols[1].metric('Avg calories / meal', f"{int(last30['per_meal']['calories'])}")
+            cols[2].metric('Avg protein / meal', f"{last30['per_meal']['protein']:.1f} g")
+            cols[3].metric('Avg carbs / meal', f"{last30['per_meal']['carbs']:.1f} g")
+            top = meal_log.top_items(str(user), days=30)
+            if top:
+                st.write("Most eaten: " + ", ".join(f"{name} ({count})" for name, count in top))
+
     # Logoff handled by dashboard sidebar; do not create per-page logoff button
 
 
@@ -2,11 +2,12 @@
 # importing necessary libraries
 import streamlit as st
 import os
-import shutil
-import re
-import base64
-import io
-from PIL import Image, ImageOps
+import catalog
+import catalog_search
+import favorites
+import thumbnails
+import visual_index
+from st_compat import fragment
 
 # displaying page content
 def render():
@@ -83,25 +84,9 @@ def render():
     st.divider()
 
     # Show all images from a `favourites_option` directory and allow selecting favorites
-    project_root = os.path.dirname(os.path.dirname(__file__))
-    candidates = [
-        os.path.join(project_root, 'images_data', 'favourites_option'),
-        os.path.join(project_root, 'image_data', 'favourites_option'),
-        os.path.join(project_root, 'images', 'favourites_option'),
-        os.path.join(project_root, 'favourites_option'),
-    ]
-    # files and locations
-    image_files = []
-    for c in candidates:
-        if os.path.isdir(c):
-            for fname in sorted(os.listdir(c)):
-                # skip bunch-bananas-6175887.webp from recommendations
-                if fname.lower() == 'bunch-bananas-6175887.webp':
-                    continue
-                if fname.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.avif')):
-                    image_files.append(os.path.join(c, fname))
-            if image_files:
-                break
+    # shared, watcher-refreshed catalog snapshot: no directory scans or stats during a render
+    cat = catalog.get()
+    image_files = cat.paths
     # If no images found, show placeholder
     if not image_files:
         st.info('No recommendation images found in favourites_option — showing placeholder.')
@@ -111,198 +96,179 @@ def render():
     if 'favorites' not in st.session_state:
         st.session_state['favorites'] = []
 
-    # Helper to safely resolve and display image paths (avoid passing bare file ids to st.image)
+    # Helper to resolve a favorite (catalog path, user-folder copy or file name) to its catalog item
     def _resolve_image_path(p):
-        # If absolute/relative path exists, return it
-        if os.path.isabs(p) and os.path.exists(p):
-            return p
-        alt = os.path.join(project_root, p)
-        if os.path.exists(alt):
-            return alt
-
-        # Try looking under images_data folders for the basename
-        base = os.path.basename(p)
-        search_dirs = [
-            os.path.join(project_root, 'images_data'),
-            os.path.join(project_root, 'images_data', 'favourites_option'),
-        ]
-        # include user's folders if available
-        if st.session_state.get('authenticated') and st.session_state.get('user'):
-            uid = str(st.session_state.get('user'))
-            search_dirs.insert(0, os.path.join(project_root, 'images_data', uid, 'favourites'))
-            search_dirs.insert(0, os.path.join(project_root, 'images_data', uid, 'food_to_analyse'))
-
-        for d in search_dirs:
-            candidate = os.path.join(d, base)
-            if os.path.exists(candidate):
-                return candidate
-
-        # Not found — return None
-        return None
+        item = cat.resolve(p)
+        return item.path if item is not None else None
 
     # Helper callback to toggle favorites so button label updates immediately
     def _toggle_favorite(path):
         if 'favorites' not in st.session_state:
             st.session_state['favorites'] = []
+        item = cat.resolve(path)
+        user_id = str(st.session_state.get('user')) if st.session_state.get('authenticated') and st.session_state.get('user') else None
         if path in st.session_state['favorites']:
             st.session_state['favorites'].remove(path)
-            # saving favorite to user folder
-            if st.session_state.get('authenticated') and st.session_state.get('user'):
-                user_id = str(st.session_state.get('user'))
-                user_dir = os.path.join(project_root, 'images_data', user_id, 'favourites')
+            # drop it from the user's favourites manifest
+            if user_id and item is not None:
                 try:
-                    target = os.path.join(user_dir, os.path.basename(path))
-                    if os.path.exists(target):
-                        os.remove(target)
+                    favorites.remove(user_id, item.id)
                 except Exception:
-                    st.warning('Could not remove favorite from user folder')
+                    st.warning('Could not remove favorite from your saved favorites')
         # if not favorited
         else:
             st.session_state['favorites'].append(path)
-            # checks if logged in
-            if st.session_state.get('authenticated') and st.session_state.get('user'):
-                user_id = str(st.session_state.get('user'))
-                # folder path
-                user_dir = os.path.join(project_root, 'images_data', user_id, 'favourites')
+            # record the catalog ID in the user's manifest (restored at login)
+            if user_id and item is not None:
                 try:
-                    os.makedirs(user_dir, exist_ok=True)
-                    # defines where the image will be saved
-                    target = os.path.join(user_dir, os.path.basename(path))
-                    if not os.path.exists(target):
-                        shutil.copy(path, target)
+                    favorites.add(user_id, item.id)
                 # warning if unable to save
                 except Exception:
-                    st.warning('Could not save favorite to user folder')
+                    st.warning('Could not save favorite')
 
     # Render each image in its own row with a favorite button on the left
     # Use a fixed square size so all pictures show at the same width and height
     # Reduced size so three thumbnails visually fit per row
     IMG_SIZE = (160, 160)
     THUMB_SIZE = IMG_SIZE
+    # catalog tiles per grid page and favorites shown at once, so a rerun sends a bounded number of thumbnails
+    PAGE_SIZE = 12
+    FAVORITES_SHOWN = 12
 
-    def _load_thumb(path, size=IMG_SIZE):
-        try:
-            img = Image.open(path)
-            return ImageOps.fit(img.convert('RGB'), size, Image.LANCZOS)
-        except Exception:
-            return None
-
-    def _img_to_datauri(img, fmt='JPEG'):
-        try:
-            buff = io.BytesIO()
-            img.save(buff, format=fmt)
-            b64 = base64.b64encode(buff.getvalue()).decode('ascii')
-            return f"data:image/{fmt.lower()};base64,{b64}"
-        except Exception:
-            return None
-
-    def _render_thumb(col, thumb, label, is_fav, outline=False, gap=False):
+    def _render_thumb(col, uri, label, is_fav, outline=False, gap=False):
         # background: use light blue for all thumbnails
         bg = '#eef9ff'
         outline_style = "border:2px solid #d6f0ff;" if outline else ""
         gap_style = "margin:8px;" if gap else ""
-        if thumb is None:
+        if uri:
+            img_tag = f"<img src=\"{uri}\" style='width:{IMG_SIZE[0]}px;height:{IMG_SIZE[1]}px;object-fit:cover;border-radius:6px;'/>"
+        else:
             # use placeholder
             img_tag = f"<img src='https://via.placeholder.com/{IMG_SIZE[0]}' style='width:{IMG_SIZE[0]}px;height:{IMG_SIZE[1]}px;object-fit:cover;border-radius:6px;'/>"
-        else:
-            uri = _img_to_datauri(thumb)
-            if uri:
-                img_tag = f"<img src=\"{uri}\" style='width:{IMG_SIZE[0]}px;height:{IMG_SIZE[1]}px;object-fit:cover;border-radius:6px;'/>"
-            else:
-                img_tag = f"<img src='https://via.placeholder.com/{IMG_SIZE[0]}' style='width:{IMG_SIZE[0]}px;height:{IMG_SIZE[1]}px;object-fit:cover;border-radius:6px;'/>"
 
         html = f"<div style='background:{bg};padding:6px;border-radius:8px;display:inline-block;{outline_style}{gap_style}'>{img_tag}<div style='text-align:center;margin-top:6px;font-size:12px;color:#222'>{label}</div></div>"
         col.markdown(html, unsafe_allow_html=True)
-    # Display all candidate images in rows of three with uniform thumbnails
+    search_index = catalog_search.index_for(cat)
+    visual_index.refresh_in_background(list(cat.stats.values()), version=cat.version)
+    if 'catalog_page' not in st.session_state:
+        st.session_state['catalog_page'] = 0
+
+    def _thumbs(paths):
+        # Thumbnails for just the tiles on screen, from the shared cache; misses are generated in parallel
+        resolved = {p: _resolve_image_path(p) for p in paths}
+        uris = thumbnails.data_uris([r for r in resolved.values() if r], THUMB_SIZE, stats=cat.stats)
+        return {p: uris.get(r) for p, r in resolved.items()}
+
+    def _goto_page(page):
+        st.session_state['catalog_page'] = page
+
+    def _recommended(favs):
+        # Recommendations: suggest more foods similar to user's favorites
+        # Ranked by CLIP image similarity once the embedding index is built (in the background);
+        # until then, by catalog metadata shared with the favorites
+        similar = visual_index.recommend([_resolve_image_path(p) or p for p in favs], k=3)
+        if similar is not None:
+            return [p for p, _ in similar]
+        # items sharing the most distinctive tags, macro groups or cuisine with the favorites
+        fav_ids = [item.id for item in (cat.resolve(p) for p in favs) if item is not None]
+        recommended = [cat.by_id[meta.id].path for meta, _ in search_index.similar(fav_ids, k=3)]
+        if not recommended:
+            fav_set = set(favs)
+            recommended = [p for p in image_files if p not in fav_set][:3]
+        return recommended
+
+    # Each favourite toggle reruns only its own tile; the search results, the grid page and
+    # the favourites/recommendations panel rerun on their own, sharing the favourites list
+    # through st.session_state. The panel has no widget the tiles can trigger, so it polls
+    # every PANEL_REFRESH_SECONDS to pick up favourites toggled elsewhere on the page.
     chunk_size = 3
-    for i in range(0, len(image_files), chunk_size):
-        row_cols = st.columns(chunk_size)
-        for idx, img_path in enumerate(image_files[i:i+chunk_size]):
-            c = row_cols[idx]
-            name = os.path.basename(img_path)
-            resolved = _resolve_image_path(img_path)
-            is_fav = img_path in st.session_state['favorites']
-            btn_key = f"fav_btn_{i+idx}_{name}"
-            btn_label = "Favorited" if is_fav else "Select as favorite"
+    PANEL_REFRESH_SECONDS = 3
 
-            if resolved:
-                thumb = _load_thumb(resolved, THUMB_SIZE)
-                _render_thumb(c, thumb, name, is_fav)
-            else:
-                _render_thumb(c, None, name, is_fav)
+    @fragment
+    def _tile(path, key, uri, outline=False):
+        is_fav = path in st.session_state['favorites']
+        _render_thumb(st, uri, os.path.basename(path), is_fav, outline=outline)
+        # Favorite toggle below each image
+        st.button("Favorited" if is_fav else "Select as favorite", key=key, on_click=_toggle_favorite, args=(path,))
 
-            # Favorite toggle below each image
-            c.button(btn_label, key=btn_key, on_click=_toggle_favorite, args=(img_path,))
+    def _tiles(paths, key_prefix, offset=0, outline=False):
+        # Rows of three uniform thumbnails; the thumbnails are fetched in one batch
+        thumbs = _thumbs(paths)
+        for i in range(0, len(paths), chunk_size):
+            row_cols = st.columns(chunk_size)
+            for idx, path in enumerate(paths[i:i+chunk_size]):
+                with row_cols[idx]:
+                    _tile(path, f"{key_prefix}_{offset + i + idx}_{os.path.basename(path)}", thumbs.get(path), outline)
 
-    # Show current favorites list
-    if st.session_state['favorites']:
+    # Catalog search: tags, names, macro groups and cuisine from the shared index
+    @fragment
+    def _search():
+        search_cols = st.columns([3, 1])
+        query = search_cols[0].text_input('Search the catalog', key='catalog_query', placeholder='e.g. lentils, protein, indian')
+        veg_only = search_cols[1].checkbox('Vegetarian only', key='catalog_veg_only')
+        if not query.strip():
+            return
+        hits = search_index.search(query, k=6, vegetarian=True if veg_only else None)
+        hit_paths = [cat.by_id[meta.id].path for meta, _ in hits]
+        if hit_paths:
+            _tiles(hit_paths, 'search_fav', outline=True)
+        else:
+            st.info('No catalog items match your search.')
         st.divider()
-        # heading section
-        st.write("Your favorites:")
+
+    # Display one page of candidate images at a time
+    @fragment
+    def _grid():
+        pages = max(1, -(-len(image_files) // PAGE_SIZE))
+        page = min(st.session_state['catalog_page'], pages - 1)
+        _tiles(image_files[page * PAGE_SIZE:(page + 1) * PAGE_SIZE], 'fav_btn', offset=page * PAGE_SIZE)
+
+        # page navigation
+        if pages > 1:
+            nav_cols = st.columns(3)
+            nav_cols[0].button('Previous', key='catalog_prev', disabled=page == 0, on_click=_goto_page, args=(page - 1,))
+            nav_cols[1].markdown(f"<div style='text-align:center;padding-top:14px'>Page {page + 1} of {pages}</div>", unsafe_allow_html=True)
+            nav_cols[2].button('Next', key='catalog_next', disabled=page >= pages - 1, on_click=_goto_page, args=(page + 1,))
+
+    @fragment(run_every=PANEL_REFRESH_SECONDS)
+    def _panel():
         favs = st.session_state['favorites']
-        chunk_size = 3
+        if not favs:
+            return
+        shown_favs = favs[-FAVORITES_SHOWN:]
+        recommended = []
+        if len(set(favs)) < len(image_files):
+            try:
+                recommended = _recommended(favs)
+            except Exception:
+                # non-fatal: if recommendation logic fails, silently continue
+                recommended = []
+        thumbs = _thumbs(shown_favs + recommended)
+
+        # Show current favorites list (most recent ones)
+        st.divider()
+        # heading section
+        st.write("Your favorites:" if len(favs) <= FAVORITES_SHOWN else f"Your favorites (latest {FAVORITES_SHOWN} of {len(favs)}):")
         # display favorites in rows of three
-        for i in range(0, len(favs), chunk_size):
+        for i in range(0, len(shown_favs), chunk_size):
             row_cols = st.columns(chunk_size)
-            for idx, p in enumerate(favs[i:i+chunk_size]):
-                c = row_cols[idx]
-                resolved = _resolve_image_path(p)
-                if resolved:
-                    thumb = _load_thumb(resolved, THUMB_SIZE)
-                    is_fav = p in st.session_state.get('favorites', [])
-                    _render_thumb(c, thumb, os.path.basename(p), is_fav)
-                else:
-                    _render_thumb(c, None, os.path.basename(p), False)
-
-    # Recommendations: suggest more foods similar to user's favorites
-    # Build simple token-based similarity from filenames and recommend top matches
-    try:
-        favs = st.session_state.get('favorites', [])
-        candidates_set = [p for p in image_files if p not in favs]
-        if favs and candidates_set:
-            # collect tokens from favorite filenames
-            fav_tokens = set()
-            for p in favs:
-                base = os.path.splitext(os.path.basename(p))[0].lower()
-                for t in re.split(r'[^a-z0-9]+', base):
-                    if t:
-                        fav_tokens.add(t)
-
-            # score candidates by token overlap
-            scores = []
-            for p in candidates_set:
-                base = os.path.splitext(os.path.basename(p))[0].lower()
-                tokens = set([t for t in re.split(r'[^a-z0-9]+', base) if t])
-                overlap = len(tokens & fav_tokens)
-                scores.append((overlap, p))
+            for idx, p in enumerate(shown_favs[i:i+chunk_size]):
+                _render_thumb(row_cols[idx], thumbs.get(p), os.path.basename(p), True)
 
-            # choose top matches (overlap > 0) else fall back to first candidates
-            scores.sort(reverse=True)
-            recommended = [p for s, p in scores if s > 0]
-            if not recommended:
-                recommended = [p for _, p in scores][:3]
-            recommended = recommended[:3]
+        if recommended:
+            st.divider()
+            st.subheader('Recommended for you')
+            rec_cols = st.columns(3)
+            for i, p in enumerate(recommended):
+                c = rec_cols[i % 3]
+                _render_thumb(c, thumbs.get(p), os.path.basename(p), False, outline=True)
+                btn_key = f"rec_add_{i}_{os.path.basename(p)}"
+                # allow adding recommended item to favorites
+                c.button('Add to favorites', key=btn_key, on_click=_toggle_favorite, args=(p,))
 
-            if recommended:
-                st.divider()
-                st.subheader('Recommended for you')
-                rec_cols = st.columns(3)
-                for i, p in enumerate(recommended):
-                    c = rec_cols[i % 3]
-                    resolved = _resolve_image_path(p)
-                    label = os.path.basename(p)
-                    if resolved:
-                        thumb = _load_thumb(resolved, THUMB_SIZE)
-                        is_fav = p in st.session_state.get('favorites', [])
-                        _render_thumb(c, thumb, label, is_fav, outline=True)
-                    else:
-                        _render_thumb(c, None, label, False, outline=True)
-                    btn_key = f"rec_add_{i}_{os.path.basename(p)}"
-                    # allow adding recommended item to favorites
-                    c.button('Add to favorites', key=btn_key, on_click=_toggle_favorite, args=(p,))
-    except Exception:
-        # non-fatal: if recommendation logic fails, silently continue
-        pass
+    _search()
+    _grid()
+    _panel()
 
 # runs fully only when the file is executed directly
 if __name__ == "__main__":
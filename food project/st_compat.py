@@ -2,20 +2,33 @@
 
 Provide a stable `rerun()` function that works across Streamlit versions.
 Call `st_compat.rerun()` instead of `st.experimental_rerun()`.
+`fragment` marks a function as a partial-rerun fragment where supported.
 """
 from __future__ import annotations
 
+from typing import Any, Callable, Optional, TypeVar
+
 import streamlit as st
 
+F = TypeVar('F', bound=Callable[..., object])
+
 
 def rerun() -> None:
     """Request a rerun of the Streamlit script in a version-agnostic way.
 
-    Tries the documented `st.experimental_rerun()` first. If not present, it
-    falls back to raising the internal `RerunException`. As a last resort it
-    calls `st.stop()` so execution ends cleanly.
+    Tries the documented `st.rerun()` (Streamlit >= 1.27) and then
+    `st.experimental_rerun()`. If neither is present, it falls back to raising
+    the internal `RerunException`. As a last resort it calls `st.stop()` so
+    execution ends cleanly.
     """
-    # Preferred public API when available
+    # Preferred public API when available; the rerun exception it raises is a
+    # BaseException, so it passes through the `except Exception` below
+    if hasattr(st, "rerun"):
+        try:
+            st.rerun()
+            return
+        except Exception:
+            pass
     if hasattr(st, "experimental_rerun"):
         try:
             st.experimental_rerun()
@@ -36,3 +49,25 @@ def rerun() -> None:
         except Exception:
             # If even that fails, there's nothing sensible to do here.
             return
+
+
+# partial reruns are available (`fragment` is more than a pass-through)
+FRAGMENTS = (getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)) is not None
+
+
+def fragment(func: Optional[F] = None, *, run_every: Optional[float] = None) -> Any:
+    """Decorator running `func` as a fragment: its widgets rerun only `func`.
+
+    Uses `st.fragment` (Streamlit >= 1.37) or `st.experimental_fragment`
+    (1.33-1.36). With `run_every` (seconds) the fragment also reruns itself
+    on that interval, e.g. to poll a background job without rerunning the
+    page. Use as `@fragment` or `@fragment(run_every=...)`. On older
+    versions `func` is returned unchanged and its widgets rerun the whole
+    page as before (check `FRAGMENTS` before relying on `run_every`).
+    """
+    if func is None:
+        return lambda f: fragment(f, run_every=run_every)
+    deco = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if deco is None:
+        return func
+    return deco(func, run_every=run_every) if run_every else deco(func)
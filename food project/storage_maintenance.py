@@ -0,0 +1,428 @@
+"""Compaction and retention for captured images and caches.
+
+One `run()` applies a `Policy` to the captured photos (`captures/` and
+`<user>/food_to_analyse/`) and to the derived caches; the catalog and user
+favourites are never touched. In order:
+
+1. Legacy `*_annotated.*` copies are deleted; overlays are drawn on demand
+   now (see `overlays`).
+2. Retention: captures older than `max_age_days` are evicted, then the
+   oldest ones until the captures fit in `quota_mb`.
+3. Remaining JPEG/PNG/BMP originals are re-encoded to WebP (or AVIF) at
+   `quality` if that actually saves space. The file keeps its name,
+   extension and mtime (Pillow and browsers go by the content), so saved
+   paths, meal log sources and retention ages stay valid; every path
+   sharing the image (see `blob_store`) is relinked to the new blob. Cached
+   detection results and batch index records are carried over to the new
+   bytes so nothing is analysed again. Images are only downscaled when
+   `max_side` is set.
+4. Cache budget: files in the thumbnail, overlay and detection caches older
+   than `cache_max_age_days` are removed, then the oldest until the caches
+   fit in `cache_quota_mb`. They are regenerated on demand.
+5. Unreferenced blobs are garbage-collected (`blob_store.collect_garbage`).
+
+It is safe against the running app: files younger than `min_age_hours`
+are left alone (an analysis may still be reading them), every replacement
+is written under a temporary name and renamed into place (a reader sees
+the old or the new bytes, never a mix), and only one run
+happens at a time per process (and per host, where `fcntl` exists).
+
+The report lists the bytes reclaimed, measured as the change in disk usage
+of the images in images_data with hard-linked files counted once, the
+bytes freed in the caches, and the bytes of replaced blobs that the garbage
+collector frees once its grace period has passed.
+
+Command line::
+
+    python storage_maintenance.py run [--dry-run] [--max-age-days N] [--quota-mb N] [--format webp|avif]
+                                      [--cache-max-age-days N] [--cache-quota-mb N]
+
+In the app, set FOODLENS_MAINTENANCE_HOURS to run it on a daemon thread
+every N hours; policy defaults come from FOODLENS_MAINT_* variables.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import batch_analyze
+import blob_store
+import detection_cache
+import overlays
+import thumbnails
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+# caches that are rebuilt on demand and kept within the cache budget
+CACHE_DIRS = (thumbnails.THUMB_DIR, overlays.OVERLAY_DIR, detection_cache.CACHE_DIR)
+# written by earlier versions, no longer read
+LEGACY_DERIVATIVE_DIR = os.path.join(PROJECT_ROOT, 'cache', 'derivatives')
+LOCK_PATH = os.path.join(PROJECT_ROOT, 'cache', 'maintenance.lock')
+REENCODE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+IMAGE_EXTS = REENCODE_EXTS + ('.webp', '.avif', '.gif')
+# a re-encode has to save at least this share of the original to be kept
+MIN_SAVING = 0.1
+
+
+class Policy(NamedTuple):
+    format: str = 'webp'
+    quality: int = 80
+    # downscale re-encoded originals to this long side; None keeps full resolution
+    max_side: Optional[int] = None
+    max_age_days: Optional[float] = None
+    quota_mb: Optional[float] = None
+    min_age_hours: float = 24.0
+    cache_max_age_days: Optional[float] = 30.0
+    cache_quota_mb: Optional[float] = 512.0
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def policy_from_env() -> Policy:
+    default = Policy()
+    return Policy(
+        format=os.environ.get('FOODLENS_MAINT_FORMAT', default.format).lower(),
+        quality=int(_env_float('FOODLENS_MAINT_QUALITY') or default.quality),
+        max_side=int(_env_float('FOODLENS_MAINT_MAX_SIDE') or 0) or default.max_side,
+        max_age_days=_env_float('FOODLENS_MAINT_MAX_AGE_DAYS'),
+        quota_mb=_env_float('FOODLENS_MAINT_QUOTA_MB'),
+        min_age_hours=_env_float('FOODLENS_MAINT_MIN_AGE_HOURS') or default.min_age_hours,
+        cache_max_age_days=_env_float('FOODLENS_MAINT_CACHE_MAX_AGE_DAYS') or default.cache_max_age_days,
+        cache_quota_mb=_env_float('FOODLENS_MAINT_CACHE_QUOTA_MB') or default.cache_quota_mb,
+    )
+
+
+def _capture_dirs(root: str) -> Iterator[str]:
+    yield os.path.join(root, 'captures')
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir() and entry.path != blob_store.BLOB_DIR:
+                    yield os.path.join(entry.path, 'food_to_analyse')
+    except OSError:
+        return
+
+
+def _capture_files(root: str) -> List[Tuple[str, os.stat_result]]:
+    out = []
+    for d in _capture_dirs(root):
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                        out.append((entry.path, entry.stat()))
+        except OSError:
+            continue
+    return out
+
+
+def disk_usage(root: str) -> int:
+    """Bytes used by image files under `root` (blobs included), hard links counted once."""
+    seen: Set[Tuple[int, int]] = set()
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for fname in filenames:
+            if os.path.splitext(fname)[1].lower() not in IMAGE_EXTS:
+                continue
+            try:
+                st = os.lstat(os.path.join(dirpath, fname))
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key not in seen:
+                seen.add(key)
+                total += st.st_size
+    return total
+
+
+def _encode(path: str, fmt: str, quality: int, max_side: Optional[int]) -> Optional[bytes]:
+    """`path` re-encoded as `fmt`, or None if it already is."""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        if (img.format or '').lower() == fmt:
+            return None
+        if max_side:
+            img.draft('RGB', (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+        if max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+    buff = io.BytesIO()
+    img.save(buff, format=fmt.upper(), quality=quality)
+    return buff.getvalue()
+
+
+def _carry_results(old: Optional[str], new: str) -> bool:
+    """Make the cached detection result of blob `old` the result of its re-encoding `new`."""
+    if old is None:
+        return False
+    import food_analysis
+
+    entry = detection_cache.get(food_analysis.cache_key(old))
+    return entry is not None and detection_cache.put(food_analysis.cache_key(new), entry)
+
+
+def _cache_files() -> List[Tuple[str, os.stat_result]]:
+    out = []
+    for d in CACHE_DIRS:
+        for dirpath, _, filenames in os.walk(d):
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                try:
+                    out.append((path, os.stat(path)))
+                except OSError:
+                    continue
+    return out
+
+
+def _prune_caches(policy: Policy, now: float, settled: float, dry_run: bool) -> Tuple[int, int]:
+    """Apply the cache age/size budget; returns `(files_removed, bytes_freed)`."""
+    files = sorted(_cache_files(), key=lambda f: f[1].st_mtime)
+    cutoff = now - policy.cache_max_age_days * 86400 if policy.cache_max_age_days is not None else None
+    total = sum(st.st_size for _, st in files)
+    quota = policy.cache_quota_mb * 1e6 if policy.cache_quota_mb is not None else None
+    removed = freed = 0
+    for path, st in files:
+        if path.endswith('.tmp'):
+            # left behind by an interrupted write; fresh ones may still be in progress
+            expired = st.st_mtime <= settled
+        else:
+            expired = (cutoff is not None and st.st_mtime < cutoff) or (quota is not None and total > quota)
+        if not expired:
+            continue
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        removed += 1
+        freed += st.st_size
+        total -= st.st_size
+    if not dry_run and os.path.isdir(LEGACY_DERIVATIVE_DIR):
+        shutil.rmtree(LEGACY_DERIVATIVE_DIR, ignore_errors=True)
+    return removed, freed
+
+
+def _groups(files: List[Tuple[str, os.stat_result]]) -> List[Tuple[List[str], os.stat_result]]:
+    """Paths that are the same file on disk (hard links), oldest group first."""
+    by_inode: Dict[Tuple[int, int], Tuple[List[str], os.stat_result]] = {}
+    for path, st in files:
+        by_inode.setdefault((st.st_dev, st.st_ino), ([], st))[0].append(path)
+    return sorted(by_inode.values(), key=lambda g: g[1].st_mtime)
+
+
+class _HostLock:
+    """Exclusive lock file where fcntl exists; a no-op elsewhere."""
+
+    def __enter__(self) -> bool:
+        try:
+            import fcntl
+        except ImportError:
+            self._f = None
+            return True
+        os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+        self._f = open(LOCK_PATH, 'w')
+        try:
+            fcntl.flock(self._f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._f.close()
+            self._f = None
+            return False
+        return True
+
+    def __exit__(self, *exc: Any) -> None:
+        if self._f is not None:
+            self._f.close()
+
+
+_run_lock = threading.Lock()
+
+
+def run(policy: Optional[Policy] = None, root: str = blob_store.DATA_ROOT, dry_run: bool = False) -> Dict[str, Any]:
+    """Apply `policy` once and return a report (counts and bytes)."""
+    policy = policy or policy_from_env()
+    if not _run_lock.acquire(blocking=False):
+        return {'skipped': 'already running'}
+    try:
+        with _HostLock() as locked:
+            if not locked:
+                return {'skipped': 'already running in another process'}
+            return _run(policy, root, dry_run)
+    finally:
+        _run_lock.release()
+
+
+def _run(policy: Policy, root: str, dry_run: bool) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        'annotated_deleted': 0, 'evicted': 0, 'reencoded': 0, 'reencode_skipped': 0, 'results_carried': 0,
+        'cache_files_removed': 0, 'cache_bytes_freed': 0, 'blobs_collected': 0, 'dry_run': dry_run,
+    }
+    before = disk_usage(root)
+    now = time.time()
+    settled = now - policy.min_age_hours * 3600
+    files = [(p, st) for p, st in _capture_files(root) if st.st_mtime <= settled]
+
+    def _drop(paths: List[str]) -> None:
+        if not dry_run:
+            for p in paths:
+                blob_store.unlink(p)
+
+    # 1. legacy annotated copies
+    keep = []
+    for path, st in files:
+        if os.path.splitext(os.path.basename(path))[0].endswith('_annotated'):
+            _drop([path])
+            report['annotated_deleted'] += 1
+        else:
+            keep.append((path, st))
+    groups = _groups(keep)
+
+    # 2. retention by age, then by quota (oldest first)
+    if policy.max_age_days is not None:
+        cutoff = now - policy.max_age_days * 86400
+        old = [g for g in groups if g[1].st_mtime < cutoff]
+        groups = [g for g in groups if g[1].st_mtime >= cutoff]
+        for paths, _ in old:
+            _drop(paths)
+            report['evicted'] += len(paths)
+    if policy.quota_mb is not None:
+        quota = policy.quota_mb * 1e6
+        total = sum(st.st_size for _, st in groups)
+        while groups and total > quota:
+            paths, st = groups.pop(0)
+            _drop(paths)
+            total -= st.st_size
+            report['evicted'] += len(paths)
+
+    # 3. re-encode originals in place
+    fmt = policy.format
+    reencoded: List[str] = []
+    for paths, st in groups:
+        path = paths[0]
+        if os.path.splitext(path)[1].lower() not in REENCODE_EXTS:
+            continue
+        if dry_run:
+            # would be re-encoded (the saving is only known after encoding)
+            report['reencoded'] += len(paths)
+            continue
+        try:
+            data = _encode(path, fmt, policy.quality, policy.max_side)
+        except Exception:
+            data = None
+        if data is None or len(data) > st.st_size * (1 - MIN_SAVING):
+            report['reencode_skipped'] += len(paths)
+            continue
+        old = blob_store.digest_of(path)
+        # same extension as the paths, so the blob and its references agree
+        digest = blob_store.put_bytes(data, os.path.splitext(path)[1])
+        for p in paths:
+            # atomic replace under the same name
+            blob_store.link(digest, p)
+            # keep the capture's age for retention and for anything keyed on mtime
+            os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns))
+        try:
+            report['results_carried'] += int(_carry_results(old, digest))
+        except Exception:
+            pass
+        reencoded.extend(paths)
+        report['reencoded'] += len(paths)
+    if reencoded:
+        index = os.path.join(root, os.path.basename(batch_analyze.DEFAULT_INDEX))
+        try:
+            batch_analyze.restat(reencoded, root, index)
+        except OSError:
+            pass
+
+    # 4. caches
+    report['cache_files_removed'], report['cache_bytes_freed'] = _prune_caches(policy, now, settled, dry_run)
+
+    if not dry_run:
+        # 5. blobs nothing points at any more (after blob_store's grace period)
+        removed, _ = blob_store.collect_garbage()
+        report['blobs_collected'] = removed
+        # replaced or evicted images still inside the grace period; freed by a later run
+        report['bytes_pending_gc'] = blob_store.stats()['unreferenced_bytes']
+
+    after = before if dry_run else disk_usage(root)
+    report['bytes_before'] = before
+    report['bytes_after'] = after
+    report['bytes_reclaimed'] = before - after
+    return report
+
+
+_last_report: Optional[Dict[str, Any]] = None
+_thread: Optional[threading.Thread] = None
+_thread_lock = threading.Lock()
+
+
+def start_background(interval_hours: Optional[float] = None, policy: Optional[Policy] = None) -> bool:
+    """Run `run()` every `interval_hours` on a daemon thread (once per process).
+
+    Defaults to FOODLENS_MAINTENANCE_HOURS; does nothing if that is unset or 0.
+    """
+    global _thread
+    hours = interval_hours if interval_hours is not None else _env_float('FOODLENS_MAINTENANCE_HOURS')
+    if not hours or hours <= 0 or _thread is not None:
+        return False
+
+    def _loop() -> None:
+        global _last_report
+        while True:
+            try:
+                _last_report = run(policy)
+            except Exception as ex:
+                _last_report = {'error': str(ex) or type(ex).__name__}
+            time.sleep(hours * 3600)
+
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name='storage-maintenance', daemon=True)
+            _thread.start()
+    return True
+
+
+def last_report() -> Optional[Dict[str, Any]]:
+    return _last_report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compact and expire captured images and caches.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('run', help='apply the policy once')
+    p.add_argument('--dry-run', action='store_true')
+    p.add_argument('--max-age-days', type=float)
+    p.add_argument('--quota-mb', type=float)
+    p.add_argument('--format', choices=('webp', 'avif'))
+    p.add_argument('--quality', type=int)
+    p.add_argument('--min-age-hours', type=float)
+    p.add_argument('--max-side', type=int)
+    p.add_argument('--cache-max-age-days', type=float)
+    p.add_argument('--cache-quota-mb', type=float)
+    args = parser.parse_args(argv)
+
+    policy = policy_from_env()
+    overrides = {k: getattr(args, k) for k in ('max_age_days', 'quota_mb', 'format', 'quality', 'min_age_hours',
+                                               'max_side', 'cache_max_age_days', 'cache_quota_mb')
+                 if getattr(args, k) is not None}
+    report = run(policy._replace(**overrides), dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+    if 'bytes_reclaimed' in report:
+        print(f"reclaimed {report['bytes_reclaimed'] / 1e6:.1f} MB", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+import os
+
+import batch_analyze
+
+
+def _touch(root, rel):
+    path = os.path.join(root, *rel.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    return path
+
+
+def test_iter_images_skips_blobs_catalog_and_annotated(tmp_path):
+    root = str(tmp_path)
+    for rel in ('blobs/7c/7c8f0000.jpg', 'u1/food_to_analyse/a.jpg', 'u1/favourites/tofu.jpg',
+                'favourites_option/tofu.jpg', 'captures/c.png', 'captures/c_annotated.jpg', 'captures/notes.txt'):
+        _touch(root, rel)
+    found = [batch_analyze._rel(p, root) for p in batch_analyze.iter_images(root)]
+    assert found == ['captures/c.png', 'u1/food_to_analyse/a.jpg']
@@ -0,0 +1,219 @@
+"""Storage drivers: local disk and S3 against a local stand-in.
+
+The common tests run against `LocalStorage` in a temporary images_data and
+against moto's in-process S3; the S3 ones also run against a real
+S3-compatible server (e.g. MinIO) when FOODLENS_TEST_S3_ENDPOINT is set::
+
+    docker run -p 9000:9000 minio/minio server /data
+    FOODLENS_TEST_S3_ENDPOINT=http://localhost:9000 AWS_ACCESS_KEY_ID=minioadmin \
+        AWS_SECRET_ACCESS_KEY=minioadmin python -m pytest tests/test_object_store.py
+"""
+import os
+import threading
+import uuid
+
+import pytest
+
+import blob_store
+import object_store
+
+MB = 1024 * 1024
+
+
+def _local(tmp_path, monkeypatch):
+    root = str(tmp_path / 'images_data')
+    # blob_store keeps its paths (and a schema flag) at module level
+    monkeypatch.setattr(blob_store, 'DATA_ROOT', root)
+    monkeypatch.setattr(blob_store, 'BLOB_DIR', os.path.join(root, 'blobs'))
+    monkeypatch.setattr(blob_store, 'DB_PATH', os.path.join(root, 'blobs', 'refs.sqlite3'))
+    monkeypatch.setattr(blob_store, '_local', threading.local())
+    monkeypatch.setattr(blob_store, '_schema_ready', False)
+    yield object_store.LocalStorage(root)
+
+
+def _moto():
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='foodlens-test')
+        yield object_store.S3Storage('foodlens-test', prefix='app', region='us-east-1', multipart_mb=5)
+
+
+def _minio():
+    endpoint = os.environ.get('FOODLENS_TEST_S3_ENDPOINT')
+    if not endpoint:
+        pytest.skip('FOODLENS_TEST_S3_ENDPOINT not set')
+    pytest.importorskip('boto3')
+    bucket = f'foodlens-test-{uuid.uuid4().hex[:12]}'
+    storage = object_store.S3Storage(bucket, prefix='app', endpoint_url=endpoint, region='us-east-1', multipart_mb=5)
+    storage.client.create_bucket(Bucket=bucket)
+    try:
+        yield storage
+    finally:
+        for page in storage.client.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+            for obj in page.get('Contents', ()):
+                storage.client.delete_object(Bucket=bucket, Key=obj['Key'])
+        storage.client.delete_bucket(Bucket=bucket)
+
+
+@pytest.fixture(params=['local', 'moto', 'minio'])
+def storage(request, tmp_path, monkeypatch):
+    if request.param == 'local':
+        yield from _local(tmp_path, monkeypatch)
+    else:
+        yield from (_moto() if request.param == 'moto' else _minio())
+
+
+@pytest.fixture(params=['moto', 'minio'])
+def s3_storage(request):
+    yield from (_moto() if request.param == 'moto' else _minio())
+
+
+def _count_gets(storage):
+    gets = []
+    storage.client.meta.events.register('before-parameter-build.s3.GetObject', lambda **kwargs: gets.append(kwargs['params'].get('Range')))
+    return gets
+
+
+def test_put_get_stat_delete(storage):
+    data = os.urandom(1000)
+    assert storage.put_bytes('captures/a.jpg', data) == 'captures/a.jpg'
+    assert storage.get_bytes('captures/a.jpg') == data
+    assert storage.stat('captures/a.jpg').size == 1000
+    assert storage.exists('captures/a.jpg')
+    storage.delete('captures/a.jpg')
+    assert not storage.exists('captures/a.jpg')
+    assert storage.stat('captures/a.jpg') is None
+
+
+def test_keys_live_under_prefix(s3_storage):
+    s3_storage.put_bytes('captures/a.jpg', b'x')
+    keys = [o['Key'] for o in s3_storage.client.list_objects_v2(Bucket=s3_storage.bucket)['Contents']]
+    assert keys == ['app/captures/a.jpg']
+
+
+def test_open_reads_and_seeks(storage):
+    data = os.urandom(3 * object_store.READ_CHUNK)
+    storage.put_bytes('big.bin', data)
+    with storage.open('big.bin') as f:
+        assert f.read(16) == data[:16]
+        f.seek(2 * object_store.READ_CHUNK + 5)
+        assert f.read(10) == data[2 * object_store.READ_CHUNK + 5:2 * object_store.READ_CHUNK + 15]
+        f.seek(0)
+        assert f.read() == data
+    assert storage.get_range('big.bin', 10, 20) == data[10:30]
+    # clipped at the end of the object
+    assert storage.get_range('big.bin', len(data) - 4, 100) == data[-4:]
+
+
+def test_ranged_open_fetches_only_what_is_read(s3_storage, monkeypatch):
+    storage = s3_storage
+    data = os.urandom(3 * object_store.READ_CHUNK)
+    storage.put_bytes('big.bin', data)
+    ranges = []
+    get_range = storage.get_range
+
+    def counting(key, start, length):
+        ranges.append((start, length))
+        return get_range(key, start, length)
+
+    monkeypatch.setattr(storage, 'get_range', counting)
+    with storage.open('big.bin') as f:
+        assert f.read(16) == data[:16]
+        assert ranges == [(0, object_store.READ_CHUNK)]
+        f.seek(2 * object_store.READ_CHUNK + 5)
+        assert f.read(10) == data[2 * object_store.READ_CHUNK + 5:2 * object_store.READ_CHUNK + 15]
+        assert len(ranges) == 2
+        f.seek(0)
+        assert f.read() == data
+    assert storage.get_range('big.bin', 10, 20) == data[10:30]
+    # clipped at the end of the object
+    assert storage.get_range('big.bin', len(data) - 4, 100) == data[-4:]
+
+
+def test_full_reads_are_one_get(s3_storage):
+    data = os.urandom(3 * MB)
+    s3_storage.put_bytes('captures/big.jpg', data)
+    gets = _count_gets(s3_storage)
+    assert s3_storage.read_location(s3_storage.location('captures/big.jpg')) == data
+    assert gets == [None]
+    gets.clear()
+    with s3_storage.open('captures/big.jpg') as f:
+        assert f.read() == data
+    assert gets == ['bytes=0-%d' % (len(data) - 1)]
+    gets.clear()
+    with s3_storage.open('captures/big.jpg') as f:
+        f.seek(100)
+        assert f.read(2 * MB) == data[100:100 + 2 * MB]
+        assert f.read() == data[100 + 2 * MB:]
+    assert len(gets) <= 3
+
+
+def test_open_missing_raises(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.open('nope.jpg')
+
+
+def test_list_is_one_level(storage):
+    for key in ('favourites_option/b.jpg', 'favourites_option/a.jpg', 'favourites_option/sub/c.jpg', 'other/d.jpg'):
+        storage.put_bytes(key, b'x' * 3)
+    listed = list(storage.list('favourites_option'))
+    assert [o.key for o in listed] == ['favourites_option/a.jpg', 'favourites_option/b.jpg']
+    assert all(o.size == 3 and o.mtime_ns > 0 for o in listed)
+
+
+def test_copy_is_server_side(storage, monkeypatch):
+    data = os.urandom(2048)
+    storage.put_bytes('captures/a.jpg', data)
+    monkeypatch.setattr(storage, 'get_bytes', lambda key: pytest.fail('copy read the object through the app'))
+    assert storage.copy('captures/a.jpg', 'bob/food_to_analyse/a.jpg') == 'bob/food_to_analyse/a.jpg'
+    monkeypatch.undo()
+    assert storage.get_bytes('bob/food_to_analyse/a.jpg') == data
+
+
+def test_multipart_above_threshold(s3_storage, tmp_path):
+    storage = s3_storage
+    data = os.urandom(11 * MB)
+    storage.put_bytes('big/upload.bin', data)
+    path = tmp_path / 'file.bin'
+    path.write_bytes(data)
+    storage.put_file('big/file.bin', str(path))
+    storage.put_bytes('small.bin', data[:MB])
+    for key, parts in (('big/upload.bin', 3), ('big/file.bin', 3), ('small.bin', None)):
+        etag = storage.client.head_object(Bucket=storage.bucket, Key=storage._key(key))['ETag'].strip('"')
+        # multipart uploads get an "<md5>-<parts>" ETag
+        assert (etag.split('-')[1] if '-' in etag else None) == (str(parts) if parts else None)
+    assert storage.get_bytes('big/upload.bin') == data
+    assert storage.get_bytes('big/file.bin') == data
+
+
+def test_locations(storage, tmp_path):
+    storage.put_bytes('captures/a.jpg', b'stored')
+    location = storage.location('captures/a.jpg')
+    assert storage.read_location(location) == b'stored'
+    with storage.open_location(location) as f:
+        assert f.read() == b'stored'
+    if storage.is_local:
+        # a local location is the file itself
+        assert location == storage.local_path('captures/a.jpg')
+        assert storage.key_of(location) is None
+        return
+    assert location == f's3://{storage.bucket}/app/captures/a.jpg'
+    assert storage.key_of(location) == 'captures/a.jpg'
+    # anything else is a local file, relative paths included
+    local = tmp_path / 'x.jpg'
+    local.write_bytes(b'local')
+    assert storage.key_of(str(local)) is None
+    assert storage.read_location(str(local)) == b'local'
+    assert storage.key_of('s3://another-bucket/app/captures/a.jpg') is None
+
+
+def test_incomplete_driver_fails_on_creation():
+    class Partial(object_store.Storage):
+        def get_bytes(self, key):
+            return b''
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,170 @@
+"""Thumbnail cache for the recommendation grid.
+
+Thumbnails are keyed by (path, mtime, size) of the source image and the
+thumbnail size, so an edited or replaced image gets a new thumbnail and an
+unchanged one is never decoded again. Two tiers:
+
+* memory: ready-to-embed `data:image/jpeg;base64,...` URIs in an LRU shared
+  by all sessions of the server process. A warm grid render only does dict
+  lookups.
+* disk: the encoded JPEGs under `cache/thumbs`, so a restart re-reads small
+  files instead of decoding full-size WebP/AVIF/JPEG images.
+
+Misses in both tiers are generated on a thread pool (Pillow releases the GIL
+while decoding and resampling), all in parallel.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import object_store
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+THUMB_DIR = os.environ.get('FOODLENS_THUMB_DIR', os.path.join(PROJECT_ROOT, 'cache', 'thumbs'))
+THUMB_SIZE = (160, 160)
+JPEG_QUALITY = 85
+MEMORY_ENTRIES = 2048
+WORKERS = int(os.environ.get('FOODLENS_THUMB_WORKERS', str(min(8, (os.cpu_count() or 2)))))
+
+# (path, mtime_ns, size) of a source image
+Stat = Tuple[str, int, int]
+
+_uris: 'OrderedDict[str, str]' = OrderedDict()
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_counters = {'memory_hits': 0, 'disk_hits': 0, 'generated': 0, 'failed': 0}
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='thumbs')
+    return _pool
+
+
+def stat_of(path: str) -> Optional[Stat]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def cache_key(stat: Stat, size: Tuple[int, int] = THUMB_SIZE) -> str:
+    path, mtime_ns, nbytes = stat
+    raw = f"{os.path.abspath(path)}|{mtime_ns}|{nbytes}|{size[0]}x{size[1]}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(THUMB_DIR, key[:2], key + '.jpg')
+
+
+def _to_uri(jpeg: bytes) -> str:
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')
+
+
+def _remember(key: str, uri: str) -> None:
+    with _lock:
+        _uris[key] = uri
+        _uris.move_to_end(key)
+        while len(_uris) > MEMORY_ENTRIES:
+            _uris.popitem(last=False)
+
+
+def _render(path: str, size: Tuple[int, int]) -> bytes:
+    from PIL import Image, ImageOps
+
+    with object_store.open_location(path) as f, Image.open(f) as img:
+        # JPEG can decode at a reduced scale directly; other formats ignore this
+        img.draft('RGB', (size[0] * 2, size[1] * 2))
+        img = ImageOps.exif_transpose(img)
+        thumb = ImageOps.fit(img.convert('RGB'), size, Image.LANCZOS)
+    buff = io.BytesIO()
+    thumb.save(buff, format='JPEG', quality=JPEG_QUALITY)
+    return buff.getvalue()
+
+
+def _load_or_render(key: str, path: str, size: Tuple[int, int]) -> Optional[str]:
+    disk = _disk_path(key)
+    try:
+        with open(disk, 'rb') as f:
+            jpeg = f.read()
+        counter = 'disk_hits'
+    except OSError:
+        try:
+            jpeg = _render(path, size)
+        except Exception:
+            with _lock:
+                _counters['failed'] += 1
+            return None
+        counter = 'generated'
+        try:
+            os.makedirs(os.path.dirname(disk), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(disk), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(jpeg)
+            os.replace(tmp, disk)
+        except OSError:
+            # the memory tier still works if the disk is read-only or full
+            pass
+    uri = _to_uri(jpeg)
+    _remember(key, uri)
+    with _lock:
+        _counters[counter] += 1
+    return uri
+
+
+def data_uris(paths: Iterable[str], size: Tuple[int, int] = THUMB_SIZE, stats: Optional[Dict[str, Stat]] = None) -> Dict[str, Optional[str]]:
+    """JPEG data URIs for `paths` (None for images that cannot be read).
+
+    Pass `stats` (path -> (path, mtime_ns, size)) when they are already known
+    to skip the `os.stat` per path. Cache misses are generated in parallel.
+    """
+    out: Dict[str, Optional[str]] = {}
+    todo = {}
+    for path in paths:
+        if path in out or path in todo:
+            continue
+        stat = (stats or {}).get(path) or stat_of(path)
+        if stat is None:
+            out[path] = None
+            continue
+        key = cache_key(stat, size)
+        with _lock:
+            uri = _uris.get(key)
+            if uri is not None:
+                _uris.move_to_end(key)
+                _counters['memory_hits'] += 1
+        if uri is not None:
+            out[path] = uri
+        else:
+            todo[path] = key
+    if len(todo) == 1:
+        path, key = next(iter(todo.items()))
+        out[path] = _load_or_render(key, path, size)
+    elif todo:
+        futures = {path: _executor().submit(_load_or_render, key, path, size) for path, key in todo.items()}
+        for path, fut in futures.items():
+            out[path] = fut.result()
+    return out
+
+
+def data_uri(path: str, size: Tuple[int, int] = THUMB_SIZE) -> Optional[str]:
+    return data_uris([path], size)[path]
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters, memory_entries=len(_uris))
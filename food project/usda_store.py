@@ -0,0 +1,353 @@
+"""Local store of USDA FoodData Central foods.
+
+`import_fdc()` reads a FoodData Central bulk download from disk (the CSV
+folder or one of the JSON files) and writes a compact SQLite database with
+one row per food: name, data type and calories/protein/carbs/fat per
+serving. Names are indexed twice: a B-tree on the normalized name for exact
+lookups and an FTS5 table for word matches. Nothing is loaded into memory at
+startup; each lookup is one indexed query on a read-only connection.
+
+FDC reports nutrients per 100 g. When the download includes portions
+(`food_portion.csv`, `foodPortions`, or a branded serving size in grams) the
+first portion is used as the serving, otherwise 100 g.
+
+The database is built under a temporary name and moved into place, so the
+running app keeps serving the old copy until the import finishes.
+
+Command line::
+
+    python usda_store.py import ~/Downloads/FoodData_Central_csv_2024-04-18
+    python usda_store.py import FoodData_Central_foundation_food_json_2024-04-18.json
+    python usda_store.py lookup "cheddar cheese"
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import nutrition
+from nutrition import NUTRIENTS, normalize
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('FOODLENS_USDA_DB', os.path.join(PROJECT_ROOT, 'data', 'usda_foods.sqlite3'))
+
+# FDC nutrient IDs for each of our nutrients, in order of preference
+NUTRIENT_IDS = {
+    'calories': (1008, 2047, 2048),  # Energy (kcal), then the Atwater factors
+    'protein': (1003,),
+    'carbs': (1005,),
+    'fat': (1004,),
+}
+# when several foods share a name, prefer the curated data sets
+DATA_TYPE_PRIORITY = {'foundation_food': 0, 'sr_legacy_food': 1, 'survey_fndds_food': 2, 'branded_food': 3}
+# `dataType` in the JSON downloads -> `data_type` in the CSV download
+JSON_DATA_TYPES = {'Foundation': 'foundation_food', 'SR Legacy': 'sr_legacy_food', 'Survey (FNDDS)': 'survey_fndds_food', 'Branded': 'branded_food'}
+BATCH_ROWS = 10000
+
+_wanted = {nid: (k, rank) for k, ids in NUTRIENT_IDS.items() for rank, nid in enumerate(ids)}
+_local = threading.local()
+
+
+# --- import -------------------------------------------------------------
+
+def _csv_rows(path: str) -> Iterator[Dict[str, str]]:
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        yield from csv.DictReader(f)
+
+
+def _batched(rows: Iterable[Tuple[Any, ...]]) -> Iterator[List[Tuple[Any, ...]]]:
+    batch: List[Tuple[Any, ...]] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _staging(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        '''
+        CREATE TABLE raw_food (fdc_id INTEGER PRIMARY KEY, name TEXT NOT NULL, data_type TEXT);
+        CREATE TABLE raw_nutrient (fdc_id INTEGER NOT NULL, nutrient TEXT NOT NULL, pref INTEGER NOT NULL, amount REAL NOT NULL);
+        CREATE TABLE raw_portion (fdc_id INTEGER NOT NULL, seq INTEGER NOT NULL, grams REAL NOT NULL);
+        '''
+    )
+
+
+def _load_csv(conn: sqlite3.Connection, folder: str) -> None:
+    for batch in _batched(
+        (int(r['fdc_id']), r['description'], r.get('data_type', ''))
+        for r in _csv_rows(os.path.join(folder, 'food.csv')) if r.get('description')
+    ):
+        conn.executemany('INSERT OR REPLACE INTO raw_food VALUES (?, ?, ?)', batch)
+
+    def nutrients() -> Iterator[Tuple[Any, ...]]:
+        for r in _csv_rows(os.path.join(folder, 'food_nutrient.csv')):
+            hit = _wanted.get(int(r['nutrient_id'])) if r.get('nutrient_id', '').isdigit() else None
+            amount = _float(r.get('amount'))
+            if hit is not None and amount is not None:
+                yield int(r['fdc_id']), hit[0], hit[1], amount
+
+    for batch in _batched(nutrients()):
+        conn.executemany('INSERT INTO raw_nutrient VALUES (?, ?, ?, ?)', batch)
+
+    def portions() -> Iterator[Tuple[Any, ...]]:
+        path = os.path.join(folder, 'food_portion.csv')
+        if os.path.exists(path):
+            for r in _csv_rows(path):
+                grams = _float(r.get('gram_weight'))
+                if grams:
+                    yield int(r['fdc_id']), int(_float(r.get('seq_num')) or 0), grams
+        path = os.path.join(folder, 'branded_food.csv')
+        if os.path.exists(path):
+            for r in _csv_rows(path):
+                grams = _float(r.get('serving_size'))
+                if grams and r.get('serving_size_unit', '').lower() in ('g', 'grm'):
+                    yield int(r['fdc_id']), 0, grams
+
+    for batch in _batched(portions()):
+        conn.executemany('INSERT INTO raw_portion VALUES (?, ?, ?)', batch)
+
+
+def _load_json(conn: sqlite3.Connection, path: str) -> None:
+    # the JSON downloads wrap one list of foods in a single top-level key
+    with open(path, 'r', encoding='utf-8') as f:
+        doc = json.load(f)
+    foods = next((v for v in doc.values() if isinstance(v, list)), []) if isinstance(doc, dict) else doc
+    food_rows, nutrient_rows, portion_rows = [], [], []
+    for food in foods:
+        fdc_id = food.get('fdcId')
+        name = food.get('description')
+        if fdc_id is None or not name:
+            continue
+        food_rows.append((fdc_id, name, JSON_DATA_TYPES.get(food.get('dataType', ''), '')))
+        for fn in food.get('foodNutrients', ()):
+            hit = _wanted.get((fn.get('nutrient') or {}).get('id'))
+            amount = _float(fn.get('amount'))
+            if hit is not None and amount is not None:
+                nutrient_rows.append((fdc_id, hit[0], hit[1], amount))
+        for seq, portion in enumerate(food.get('foodPortions', ())):
+            grams = _float(portion.get('gramWeight'))
+            if grams:
+                portion_rows.append((fdc_id, portion.get('sequenceNumber', seq), grams))
+        if (food.get('servingSizeUnit') or '').lower() in ('g', 'grm') and _float(food.get('servingSize')):
+            portion_rows.append((fdc_id, 0, _float(food['servingSize'])))
+    conn.executemany('INSERT OR REPLACE INTO raw_food VALUES (?, ?, ?)', food_rows)
+    conn.executemany('INSERT INTO raw_nutrient VALUES (?, ?, ?, ?)', nutrient_rows)
+    conn.executemany('INSERT INTO raw_portion VALUES (?, ?, ?)', portion_rows)
+
+
+def _build(conn: sqlite3.Connection) -> int:
+    conn.create_function('normalize', 1, normalize, deterministic=True)
+    conn.create_function('priority', 1, lambda t: DATA_TYPE_PRIORITY.get(t or '', len(DATA_TYPE_PRIORITY)), deterministic=True)
+    conn.executescript(
+        '''
+        CREATE INDEX raw_nutrient_food ON raw_nutrient(fdc_id, nutrient, pref);
+        CREATE INDEX raw_portion_food ON raw_portion(fdc_id, seq);
+        CREATE TABLE foods (
+            fdc_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            norm_name TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            serving_g REAL NOT NULL,
+            calories REAL NOT NULL,
+            protein REAL NOT NULL,
+            carbs REAL NOT NULL,
+            fat REAL NOT NULL
+        );
+        '''
+    )
+    # best-preference amount per (food, nutrient), scaled from per-100 g to one serving
+    per_100g = {
+        k: f"(SELECT amount FROM raw_nutrient n WHERE n.fdc_id = f.fdc_id AND n.nutrient = '{k}' ORDER BY pref LIMIT 1)"
+        for k in NUTRIENTS
+    }
+    conn.execute(
+        f'''
+        INSERT INTO foods
+        SELECT fdc_id, name, normalize(name), priority(data_type), serving_g,
+               {', '.join(f"COALESCE({k}, 0) * serving_g / 100.0" for k in NUTRIENTS)}
+        FROM (
+            SELECT f.fdc_id, f.name, f.data_type,
+                   COALESCE((SELECT grams FROM raw_portion p WHERE p.fdc_id = f.fdc_id ORDER BY seq LIMIT 1), 100.0) AS serving_g,
+                   {', '.join(f"{expr} AS {k}" for k, expr in per_100g.items())}
+            FROM raw_food f
+        )
+        WHERE calories IS NOT NULL
+        '''
+    )
+    conn.executescript(
+        '''
+        DROP TABLE raw_food;
+        DROP TABLE raw_nutrient;
+        DROP TABLE raw_portion;
+        CREATE INDEX foods_norm_name ON foods(norm_name, priority);
+        CREATE VIRTUAL TABLE foods_fts USING fts5(name, content='foods', content_rowid='fdc_id');
+        INSERT INTO foods_fts(rowid, name) SELECT fdc_id, name FROM foods;
+        INSERT INTO foods_fts(foods_fts) VALUES ('optimize');
+        '''
+    )
+    return conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0]
+
+
+def import_fdc(source: str, db_path: str = DB_PATH) -> int:
+    """Build the store from a FoodData Central CSV folder or JSON file.
+
+    Returns the number of foods written. The previous store stays in place
+    until the new one is complete.
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        _staging(conn)
+        if os.path.isdir(source):
+            _load_csv(conn, source)
+        else:
+            _load_json(conn, source)
+        count = _build(conn)
+        conn.execute('VACUUM')
+    except BaseException:
+        conn.close()
+        os.remove(tmp)
+        raise
+    conn.close()
+    os.replace(tmp, db_path)
+    if db_path == DB_PATH:
+        nutrition.refresh()
+    return count
+
+
+# --- lookups ------------------------------------------------------------
+
+def _connect() -> Optional[sqlite3.Connection]:
+    # one read-only connection per thread, reopened when a new import replaced the file
+    try:
+        mtime = os.stat(DB_PATH).st_mtime_ns
+    except OSError:
+        return None
+    cached = getattr(_local, 'conn', None)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    _local.conn = (mtime, conn)
+    return conn
+
+
+def available() -> bool:
+    return os.path.exists(DB_PATH)
+
+
+def version() -> Optional[int]:
+    """Changes whenever the store is re-imported (None when there is no store)."""
+    try:
+        return os.stat(DB_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+_FIELDS = ('fdc_id', 'name', 'serving_g') + NUTRIENTS
+
+
+def _columns(prefix: str = '') -> str:
+    return ', '.join(prefix + c for c in _FIELDS)
+
+
+def _row(row: Optional[Tuple[Any, ...]]) -> Optional[Dict[str, Any]]:
+    return dict(zip(_FIELDS, row)) if row is not None else None
+
+
+def lookup(name: str) -> Optional[Dict[str, Any]]:
+    """The food whose normalized name equals `name`'s, or None."""
+    conn = _connect()
+    if conn is None:
+        return None
+    return _row(conn.execute(
+        f'SELECT {_columns()} FROM foods WHERE norm_name = ? ORDER BY priority LIMIT 1',
+        (normalize(name),),
+    ).fetchone())
+
+
+def search(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Foods whose names contain every word of `query`, best matches first."""
+    conn = _connect()
+    words = re.findall(r'[a-z0-9]+', normalize(query))
+    if conn is None or not words:
+        return []
+    match = ' '.join(f'"{w}"' for w in words)
+    rows = conn.execute(
+        f'''
+        SELECT {_columns('f.')}
+        FROM foods_fts JOIN foods f ON f.fdc_id = foods_fts.rowid
+        WHERE foods_fts MATCH ?
+        ORDER BY f.priority, bm25(foods_fts), length(f.name)
+        LIMIT ?
+        ''',
+        (match, limit),
+    ).fetchall()
+    return [_row(r) for r in rows]
+
+
+def best_match(name: str) -> Optional[Dict[str, Any]]:
+    """Exact name match, else the best word match."""
+    hit = lookup(name)
+    if hit is None:
+        found = search(name, limit=1)
+        hit = found[0] if found else None
+    return hit
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Import and query the local USDA FoodData Central store.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    imp = sub.add_parser('import', help='build the store from a CSV folder or JSON file')
+    imp.add_argument('source')
+    look = sub.add_parser('lookup', help='look a food name up')
+    look.add_argument('name')
+    look.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'import':
+        start = time.perf_counter()
+        count = import_fdc(args.source)
+        print(f"imported {count} foods into {DB_PATH} in {time.perf_counter() - start:.1f}s")
+        return 0
+    if not available():
+        print(f"no store at {DB_PATH}; run the import first", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    exact = lookup(args.name)
+    hits = [exact] if exact else search(args.name, args.limit)
+    elapsed = (time.perf_counter() - start) * 1000
+    for h in hits:
+        print(f"{h['fdc_id']:>8}  {h['name']}  ({h['serving_g']:.0f} g: "
+              f"{h['calories']:.0f} kcal, P {h['protein']:.1f}, C {h['carbs']:.1f}, F {h['fat']:.1f})")
+    print(f"{len(hits)} result(s) in {elapsed:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Account and enrollment-profile store.
+
+Accounts live in one SQLite table (WAL mode, so logins keep reading while
+someone enrolls) keyed by username; a lookup is a primary-key probe however
+many users there are. The enrollment profile is stored as JSON next to the
+password hash. Enrolling is a single INSERT, so two people enrolling at once
+cannot overwrite each other and a taken username is reported instead of
+replaced.
+
+Reads go through a per-process cache of existing accounts (a miss is not
+cached, so probing unknown names cannot grow it). Callers get their own
+copy of the profile, which pages keep in `st.session_state`. Writes made by
+this process update the cache directly; writes from other processes are
+noticed through SQLite's `data_version`, which is read from the shared WAL
+index rather than the database file.
+
+The single-account `credentials.json` of earlier versions is imported the
+first time the store is opened.
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('FOODLENS_USERS_DB', os.path.join(PROJECT_ROOT, 'data', 'users.sqlite3'))
+LEGACY_CREDENTIALS = os.path.join(PROJECT_ROOT, 'credentials.json')
+PBKDF2_ITERATIONS = 200_000
+
+
+class User(NamedTuple):
+    username: str
+    password_hash: str
+    profile: Dict[str, Any]
+
+
+class UsernameTaken(ValueError):
+    pass
+
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+_cache: Dict[str, User] = {}
+_cache_lock = threading.Lock()
+# cached `remembered()` answer: [] until read, then [username or None]
+_remembered: List[Optional[str]] = []
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(
+                '''
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password_hash TEXT NOT NULL,
+                    profile TEXT NOT NULL DEFAULT '{}',
+                    created REAL NOT NULL,
+                    remembered REAL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS users_remembered ON users(remembered) WHERE remembered IS NOT NULL;
+                '''
+            )
+            _import_legacy(conn)
+            _schema_ready = True
+    _local.conn = conn
+    _local.data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    return conn
+
+
+def _import_legacy(conn: sqlite3.Connection) -> None:
+    try:
+        with open(LEGACY_CREDENTIALS, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not isinstance(data, dict) or not data.get('username') or not data.get('password_hash'):
+        return
+    conn.execute(
+        'INSERT OR IGNORE INTO users (username, password_hash, profile, created, remembered) VALUES (?, ?, ?, ?, ?)',
+        (str(data['username']), str(data['password_hash']), json.dumps(data.get('enrollment') or {}), time.time(), time.time()),
+    )
+
+
+def _checked() -> sqlite3.Connection:
+    """Thread connection; drops the read cache if another process changed the database."""
+    conn = _connect()
+    version = conn.execute('PRAGMA data_version').fetchone()[0]
+    if version != _local.data_version:
+        _local.data_version = version
+        with _cache_lock:
+            _cache.clear()
+            _remembered.clear()
+    return conn
+
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), PBKDF2_ITERATIONS).hex()
+    return f'pbkdf2_sha256${PBKDF2_ITERATIONS}${salt}${digest}'
+
+
+def check_password(password: str, stored: str) -> bool:
+    """Compare against a stored hash; plain SHA-256 hex from `credentials.json` is accepted too."""
+    if stored.startswith('pbkdf2_sha256$'):
+        try:
+            _, iterations, salt, digest = stored.split('$')
+            computed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), int(iterations)).hex()
+        except ValueError:
+            return False
+        return hmac.compare_digest(computed, digest)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+def _own(user: User) -> User:
+    # the cached record is shared by every session in the process; hand out a private profile
+    return user._replace(profile=copy.deepcopy(user.profile))
+
+
+def get(username: str) -> Optional[User]:
+    """The account for `username`, or None."""
+    conn = _checked()
+    with _cache_lock:
+        user = _cache.get(username)
+    if user is None:
+        row = conn.execute('SELECT username, password_hash, profile FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            return None
+        user = User(row[0], row[1], json.loads(row[2] or '{}'))
+        with _cache_lock:
+            _cache[username] = user
+    return _own(user)
+
+
+def create(username: str, password: str, profile: Optional[Dict[str, Any]] = None, remember: bool = False) -> User:
+    """Add an account. Raises `UsernameTaken` if the name exists, ValueError if it is empty."""
+    if not username or not password:
+        raise ValueError('username and password are required')
+    user = User(username, hash_password(password), dict(profile or {}))
+    now = time.time()
+    try:
+        _checked().execute(
+            'INSERT INTO users (username, password_hash, profile, created, remembered) VALUES (?, ?, ?, ?, ?)',
+            (username, user.password_hash, json.dumps(user.profile), now, now if remember else None),
+        )
+    except sqlite3.IntegrityError:
+        raise UsernameTaken(username) from None
+    with _cache_lock:
+        _cache[username] = user
+        if remember:
+            _remembered[:] = [username]
+    return _own(user)
+
+
+def verify(username: str, password: str) -> Optional[User]:
+    """The account if `password` is right for `username`, else None."""
+    user = get(username)
+    if user is None or not check_password(password, user.password_hash):
+        return None
+    return user
+
+
+def update_profile(username: str, profile: Dict[str, Any]) -> None:
+    _checked().execute('UPDATE users SET profile = ? WHERE username = ?', (json.dumps(profile), username))
+    with _cache_lock:
+        _cache.pop(username, None)
+
+
+def remember(username: str) -> None:
+    """Mark `username` as the account to prefill on the login form."""
+    _checked().execute('UPDATE users SET remembered = ? WHERE username = ?', (time.time(), username))
+    with _cache_lock:
+        _remembered.clear()
+
+
+def remembered() -> Optional[str]:
+    """Most recently remembered username, or None."""
+    conn = _checked()
+    with _cache_lock:
+        if _remembered:
+            return _remembered[0]
+    row = conn.execute(
+        'SELECT username FROM users WHERE remembered IS NOT NULL ORDER BY remembered DESC LIMIT 1'
+    ).fetchone()
+    with _cache_lock:
+        _remembered[:] = [row[0] if row else None]
+    return _remembered[0]
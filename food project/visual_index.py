@@ -0,0 +1,239 @@
+"""CLIP image-embedding index over the recommendation catalog.
+
+Each catalog image is encoded once with the shared CLIP model and its
+normalized embedding kept in one float32 matrix (`cache/embeddings`), with
+the (path, mtime, size) it was computed from. `refresh()` only encodes
+images that are new or changed and drops removed ones, so keeping the index
+current costs nothing when the catalog has not changed.
+
+`recommend()` scores the whole catalog against the user's favourites with a
+single matrix product (cosine similarity to the mean favourite embedding)
+and picks the top k with `argpartition`, so it stays cheap for catalogs of
+tens of thousands of items.
+
+Building needs the optional 'clip' package; pages should call
+`refresh_in_background()` and fall back to something simpler while
+`recommend()` returns None.
+"""
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import model_registry
+import object_store
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.environ.get('FOODLENS_EMBED_DIR', os.path.join(PROJECT_ROOT, 'cache', 'embeddings'))
+BATCH_SIZE = 32
+
+# (path, mtime_ns, size) of a catalog image
+Stat = Tuple[str, int, int]
+
+
+class _Index:
+    """Immutable snapshot: row i of `vectors` is the embedding of `stats[i]`."""
+
+    def __init__(self, stats: List[Stat], vectors: np.ndarray) -> None:
+        self.stats = stats
+        self.vectors = vectors
+        self.row = {s[0]: i for i, s in enumerate(stats)}
+
+
+_index: Optional[_Index] = None
+_index_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refreshing = False
+_last_error: Optional[str] = None
+# catalog signature of the last failed refresh, so a missing 'clip' package is not retried every rerun
+_failed_sig: Optional[int] = None
+# catalog version (see `catalog.Catalog.version`) the index was last checked against
+_synced_version: Optional[int] = None
+
+
+def _files() -> Tuple[str, str]:
+    return os.path.join(INDEX_DIR, 'vectors.npy'), os.path.join(INDEX_DIR, 'items.json')
+
+
+def _load() -> Optional[_Index]:
+    vec_path, meta_path = _files()
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            stats = [tuple(s) for s in json.load(f)]
+        vectors = np.load(vec_path)
+    except (OSError, ValueError):
+        return None
+    if vectors.ndim != 2 or len(vectors) != len(stats):
+        return None
+    return _Index(stats, vectors)
+
+
+def _save(index: _Index) -> None:
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    vec_path, meta_path = _files()
+    fd, tmp = tempfile.mkstemp(dir=INDEX_DIR, suffix='.npy')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, index.vectors)
+    os.replace(tmp, vec_path)
+    fd, tmp = tempfile.mkstemp(dir=INDEX_DIR, suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump([list(s) for s in index.stats], f)
+    os.replace(tmp, meta_path)
+
+
+def current() -> Optional[_Index]:
+    """The loaded index (read from disk on first use), or None."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load()
+    return _index
+
+
+def _encode(paths: Sequence[str]) -> Tuple[List[int], np.ndarray]:
+    """Embed images in batches; returns the positions that could be read and their vectors."""
+    import torch
+    from PIL import Image
+
+    handle = model_registry.get_model('clip')
+    bundle = handle.model
+    ok: List[int] = []
+    chunks = []
+    for start in range(0, len(paths), BATCH_SIZE):
+        tensors = []
+        for i in range(start, min(start + BATCH_SIZE, len(paths))):
+            try:
+                with object_store.open_location(paths[i]) as f, Image.open(f) as img:
+                    img.draft('RGB', (448, 448))
+                    tensors.append(bundle.preprocess(img.convert('RGB')))
+                ok.append(i)
+            except Exception:
+                continue
+        if not tensors:
+            continue
+        with handle, torch.no_grad():
+            feats = bundle.model.encode_image(torch.stack(tensors).to(bundle.device))
+            feats = feats / feats.norm(dim=-1, keepdim=True)
+        chunks.append(feats.float().cpu().numpy())
+    vectors = np.concatenate(chunks).astype(np.float32) if chunks else np.zeros((0, 0), dtype=np.float32)
+    return ok, vectors
+
+
+def refresh(stats: Sequence[Stat]) -> _Index:
+    """Bring the index in line with `stats` (the catalog as it is now).
+
+    Unchanged images keep their vectors; new or modified ones are encoded;
+    images no longer listed are dropped. The new index is saved and swapped
+    in atomically.
+    """
+    global _index
+    with _refresh_lock:
+        old = current()
+        keep: Dict[str, np.ndarray] = {}
+        todo: List[Stat] = []
+        for stat in stats:
+            row = old.row.get(stat[0]) if old is not None else None
+            if row is not None and tuple(old.stats[row]) == tuple(stat):
+                keep[stat[0]] = old.vectors[row]
+            else:
+                todo.append(stat)
+        if old is not None and not todo and len(keep) == len(old.stats):
+            return old
+        fresh: Dict[str, np.ndarray] = {}
+        if todo:
+            ok, vectors = _encode([s[0] for s in todo])
+            fresh = {todo[i][0]: vectors[j] for j, i in enumerate(ok)}
+        out_stats = [tuple(s) for s in stats if s[0] in keep or s[0] in fresh]
+        rows = [keep.get(s[0], fresh.get(s[0])) for s in out_stats]
+        dim = rows[0].shape[0] if rows else 0
+        index = _Index(out_stats, np.stack(rows).astype(np.float32) if rows else np.zeros((0, dim), dtype=np.float32))
+        _save(index)
+        with _index_lock:
+            _index = index
+        return index
+
+
+def refresh_in_background(stats: Sequence[Stat], version: Optional[int] = None) -> bool:
+    """Start `refresh(stats)` on a daemon thread unless one is running or nothing changed.
+
+    `version` identifies the catalog snapshot `stats` came from; once the
+    index is known to match it, later calls with the same version return
+    without comparing the stats again.
+
+    Returns True while a refresh is (now) in progress.
+    """
+    global _refreshing, _synced_version
+    if version is not None and version == _synced_version:
+        return False
+    index = current()
+    if index is not None and len(index.stats) == len(stats) and all(
+        index.row.get(s[0]) is not None and tuple(index.stats[index.row[s[0]]]) == tuple(s) for s in stats
+    ):
+        _synced_version = version
+        return False
+    sig = hash(tuple(tuple(s) for s in stats))
+    with _index_lock:
+        if _refreshing:
+            return True
+        if sig == _failed_sig:
+            return False
+        _refreshing = True
+
+    def _work() -> None:
+        global _refreshing, _last_error, _failed_sig, _synced_version
+        try:
+            refresh(list(stats))
+            _last_error = _failed_sig = None
+            _synced_version = version
+        except Exception as ex:
+            _last_error = str(ex) or type(ex).__name__
+            _failed_sig = sig
+        finally:
+            with _index_lock:
+                _refreshing = False
+
+    threading.Thread(target=_work, name='visual-index', daemon=True).start()
+    return True
+
+
+def recommend(favorites: Sequence[str], k: int = 3, exclude: Sequence[str] = ()) -> Optional[List[Tuple[str, float]]]:
+    """Top-k catalog paths most similar to `favorites`, as `(path, cosine)`.
+
+    Returns None when there is no index yet or none of the favourites is in
+    it, so callers can fall back to another ranking.
+    """
+    index = current()
+    if index is None or not len(index.stats):
+        return None
+    fav_rows = [index.row[p] for p in favorites if p in index.row]
+    if not fav_rows:
+        return None
+    query = index.vectors[fav_rows].mean(axis=0)
+    norm = float(np.linalg.norm(query))
+    if norm == 0:
+        return None
+    scores = index.vectors @ (query / norm)
+    banned = [index.row[p] for p in list(favorites) + list(exclude) if p in index.row]
+    scores[banned] = -np.inf
+    k = min(k, len(scores) - len(set(banned)))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(index.stats[i][0], float(scores[i])) for i in top]
+
+
+def stats() -> Dict[str, Any]:
+    index = current()
+    return {
+        'items': len(index.stats) if index is not None else 0,
+        'dim': int(index.vectors.shape[1]) if index is not None and index.vectors.ndim == 2 else 0,
+        'refreshing': _refreshing,
+        'last_error': _last_error,
+    }